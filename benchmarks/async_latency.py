@@ -0,0 +1,107 @@
+"""GET /api/photos 在并发登录/评论压力下的延迟。
+
+对一个已启动的后端（python app.py）运行：
+
+    python benchmarks/async_latency.py --base http://localhost:4002/api \
+        --username admin --password admin123 --photo-id 1 --duration 20
+
+一组线程持续请求 GET /api/photos 并记录延迟，另一组线程同时发起登录与评论。
+结果以 JSON 输出（p50/p90/p99/max，单位毫秒），便于对比改动前后的数据。
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+
+def _request(url, data=None, headers=None, method=None):
+    body = None
+    if data is not None:
+        body = urllib.parse.urlencode(data).encode()
+    req = urllib.request.Request(url, data=body, headers=headers or {}, method=method)
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return resp.status, resp.read()
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100.0 * (len(values) - 1)))))
+    return round(values[k] * 1000, 2)
+
+
+def _summary(latencies, errors):
+    return {
+        'count': len(latencies),
+        'errors': errors,
+        'p50_ms': _percentile(latencies, 50),
+        'p90_ms': _percentile(latencies, 90),
+        'p99_ms': _percentile(latencies, 99),
+        'max_ms': round(max(latencies) * 1000, 2) if latencies else None,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--base', default='http://localhost:4002/api')
+    ap.add_argument('--username', default='admin')
+    ap.add_argument('--password', default='admin123')
+    ap.add_argument('--photo-id', type=int, default=1)
+    ap.add_argument('--duration', type=float, default=20.0)
+    ap.add_argument('--readers', type=int, default=4)
+    ap.add_argument('--writers', type=int, default=8)
+    args = ap.parse_args()
+    base = args.base.rstrip('/')
+
+    _, raw = _request(f'{base}/auth/login', {'username': args.username, 'password': args.password})
+    token = json.loads(raw)['token']
+    auth = {'Authorization': f'Bearer {token}'}
+    _, raw = _request(f'{base}/csrf', headers=auth)
+    write_headers = dict(auth, **{'X-CSRF-Token': json.loads(raw)['token']})
+
+    stop = time.monotonic() + args.duration
+    lock = threading.Lock()
+    results = {'list_photos': ([], [0]), 'login': ([], [0]), 'comment': ([], [0])}
+
+    def record(name, fn):
+        t0 = time.perf_counter()
+        try:
+            fn()
+            ok = True
+        except Exception:
+            ok = False
+        dt = time.perf_counter() - t0
+        with lock:
+            if ok:
+                results[name][0].append(dt)
+            else:
+                results[name][1][0] += 1
+
+    def reader():
+        while time.monotonic() < stop:
+            record('list_photos', lambda: _request(f'{base}/photos?page=1&pageSize=30'))
+
+    def writer(i):
+        while time.monotonic() < stop:
+            if i % 2:
+                record('login', lambda: _request(f'{base}/auth/login', {'username': args.username, 'password': args.password}))
+            else:
+                record('comment', lambda: _request(f'{base}/photos/{args.photo_id}/comment', {'content': 'bench'}, headers=write_headers))
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    out = {name: _summary(lat, err[0]) for name, (lat, err) in results.items()}
+    out['config'] = {'readers': args.readers, 'writers': args.writers, 'duration_s': args.duration}
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""衍生图生成的单图耗时与峰值内存：旧流程（完整解码后两次 copy+thumbnail）对比
+python_server.imaging 的缩小解码 + 级联缩放。
+
+    python benchmarks/derivatives.py --size 6000x4000 --count 5
+
+每种实现在独立子进程中运行，峰值内存取子进程的 ru_maxrss；输出 JSON。
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def legacy_render(content):
+    img = Image.open(io.BytesIO(content))
+    img_copy = img.copy(); img_copy.thumbnail((2000, 2000))
+    buf_proc = io.BytesIO(); img_copy.save(buf_proc, format='WEBP', quality=80)
+    th = img.copy(); th.thumbnail((480, 480))
+    buf_th = io.BytesIO(); th.save(buf_th, format='WEBP', quality=70)
+    return [buf_proc.getvalue(), buf_th.getvalue()]
+
+
+def peak_rss_mb():
+    # ru_maxrss 在 Linux 上会继承父进程 fork 时的值，优先读 /proc 的 VmHWM
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_variant(variant, path, count):
+    from python_server import imaging
+    with open(path, 'rb') as f:
+        content = f.read()
+    base_rss = peak_rss_mb()
+    fn = legacy_render if variant == 'before' else (lambda c: imaging._render(c, imaging.PHOTO_SPECS))
+    times = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        fn(content)
+        times.append(time.perf_counter() - t0)
+    peak = peak_rss_mb()
+    print(json.dumps({
+        'ms_per_image': round(sum(times) / len(times) * 1000, 1),
+        'min_ms': round(min(times) * 1000, 1),
+        'peak_rss_mb': round(peak, 1),
+        'peak_rss_growth_mb': round(peak - base_rss, 1),
+    }))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size', default='6000x4000')
+    ap.add_argument('--count', type=int, default=5)
+    ap.add_argument('--variant', choices=['before', 'after'])
+    ap.add_argument('--input')
+    args = ap.parse_args()
+    if args.variant:
+        run_variant(args.variant, args.input, args.count)
+        return
+
+    sys.path.insert(0, os.path.dirname(__file__))
+    from imaging import make_jpeg
+    w, h = (int(x) for x in args.size.lower().split('x'))
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), f'.derivatives-{w}x{h}.jpg')
+    with open(path, 'wb') as f:
+        f.write(make_jpeg(w, h, 1))
+    result = {'size': args.size, 'count': args.count, 'jpeg_bytes': os.path.getsize(path)}
+    try:
+        for variant in ('before', 'after'):
+            raw = subprocess.check_output([sys.executable, __file__, '--variant', variant, '--input', path, '--count', str(args.count)])
+            result[variant] = json.loads(raw)
+    finally:
+        os.remove(path)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""基准测试用的内存对象存储：替换 python_server.main._r2_client，让 _r2_* 全部落到进程内字典。
+
+    import fake_r2  # benchmarks/ 目录下运行
+    store = fake_r2.install(server, latency_ms=5)
+
+只实现 main.py 用到的 Minio 方法（put_object / get_object / remove_object / remove_objects /
+stat_object / presigned_get_object）；latency_ms 为每次调用前的 sleep，用来模拟网络往返。
+"""
+import os
+import threading
+import time
+
+
+class _Object:
+    def __init__(self, data):
+        self._data = data
+        self.size = len(data)
+
+    def read(self, amt=None):
+        data, self._data = self._data, b''
+        return data
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class _DeleteError:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeMinio:
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.objects = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put_object(self, bucket, name, data, length, content_type=None, part_size=0):
+        self._wait()
+        body = data.read(length) if length >= 0 else data.read()
+        with self._lock:
+            self.objects[(bucket, name)] = bytes(body)
+
+    def get_object(self, bucket, name):
+        self._wait()
+        with self._lock:
+            data = self.objects.get((bucket, name))
+        if data is None:
+            raise KeyError(name)
+        return _Object(data)
+
+    def stat_object(self, bucket, name):
+        return self.get_object(bucket, name)
+
+    def remove_object(self, bucket, name):
+        self._wait()
+        with self._lock:
+            self.objects.pop((bucket, name), None)
+
+    def remove_objects(self, bucket, delete_objects):
+        self._wait()
+        with self._lock:
+            for obj in delete_objects:
+                self.objects.pop((bucket, obj._name), None)
+        return iter(())
+
+    def presigned_get_object(self, bucket, name, expires=None):
+        return f'http://r2.bench/{bucket}/{name}'
+
+    def stored_bytes(self):
+        with self._lock:
+            return sum(len(v) for v in self.objects.values())
+
+
+def install(server, latency_ms=0.0, bucket='bench'):
+    # R2_PUBLIC_BASE 让 _r2_url / _r2_key_from_url 走公开地址分支，不需要真实端点
+    os.environ['R2_PUBLIC_BASE'] = 'http://r2.bench'
+    os.environ['R2_BUCKET'] = bucket
+    os.environ.pop('R2_PUBLIC_NAME', None)
+    os.environ['R2_PUBLIC_PATH_HAS_BUCKET'] = 'true'
+    client = FakeMinio(latency_ms)
+    server._r2_client = lambda: (client, bucket)
+    return client
@@ -0,0 +1,124 @@
+"""/uploads 静态文件的每秒请求数：不加防盗链、旧的 BaseHTTPMiddleware 实现、
+python_server.hotlink 的纯 ASGI 预编译实现三者对比。
+
+    python benchmarks/hotlink.py --requests 5000 --size-kb 64 --referrers 20
+
+在进程内用 httpx.ASGITransport 直接驱动 Starlette 应用（不经过网络），
+ALLOWED_REFERRERS 中放 --referrers 条规则，请求带一个命中最后一条规则的 Referer；
+另外单独给出 Referer 匹配本身的每次耗时。输出 JSON。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount
+from starlette.staticfiles import StaticFiles
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from python_server import hotlink  # noqa: E402
+
+
+def legacy_allows(ref):
+    # 改造前 UploadsSecurityMiddleware 的判断逻辑：每次请求重新读取环境变量并逐条比较
+    allowed = ['http://localhost:5173', f"http://localhost:{os.getenv('PORT','4002')}"]
+    extra = os.getenv('ALLOWED_REFERRERS')
+    if extra:
+        allowed.extend([s.strip() for s in extra.split(',') if s.strip()])
+    ok = (ref == '')
+    if not ok and ref:
+        from urllib.parse import urlparse
+        host = urlparse(ref).hostname or ''
+        for a in allowed:
+            a = a.strip()
+            if a == '*':
+                return True
+            if a.startswith('*.') and host and host.endswith(a[2:]):
+                return True
+            if ref.startswith(a):
+                return True
+    return ok
+
+
+class LegacyMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        if request.url.path.startswith('/uploads/'):
+            if not legacy_allows(request.headers.get('referer', '')):
+                return JSONResponse({'error': 'hotlink forbidden'}, status_code=403)
+            resp = await call_next(request)
+            resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+            return resp
+        return await call_next(request)
+
+
+def build_app(root, variant):
+    app = Starlette(routes=[Mount('/uploads', StaticFiles(directory=root), name='uploads')])
+    if variant == 'legacy':
+        app.add_middleware(LegacyMiddleware)
+    elif variant == 'asgi':
+        app.add_middleware(hotlink.UploadsSecurityMiddleware)
+    return app
+
+
+async def drive(app, n, concurrency, referer):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with sem:
+                r = await client.get('/uploads/photo.webp', headers={'referer': referer})
+                assert r.status_code == 200, r.status_code
+
+        await one()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(n)))
+        return time.perf_counter() - t0
+
+
+def time_matcher(fn, ref, n=200000):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn(ref)
+    return (time.perf_counter() - t0) / n * 1e9
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--requests', type=int, default=5000)
+    ap.add_argument('--concurrency', type=int, default=32)
+    ap.add_argument('--size-kb', type=int, default=64)
+    ap.add_argument('--referrers', type=int, default=20)
+    args = ap.parse_args()
+
+    rules = [f'https://site{i}.example.org' for i in range(args.referrers - 1)] + ['*.cdn.example.com']
+    os.environ['ALLOWED_REFERRERS'] = ','.join(rules)
+    hotlink.refresh()
+    referer = 'https://img.cdn.example.com/gallery/42'
+
+    root = tempfile.mkdtemp(prefix='hotlink-bench-')
+    with open(os.path.join(root, 'photo.webp'), 'wb') as f:
+        f.write(os.urandom(args.size_kb * 1024))
+
+    result = {'requests': args.requests, 'concurrency': args.concurrency, 'size_kb': args.size_kb, 'referrers': args.referrers}
+    for variant in ('none', 'legacy', 'asgi'):
+        dt = asyncio.run(drive(build_app(root, variant), args.requests, args.concurrency, referer))
+        result[variant] = {'req_per_sec': round(args.requests / dt, 1)}
+    result['match_ns'] = {
+        'legacy': round(time_matcher(legacy_allows, referer), 1),
+        'asgi': round(time_matcher(hotlink.matcher().allows, referer), 1),
+    }
+    os.remove(os.path.join(root, 'photo.webp'))
+    os.rmdir(root)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
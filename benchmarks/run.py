@@ -0,0 +1,262 @@
+"""请求热路径的离线基准：在进程内驱动整个应用，输出每个场景的吞吐、p50/p99 延迟与峰值 RSS（JSON）。
+
+需要一个可写的本地 PostgreSQL（不要指向生产库），对象存储用 fake_r2 的内存实现代替：
+
+    DATABASE_URL=postgresql://localhost/bench python benchmarks/run.py --photos 5000 --out before.json
+    DATABASE_URL=postgresql://localhost/bench python benchmarks/run.py --photos 5000 --compare before.json
+
+场景：
+  - list_photos：首页（响应缓存）、cursor 翻页、旧分页、q / tag / category / photographer 各筛选
+  - photo_detail、toggle_like、toggle_favorite
+  - upload_photos：每次请求 --upload-files 张合成 JPEG（噪点 + 渐变，接近相机原图的压缩率）
+  - carousel：POST /api/admin/carousel（图片处理 + 两个对象写入），每次之后删除
+  - uploads_static：经过 UploadsSecurityMiddleware 的 /uploads 静态文件请求
+脚本会以 ADMIN_USERNAME（默认 admin）登录，首次运行时写入 --photos 条合成作品（description 为 bench-seed），
+上传与轮播场景产生的数据在结束时删除（--keep 保留）。峰值 RSS 是到该场景结束为止的进程峰值（只增不减），
+图片进程池的子进程另计在 children_peak_rss_mb。
+单独的专项基准仍在同目录下：async_latency.py、search.py、imaging.py、derivatives.py、upload_memory.py、hotlink.py、video_seek.py。
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import httpx
+from PIL import Image, ImageChops
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import fake_r2  # noqa: E402
+
+CATEGORIES = ['风光', '人像', '街拍', '建筑', '夜景', '旅行']
+TAGS = ['日落', '海边', '城市', '黑白', '胶片', '星空']
+WORDS = ['日落', '海边', '城市', '夜景', '人像', '山川', '街头', '古镇', 'sunset', 'street', 'film', 'travel']
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    return round(resource.getrusage(who).ru_maxrss / 1024.0, 1)
+
+
+def git_rev():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__), text=True).strip()
+    except Exception:
+        return None
+
+
+def make_jpeg(width, height, seed):
+    # 噪点叠加渐变：纯色图压缩率过高、纯噪点又过低，这样的体积接近真实照片
+    rnd = random.Random(seed)
+    noise = Image.effect_noise((width, height), 40 + rnd.randint(0, 20))
+    channels = []
+    for angle in (0, 90, rnd.randint(0, 359)):
+        grad = Image.linear_gradient('L').rotate(angle).resize((width, height))
+        channels.append(ImageChops.add(grad, noise, scale=1.6, offset=rnd.randint(-20, 20)))
+    buf = io.BytesIO()
+    Image.merge('RGB', channels).save(buf, 'JPEG', quality=90)
+    return buf.getvalue()
+
+
+def seed_photos(server, user_id, n):
+    # 合成作品直接按集合写入；已有的 bench-seed 行会复用
+    from python_server.db import get_conn, atomic
+    from python_server import tags as tagging
+    with get_conn() as conn, atomic(conn), conn.cursor() as cur:
+        cur.execute("SELECT id FROM photos WHERE description = 'bench-seed' ORDER BY id")
+        ids = [r['id'] for r in cur.fetchall()]
+        missing = n - len(ids)
+        if missing > 0:
+            cur.execute("""
+                INSERT INTO photos (user_id, title, description, category, original_url, image_url, thumb_url, size_bytes, created_at)
+                SELECT %s,
+                       (%s::text[])[1 + g %% cardinality(%s::text[])] || ' ' || (%s::text[])[1 + (g / 7) %% cardinality(%s::text[])] || ' ' || g,
+                       'bench-seed',
+                       (%s::text[])[1 + g %% cardinality(%s::text[])],
+                       'http://r2.bench/bench/originals/seed-' || g || '.jpg',
+                       'http://r2.bench/bench/processed/seed-' || g || '.webp',
+                       'http://r2.bench/bench/thumbs/seed-' || g || '_thumb.webp',
+                       2000000,
+                       LOCALTIMESTAMP - g * interval '1 minute'
+                FROM generate_series(1, %s) g
+                RETURNING id
+            """, (user_id, WORDS, WORDS, WORDS, WORDS, CATEGORIES, CATEGORIES, missing))
+            new_ids = [r['id'] for r in cur.fetchall()]
+            for i, name in enumerate(TAGS):
+                tagging.link(cur, new_ids[i::len(TAGS)], [name])
+            ids.extend(new_ids)
+    return ids
+
+
+async def measure(name, call, n, concurrency, ok=(200,)):
+    latencies = []
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            r = await call(i)
+            latencies.append(time.perf_counter() - t0)
+            if r.status_code not in ok:
+                errors += 1
+
+    await call(0)  # 预热
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    elapsed = time.perf_counter() - t0
+    result = {
+        'requests': n,
+        'errors': errors,
+        'req_per_sec': round(n / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    print(f'{name:<28} {result["req_per_sec"]:>9} req/s  p50 {result["p50_ms"]:>8} ms  p99 {result["p99_ms"]:>8} ms', file=sys.stderr)
+    return result
+
+
+async def run(args):
+    from python_server import main as server
+
+    store = fake_r2.install(server, args.r2_latency_ms)
+    rnd = random.Random(42)
+    result = {'rev': git_rev(), 'photos': args.photos, 'concurrency': args.concurrency, 'r2_latency_ms': args.r2_latency_ms, 'scenarios': {}}
+    scenarios = result['scenarios']
+    cleanup_photos = []
+    static_path = None
+
+    async with server.lifespan(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=300) as client:
+            username = os.getenv('ADMIN_USERNAME', 'admin')
+            r = await client.post('/api/auth/login', data={'username': username, 'password': os.getenv('ADMIN_PASSWORD', 'admin123')})
+            r.raise_for_status()
+            auth = {'authorization': f"Bearer {r.json()['token']}"}
+            csrf = (await client.get('/api/csrf', headers=auth)).json()['token']
+            headers = dict(auth, **{'x-csrf-token': csrf})
+            me = (await client.get('/api/users/me', headers=auth)).json()
+            ids = await asyncio.to_thread(seed_photos, server, me['id'], args.photos)
+            n = args.requests
+
+            def get(path, params=None, h=None):
+                return lambda i: client.get(path, params=params, headers=h)
+
+            first = (await client.get('/api/photos', params={'cursor': ''})).json()
+            lists = {
+                'list_photos:home': get('/api/photos'),
+                'list_photos:cursor': get('/api/photos', {'cursor': first.get('next_cursor') or ''}),
+                'list_photos:page': get('/api/photos', {'page': 5, 'pageSize': 20}),
+                'list_photos:q': get('/api/photos', {'q': '海边'}),
+                'list_photos:q_relevance': get('/api/photos', {'q': '日落', 'sort': 'relevance', 'cursor': ''}),
+                'list_photos:tag': get('/api/photos', {'tag': TAGS[0]}),
+                'list_photos:category': get('/api/photos', {'category': CATEGORIES[1]}),
+                'list_photos:photographer': get('/api/photos', {'photographer': username}),
+            }
+            for name, call in lists.items():
+                scenarios[name] = await measure(name, call, n, args.concurrency)
+
+            scenarios['photo_detail'] = await measure('photo_detail', lambda i: client.get(f'/api/photos/{rnd.choice(ids)}'), n, args.concurrency)
+            scenarios['toggle_like'] = await measure('toggle_like', lambda i: client.post(f'/api/photos/{rnd.choice(ids)}/like', headers=headers), n, args.concurrency)
+            scenarios['toggle_favorite'] = await measure('toggle_favorite', lambda i: client.post(f'/api/photos/{rnd.choice(ids)}/favorite', headers=headers), n, args.concurrency)
+
+            static_path = os.path.join(server.UPLOADS_ROOT, 'processed', f'bench-{os.getpid()}.webp')
+            with open(static_path, 'wb') as f:
+                f.write(os.urandom(args.static_kb * 1024))
+            static_url = f'/uploads/processed/{os.path.basename(static_path)}'
+            referer = {'referer': 'http://localhost:5173/photo/1'}
+            scenarios['uploads_static'] = await measure('uploads_static', lambda i: client.get(static_url, headers=referer), n, args.concurrency)
+
+            # 每个文件内容都不同，避免被内容哈希去重
+            # 预热也占一批；最后一张留给轮播场景
+            w, h = args.jpeg_size
+            upload_count = (args.upload_requests + 1) * args.upload_files
+            jpegs = await asyncio.to_thread(lambda: [make_jpeg(w, h, s) for s in range(upload_count + 1)])
+            result['jpeg_kb'] = round(sum(len(j) for j in jpegs) / len(jpegs) / 1024, 1)
+            batches = iter(range(0, upload_count, args.upload_files))
+
+            async def upload(i):
+                start = next(batches)
+                files = [('files', (f'bench-{start + k}.jpg', jpegs[start + k], 'image/jpeg')) for k in range(args.upload_files)]
+                r = await client.post('/api/photos', files=files, data={'title': 'bench-upload', 'tags': ','.join(TAGS[:2])}, headers=headers)
+                if r.status_code == 200:
+                    cleanup_photos.extend(it['id'] for it in r.json()['items'])
+                return r
+            scenarios['upload_photos'] = await measure('upload_photos', upload, args.upload_requests, args.upload_concurrency)
+
+            carousel_jpeg = jpegs[-1]
+
+            async def carousel(i):
+                r = await client.post('/api/admin/carousel', files={'file': ('bench.jpg', carousel_jpeg, 'image/jpeg')}, headers=headers)
+                if r.status_code == 200:
+                    await client.delete(f"/api/admin/carousel/{r.json()['id']}", headers=headers)
+                return r
+            scenarios['carousel'] = await measure('carousel', carousel, args.carousel_requests, 1)
+
+            if cleanup_photos and not args.keep:
+                await client.request('DELETE', '/api/photos', json={'ids': cleanup_photos}, headers=headers)
+    if static_path and os.path.exists(static_path):
+        os.remove(static_path)
+    result['peak_rss_mb'] = peak_rss_mb()
+    result['children_peak_rss_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    result['r2_calls'] = store.calls
+    return result
+
+
+def compare(current, baseline):
+    # 每个场景相对基线的变化（百分比，正数表示变好）
+    out = {}
+    for name, cur in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        out[name] = {
+            'req_per_sec': round((cur['req_per_sec'] / base['req_per_sec'] - 1) * 100, 1) if base['req_per_sec'] else None,
+            'p99_ms': round((1 - cur['p99_ms'] / base['p99_ms']) * 100, 1) if base['p99_ms'] else None,
+        }
+    return {'baseline_rev': baseline.get('rev'), 'change_pct': out}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--photos', type=int, default=5000)
+    ap.add_argument('--requests', type=int, default=500)
+    ap.add_argument('--concurrency', type=int, default=16)
+    ap.add_argument('--upload-requests', type=int, default=6)
+    ap.add_argument('--upload-files', type=int, default=4)
+    ap.add_argument('--upload-concurrency', type=int, default=2)
+    ap.add_argument('--carousel-requests', type=int, default=5)
+    ap.add_argument('--jpeg-size', type=int, nargs=2, default=(4000, 3000), metavar=('W', 'H'))
+    ap.add_argument('--static-kb', type=int, default=256)
+    ap.add_argument('--r2-latency-ms', type=float, default=0.0)
+    ap.add_argument('--keep', action='store_true')
+    ap.add_argument('--out')
+    ap.add_argument('--compare')
+    args = ap.parse_args()
+    if not os.getenv('DATABASE_URL'):
+        sys.exit('需要 DATABASE_URL（指向一个可写的本地测试库）')
+
+    result = asyncio.run(run(args))
+    if args.compare:
+        with open(args.compare) as f:
+            result['compare'] = compare(result, json.load(f))
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""搜索（GET /api/photos?q=）在大表上的耗时：顺序扫描 vs bigram GIN 索引。
+
+需要一个可写的 PostgreSQL（不要指向生产库）：
+
+    DATABASE_URL=postgresql://localhost/bench python benchmarks/search.py --rows 1000000
+
+脚本会创建 UNLOGGED 表 bench_search_photos 并写入合成的中文标题/描述，
+分别在建索引前后执行同一组查询，输出每个查询的中位耗时（毫秒）与命中行数（JSON）。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from python_server.db import SEARCH_GRAMS_FN, search_doc  # noqa: E402
+
+WORDS = ['日落', '海边', '城市', '夜景', '人像', '山川', '街头', '黑白', '花卉', '雪景',
+         '森林', '星空', '建筑', '旅行', '婚礼', '秋天', '春天', '湖泊', '草原', '古镇',
+         'sunset', 'portrait', 'street', 'film', 'travel']
+QUERIES = ['日落', '海边夜景', '古镇', '星空', 'street', '雪']
+
+
+def _timed(cur, sql, params, repeat):
+    times = []
+    rows = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        cur.execute(sql, params)
+        rows = len(cur.fetchall())
+        times.append(time.perf_counter() - t0)
+    return round(statistics.median(times) * 1000, 2), rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=1000000)
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--keep', action='store_true', help='保留测试表')
+    args = ap.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(SEARCH_GRAMS_FN)
+    cur.execute('DROP TABLE IF EXISTS bench_search_photos')
+    cur.execute('CREATE UNLOGGED TABLE bench_search_photos (id SERIAL PRIMARY KEY, title VARCHAR(255) NOT NULL, description TEXT)')
+    t0 = time.perf_counter()
+    cur.execute("""
+        INSERT INTO bench_search_photos (title, description)
+        SELECT w[1 + (random() * (n - 1))::int] || w[1 + (random() * (n - 1))::int] || ' ' || w[1 + (random() * (n - 1))::int],
+               (SELECT string_agg(w[1 + (random() * (n - 1))::int], '' ) FROM generate_series(1, 8 + g % 3))
+        FROM generate_series(1, %s) AS g, (SELECT %s::text[] AS w, %s AS n) v
+    """, (args.rows, WORDS, len(WORDS)))
+    cur.execute('ANALYZE bench_search_photos')
+    load_s = time.perf_counter() - t0
+
+    sql = """
+        SELECT id FROM bench_search_photos
+        WHERE {grams} (title ILIKE %s OR description ILIKE %s)
+        ORDER BY id DESC LIMIT 30
+    """
+    result = {'rows': args.rows, 'load_s': round(load_s, 2), 'queries': {}}
+    for q in QUERIES:
+        like = f'%{q}%'
+        plain = sql.format(grams='')
+        result['queries'][q] = {'seqscan_ms': _timed(cur, plain, (like, like), args.repeat)[0]}
+
+    t0 = time.perf_counter()
+    cur.execute(f'CREATE INDEX bench_search_grams ON bench_search_photos USING GIN (photo_search_grams({search_doc()}))')
+    cur.execute('ANALYZE bench_search_photos')
+    result['index_build_s'] = round(time.perf_counter() - t0, 2)
+
+    for q in QUERIES:
+        like = f'%{q}%'
+        if len(q) >= 2:
+            indexed = sql.format(grams=f'photo_search_grams({search_doc()}) @> photo_search_grams(%s) AND')
+            ms, rows = _timed(cur, indexed, (q, like, like), args.repeat)
+        else:
+            ms, rows = _timed(cur, sql.format(grams=''), (like, like), args.repeat)
+        result['queries'][q].update({'indexed_ms': ms, 'rows': rows})
+
+    if not args.keep:
+        cur.execute('DROP TABLE bench_search_photos')
+    conn.close()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""上传路径的内存占用：大文件（默认 2 GB 视频）经 _store_upload 写出时 RSS 不应随文件大小增长。
+
+    python benchmarks/upload_memory.py --size-mb 2048 --limit-mb 64
+
+构造一个与 FastAPI 相同的 UploadFile（SpooledTemporaryFile，超过 1 MB 落盘），
+调用 python_server.main._store_upload 写入（配置了 R2_* 时走分片上传，否则写到临时 uploads 目录），
+统计峰值 RSS 的增量；超过 --limit-mb 时以非零状态退出，可作为回归检查。
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size-mb', type=int, default=2048)
+    ap.add_argument('--limit-mb', type=int, default=64)
+    args = ap.parse_args()
+
+    from starlette.datastructures import Headers, UploadFile
+    from python_server import main as server
+
+    tmp = tempfile.mkdtemp(prefix='upload-mem-')
+    os.makedirs(os.path.join(tmp, 'videos'))
+    server.UPLOADS_ROOT = tmp
+
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    chunk = os.urandom(1024 * 1024)
+    for _ in range(args.size_mb):
+        spool.write(chunk)
+    spool.seek(0)
+    uf = UploadFile(spool, size=args.size_mb * 1024 * 1024, filename='big.mp4', headers=Headers({'content-type': 'video/mp4'}))
+
+    before = peak_rss_mb()
+    t0 = time.perf_counter()
+    url, in_r2, size, sha = server._store_upload('videos/bench-big.mp4', uf)
+    dt = time.perf_counter() - t0
+    growth = peak_rss_mb() - before
+
+    out = {
+        'size_mb': args.size_mb,
+        'in_r2': in_r2,
+        'seconds': round(dt, 2),
+        'mb_per_sec': round(args.size_mb / dt, 1) if dt else None,
+        'peak_rss_growth_mb': round(growth, 1),
+        'limit_mb': args.limit_mb,
+        'size_ok': size == args.size_mb * 1024 * 1024,
+        'sha256': sha,
+    }
+    print(json.dumps(out, indent=2))
+    try:
+        os.remove(os.path.join(tmp, 'videos', 'bench-big.mp4'))
+    except OSError:
+        pass
+    return 0 if growth <= args.limit_mb and out['size_ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""并发视频拖动：多个客户端同时对一个大 MP4 发随机 Range 请求，
+对比 Starlette StaticFiles 与 python_server.uploads.UploadsApp 的吞吐和延迟。
+
+    python benchmarks/video_seek.py --size-mb 200 --clients 32 --seeks 20 --chunk-kb 1024
+
+在进程内用 httpx.ASGITransport 驱动应用（不经过网络，也就用不到 sendfile，
+测的是 Range 解析与按块读取本身）；每个客户端先做一次条件请求（If-None-Match），
+再做 --seeks 次随机位置的 Range 请求。输出 JSON。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.staticfiles import StaticFiles
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from python_server.uploads import UploadsApp  # noqa: E402
+
+
+def build_app(root, variant):
+    server = StaticFiles(directory=root) if variant == 'staticfiles' else UploadsApp(root)
+    return Starlette(routes=[Mount('/uploads', server, name='uploads')])
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def drive(app, args, size):
+    transport = httpx.ASGITransport(app=app)
+    latencies = []
+    not_modified = 0
+    chunk = args.chunk_kb * 1024
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        first = await client.head('/uploads/video.mp4')
+        etag = first.headers.get('etag')
+
+        async def viewer(seed):
+            nonlocal not_modified
+            rnd = random.Random(seed)
+            r = await client.get('/uploads/video.mp4', headers={'if-none-match': etag, 'range': 'bytes=0-0'})
+            if r.status_code == 304:
+                not_modified += 1
+            for _ in range(args.seeks):
+                start = rnd.randrange(0, size - chunk)
+                t0 = time.perf_counter()
+                r = await client.get('/uploads/video.mp4', headers={'range': f'bytes={start}-{start + chunk - 1}'})
+                latencies.append(time.perf_counter() - t0)
+                assert r.status_code == 206 and len(r.content) == chunk, (r.status_code, len(r.content))
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(viewer(i) for i in range(args.clients)))
+        elapsed = time.perf_counter() - t0
+    n = len(latencies)
+    return {
+        'seeks_per_sec': round(n / elapsed, 1),
+        'mb_per_sec': round(n * chunk / elapsed / 1024 / 1024, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'conditional_304': not_modified,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size-mb', type=int, default=200)
+    ap.add_argument('--clients', type=int, default=32)
+    ap.add_argument('--seeks', type=int, default=20)
+    ap.add_argument('--chunk-kb', type=int, default=1024)
+    args = ap.parse_args()
+
+    root = tempfile.mkdtemp(prefix='video-seek-')
+    path = os.path.join(root, 'video.mp4')
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(args.size_mb):
+            f.write(block)
+    size = os.path.getsize(path)
+
+    result = {'size_mb': args.size_mb, 'clients': args.clients, 'seeks_per_client': args.seeks, 'chunk_kb': args.chunk_kb}
+    try:
+        for variant in ('staticfiles', 'uploads'):
+            result[variant] = asyncio.run(drive(build_app(root, variant), args, size))
+    finally:
+        os.remove(path)
+        os.rmdir(root)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -60,6 +60,8 @@ export default function Detail(){
         <div className="viewer-stage">
           <img
             src={data.image_url}
+            srcSet={data.srcset || undefined}
+            sizes="(max-width:768px) 100vw, 60vw"
             alt={data.title}
             className="viewer-img"
             style={{ transform: `scale(${scale})` }}
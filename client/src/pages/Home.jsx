@@ -18,6 +18,7 @@ export default function Home() {
   const location = useLocation()
   const [error, setError] = useState('')
   const [page, setPage] = useState(1)
+  const [cursor, setCursor] = useState(null)
   const [hasMore, setHasMore] = useState(true)
   const [fillLogs, setFillLogs] = useState([])
   const gridRef = useRef(null)
@@ -29,15 +30,17 @@ export default function Home() {
     const pageSize = 30
     const nextPage = reset ? 1 : page
     try {
-      const { data } = await api.get('/photos', { params: { q, category, tag, page: nextPage, pageSize } })
+      const { data } = await api.get('/photos', { params: { q, category, tag, pageSize, cursor: reset ? '' : (cursor || '') } })
+      const list = Array.isArray(data?.items) ? data.items : []
       if (reset) {
-        setItems(Array.isArray(data) ? data : [])
+        setItems(list)
         setPage(2)
       } else {
-        setItems(prev => prev.concat(Array.isArray(data) ? data : []))
+        setItems(prev => prev.concat(list))
         setPage(nextPage + 1)
       }
-      setHasMore(Array.isArray(data) ? data.length >= pageSize : false)
+      setCursor(data?.next_cursor || null)
+      setHasMore(Boolean(data?.next_cursor))
     } catch (e) {
       setError('作品加载失败')
     } finally {
@@ -305,7 +308,7 @@ export default function Home() {
                 <div className="photo-card">
                   <img
                     src={it.thumb_url || it.image_url}
-                    srcSet={`${(it.thumb_url || it.image_url) ?? ''} 480w, ${(it.image_url || it.thumb_url) ?? ''} 2000w`}
+                    srcSet={it.srcset || `${(it.thumb_url || it.image_url) ?? ''} 480w, ${(it.image_url || it.thumb_url) ?? ''} 2000w`}
                     sizes="(max-width:480px) 100vw, (max-width:768px) 50vw, 33vw"
                     loading="lazy"
                     alt={it.title}
@@ -1 +1 @@
-__all__ = ['db', 'main', 'seed']
\ No newline at end of file
+__all__ = ['adb', 'cache', 'db', 'hotlink', 'imaging', 'jobs', 'main', 'manage', 'metrics', 'migrations', 'seed', 'tags', 'uploads', 'variants']
\ No newline at end of file
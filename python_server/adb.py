@@ -0,0 +1,74 @@
+import os
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from .db import get_conn, atomic
+
+# async 端点的数据库访问：阻塞的 psycopg2 调用放到独立线程池执行，避免卡住事件循环。
+# 线程数默认与连接池上限一致，排队发生在这里而不是在连接池里。
+_executor = None
+_in_flight = 0
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        workers = int(os.getenv('DB_ASYNC_WORKERS') or os.getenv('DB_POOL_MAX', '10'))
+        _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='adb')
+    return _executor
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = None
+
+def _with_cursor(fn, args, kwargs):
+    with get_conn() as conn, conn.cursor() as cur:
+        return fn(cur, *args, **kwargs)
+
+def _in_transaction(fn, args, kwargs):
+    with get_conn() as conn, atomic(conn), conn.cursor() as cur:
+        return fn(cur, *args, **kwargs)
+
+def stats():
+    return {'workers': _executor._max_workers if _executor else 0, 'in_flight': _in_flight}
+
+async def run(fn, *args, **kwargs):
+    global _in_flight
+    loop = asyncio.get_running_loop()
+    # run_in_executor 不会带上 contextvars，这里复制一份（请求级的 SQL 统计靠它归到当前请求）
+    ctx = contextvars.copy_context()
+    _in_flight += 1
+    try:
+        return await loop.run_in_executor(_get_executor(), functools.partial(ctx.run, fn, *args, **kwargs))
+    finally:
+        _in_flight -= 1
+
+async def run_with_cursor(fn, *args, **kwargs):
+    return await run(_with_cursor, fn, args, kwargs)
+
+async def run_in_transaction(fn, *args, **kwargs):
+    # fn 里的多条语句在同一个事务里提交，抛异常时整体回滚
+    return await run(_in_transaction, fn, args, kwargs)
+
+def _fetchone(cur, sql, params):
+    cur.execute(sql, params)
+    return cur.fetchone()
+
+def _fetchall(cur, sql, params):
+    cur.execute(sql, params)
+    return cur.fetchall()
+
+def _execute(cur, sql, params):
+    cur.execute(sql, params)
+    return cur.rowcount
+
+async def fetchone(sql, params=None):
+    return await run_with_cursor(_fetchone, sql, params)
+
+async def fetchall(sql, params=None):
+    return await run_with_cursor(_fetchall, sql, params)
+
+async def execute(sql, params=None):
+    return await run_with_cursor(_execute, sql, params)
@@ -0,0 +1,74 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 公开只读接口的进程内响应缓存：按 (命名空间, 键) 存放序列化好的响应体和 ETag，
+# 过期时间 RESPONSE_CACHE_TTL 秒、条目上限 RESPONSE_CACHE_MAX_ENTRIES；
+# 写接口按命名空间精确失效。每个命名空间带一个版本号，失效前开始构建的结果不会再写回缓存。
+class ResponseCache:
+    def __init__(self, ttl: float = None, max_entries: int = None):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ttl(self):
+        if self._ttl is None:
+            return float(os.getenv('RESPONSE_CACHE_TTL', '30'))
+        return self._ttl
+
+    @property
+    def max_entries(self):
+        if self._max_entries is None:
+            return int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '256'))
+        return self._max_entries
+
+    def get_or_build(self, namespace: str, key, build):
+        # build() 返回响应体字节；返回 (body, etag)
+        full_key = (namespace, key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+            gen = (self._epoch, self._generations.get(namespace, 0))
+        body = build()
+        etag = 'W/"%s"' % hashlib.sha1(body).hexdigest()[:20]
+        ttl = self.ttl
+        if ttl <= 0:
+            return body, etag
+        with self._lock:
+            if (self._epoch, self._generations.get(namespace, 0)) == gen:
+                self._entries[full_key] = (time.monotonic() + ttl, body, etag)
+                self._entries.move_to_end(full_key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return body, etag
+
+    def invalidate(self, *namespaces):
+        # 不传命名空间时清空全部
+        with self._lock:
+            if not namespaces:
+                self._epoch += 1
+                self._entries.clear()
+                return
+            for ns in namespaces:
+                self._generations[ns] = self._generations.get(ns, 0) + 1
+            for k in [k for k in self._entries if k[0] in namespaces]:
+                del self._entries[k]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+responses = ResponseCache()
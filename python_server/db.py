@@ -1,19 +1,143 @@
 import os
+import re
+import random
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extras import RealDictCursor
+from . import metrics
 
 pool = None
 
+slow_log = logging.getLogger('python_server.db.slow')
+
+# 慢查询日志与查询预算：
+#   - SLOW_QUERY_MS（默认 200，0 关闭）以上的语句按 归一化 SQL + 路由 记录到 python_server.db.slow；
+#     SLOW_QUERY_EXPLAIN_RATE（0~1，默认 0）按比例对慢 SELECT 再跑一次 EXPLAIN (ANALYZE, BUFFERS) 附在日志里
+#   - 每条归一化 SQL 的次数/总耗时/最大耗时按路由累计，最多 QUERY_STATS_MAX 条（默认 500），见 query_stats()
+#   - 端点用 @query_budget(n) 声明语句数上限（未声明的用 QUERY_BUDGET_DEFAULT，0 表示不限）；
+#     QUERY_BUDGET_MODE=raise 时超出直接抛 QueryBudgetExceeded（开发/测试用），warn 时只记日志，默认 off
+# 这些设置在 init_pool 时读取一次（与连接池参数一样），执行语句的热路径上不再查环境变量
+class _QuerySettings:
+    __slots__ = ('slow_ms', 'explain_rate', 'stats_max', 'budget_mode', 'budget_default')
+
+    def __init__(self):
+        self.load()
+
+    def load(self):
+        self.slow_ms = float(os.getenv('SLOW_QUERY_MS', '200'))
+        self.explain_rate = float(os.getenv('SLOW_QUERY_EXPLAIN_RATE', '0'))
+        self.stats_max = int(os.getenv('QUERY_STATS_MAX', '500'))
+        mode = os.getenv('QUERY_BUDGET_MODE', 'off').lower()
+        self.budget_mode = mode if mode in ('raise', 'warn') else None
+        self.budget_default = int(os.getenv('QUERY_BUDGET_DEFAULT', '0'))
+
+settings = _QuerySettings()
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+def query_budget(n: int):
+    def mark(fn):
+        fn.query_budget = n
+        return fn
+    return mark
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s|%\(\w+\)s")
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACES = re.compile(r'\s+')
+
+def normalize_sql(query: str):
+    # 去掉字面量与参数占位符，合并空白和 IN (?, ?, ...) 列表，同一形状的语句归为一条
+    q = _LITERAL.sub('?', query)
+    q = _IN_LIST.sub('(?)', q)
+    return _SPACES.sub(' ', q).strip()
+
+_stats_lock = threading.Lock()
+_query_stats = OrderedDict()
+
+def _record_stats(sql: str, route: str, elapsed: float):
+    key = (sql, route)
+    with _stats_lock:
+        entry = _query_stats.get(key)
+        if entry is None:
+            entry = _query_stats[key] = [0, 0.0, 0.0]
+            while len(_query_stats) > settings.stats_max:
+                _query_stats.popitem(last=False)
+        else:
+            _query_stats.move_to_end(key)
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+
+def query_stats(limit: int = 50):
+    # 按总耗时排序的归一化 SQL 统计
+    with _stats_lock:
+        items = [(k, list(v)) for k, v in _query_stats.items()]
+    items.sort(key=lambda kv: kv[1][1], reverse=True)
+    return [
+        {'sql': sql, 'route': route, 'calls': n, 'total_ms': round(total * 1000, 3), 'max_ms': round(peak * 1000, 3)}
+        for (sql, route), (n, total, peak) in items[:limit]
+    ]
+
+def reset_query_stats():
+    with _stats_lock:
+        _query_stats.clear()
+
+def _check_budget(req):
+    mode = settings.budget_mode
+    if mode is None:
+        return
+    budget = getattr(req.endpoint, 'query_budget', None)
+    if budget is None:
+        budget = settings.budget_default
+    if not budget or req.queries < budget:
+        return
+    if mode == 'raise':
+        raise QueryBudgetExceeded(f'{req.route}: more than {budget} queries')
+    if not req.over_budget:
+        req.over_budget = True
+        slow_log.warning('query budget exceeded route=%s budget=%d', req.route, budget)
+
 class PostgresCursor(RealDictCursor):
     def execute(self, query, vars=None):
         # Handle INSERT to return id for lastrowid simulation
         if query.strip().upper().startswith('INSERT') and 'RETURNING' not in query.upper():
              query = query + " RETURNING id"
         
+        req = metrics.current_request()
+        if req is not None:
+            _check_budget(req)
+        t0 = time.perf_counter()
         try:
             super().execute(query, vars)
         except Exception as e:
+            metrics.record_query(query, time.perf_counter() - t0, failed=True)
             raise e
+        elapsed = time.perf_counter() - t0
+        metrics.record_query(query, elapsed)
+        route = req.route if req is not None else 'background'
+        sql = normalize_sql(query)
+        _record_stats(sql, route, elapsed)
+        threshold = settings.slow_ms
+        if threshold > 0 and elapsed * 1000 >= threshold:
+            self._log_slow(query, vars, sql, route, elapsed)
+
+    def _log_slow(self, query, vars, sql, route, elapsed):
+        plan = None
+        rate = settings.explain_rate
+        # EXPLAIN ANALYZE 会真正执行语句，只对 SELECT 做；事务中出错会中止整个事务，所以只在自动提交时做
+        if rate > 0 and metrics.statement_type(query) == 'select' and ' for update' not in sql.lower() \
+                and self.connection.autocommit and random.random() < rate:
+            plan = _explain(self.connection, query, vars)
+        if plan:
+            slow_log.warning('slow query %.1fms route=%s sql=%s\n%s', elapsed * 1000, route, sql, plan)
+        else:
+            slow_log.warning('slow query %.1fms route=%s sql=%s', elapsed * 1000, route, sql)
             
     @property
     def lastrowid(self):
@@ -28,28 +152,319 @@ class PostgresCursor(RealDictCursor):
              return 0
         return 0
 
+def _explain(conn, query, vars):
+    # 用普通游标执行，不经过 PostgresCursor，不计入统计也不会递归记录
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + query, vars)
+            return '\n'.join(r[0] for r in cur.fetchall())
+    except Exception as e:
+        return f'EXPLAIN failed: {e}'
+
+class PoolTimeout(RuntimeError):
+    pass
+
+class ConnectionPool:
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=10.0, ping_after=30.0):
+        self.dsn = dsn
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        for _ in range(self.minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=PostgresCursor)
+        conn.autocommit = True
+        self._created += 1
+        return conn
+
+    def _healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            return False
+        if self.ping_after and time.monotonic() - idle_since >= self.ping_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+            except Exception:
+                return False
+        return True
+
+    def _discard(self, conn):
+        self._discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self):
+        started = None
+        with self._cond:
+            while not self._idle and self._in_use >= self.maxconn:
+                if started is None:
+                    started = time.monotonic()
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout('DB pool exhausted')
+                self._cond.wait(remaining)
+            self._in_use += 1
+            item = self._idle.pop() if self._idle else None
+            self._record_wait(started)
+        if item is not None:
+            conn, idle_since = item
+            if self._healthy(conn, idle_since):
+                return conn
+            self._discard(conn)
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def _record_wait(self, started):
+        if started is None:
+            return
+        waited = time.monotonic() - started
+        self._waits += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def putconn(self, conn):
+        keep = not conn.closed
+        if keep and conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                keep = False
+        if keep and not conn.autocommit:
+            try:
+                conn.autocommit = True
+            except Exception:
+                keep = False
+        with self._cond:
+            self._in_use -= 1
+            if keep and len(self._idle) + self._in_use < self.maxconn:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+        if conn is not None:
+            self._discard(conn)
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'min': self.minconn,
+                'max': self.maxconn,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'created': self._created,
+                'discarded': self._discarded,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_total, 6),
+                'wait_time_max': round(self._wait_max, 6),
+                'timeouts': self._timeouts,
+            }
+
+class PooledConnection:
+    # 代理真实连接：close() 与 with 语句结束时归还到连接池，而不是断开
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise RuntimeError('connection already returned to pool')
+        return getattr(conn, name)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.putconn(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
 def init_pool():
     global pool
     if pool:
         return
-    
+    settings.load()
+
     db_url = os.getenv('DATABASE_URL')
     if not db_url:
         raise RuntimeError('DATABASE_URL environment variable not set')
-        
-    pool = db_url
+
+    pool = ConnectionPool(
+        db_url,
+        minconn=int(os.getenv('DB_POOL_MIN', '1')),
+        maxconn=int(os.getenv('DB_POOL_MAX', '10')),
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', '10')),
+        ping_after=float(os.getenv('DB_POOL_PING_AFTER', '30')),
+    )
+
+def close_pool():
+    global pool
+    if pool:
+        pool.closeall()
+    pool = None
 
 def get_conn():
     if not pool:
         raise RuntimeError('DB pool not initialized')
     
-    conn = psycopg2.connect(pool, cursor_factory=PostgresCursor)
-    conn.autocommit = True
-    return conn
+    return PooledConnection(pool, pool.getconn())
+
+def pool_stats():
+    if not pool:
+        return None
+    return pool.stats()
+
+@contextmanager
+def atomic(conn):
+    # 连接默认 autocommit；块内的语句放进同一个事务，异常时回滚
+    raw = conn._conn if isinstance(conn, PooledConnection) else conn
+    raw.autocommit = False
+    try:
+        yield conn
+        raw.commit()
+    except BaseException:
+        raw.rollback()
+        raise
+    finally:
+        raw.autocommit = True
+
+# 搜索用的二元组（bigram）切分：中文标题/描述没有空格分词，tsvector 不适用，
+# 这里把文本切成相邻两个字符的集合，配合 GIN 表达式索引做 @> 包含查询，
+# 查询端再用 ILIKE 复核，保证结果与子串匹配一致
+SEARCH_GRAMS_FN = r"""
+CREATE OR REPLACE FUNCTION photo_search_grams(doc text) RETURNS text[]
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+  SELECT COALESCE(array_agg(DISTINCT g), '{}')
+  FROM (
+    SELECT substr(s.d, i, 2) AS g
+    FROM (SELECT lower(COALESCE(doc, '')) AS d) s,
+         generate_series(1, char_length(s.d) - 1) AS i
+  ) x
+  WHERE g !~ '\s'
+$$
+"""
+
+SEARCH_DOC_SQL = "{p}title || ' ' || COALESCE({p}description, '')"
+
+def search_doc(prefix=''):
+    return SEARCH_DOC_SQL.format(p=prefix)
+
+def reconcile_counters(cur):
+    # 按 likes/favorites 实际行数校正 photos 上的冗余计数，返回被修正的作品数
+    cur.execute("""
+        UPDATE photos p
+        SET like_count = c.likes, favorite_count = c.favorites, version = p.version + 1
+        FROM (
+            SELECT ph.id,
+                   COALESCE(l.c, 0) AS likes,
+                   COALESCE(f.c, 0) AS favorites
+            FROM photos ph
+            LEFT JOIN (SELECT photo_id, COUNT(*) AS c FROM likes GROUP BY photo_id) l ON l.photo_id = ph.id
+            LEFT JOIN (SELECT photo_id, COUNT(*) AS c FROM favorites GROUP BY photo_id) f ON f.photo_id = ph.id
+        ) c
+        WHERE p.id = c.id AND (p.like_count <> c.likes OR p.favorite_count <> c.favorites)
+    """)
+    return cur.rowcount
+
+# 上传量台账：每个用户按自然日、自然月各一行，配额检查只需按主键读取
+UPLOAD_USAGE_BUCKETS = "LATERAL (VALUES ('day', {ts}::date), ('month', date_trunc('month', {ts})::date)) AS b(period, bucket)"
+
+def add_upload_usage(cur, user_id, nbytes, files=1, at=None):
+    # 与作品写入放在同一事务里调用；删除时传负数并带上作品的 created_at。返回当前日/月用量
+    cur.execute(f"""
+        INSERT INTO upload_usage (user_id, period, bucket, bytes, files)
+        SELECT %s, b.period, b.bucket, GREATEST(%s, 0), GREATEST(%s, 0)
+        FROM (SELECT COALESCE(%s::timestamp, LOCALTIMESTAMP) AS ts) t
+        CROSS JOIN {UPLOAD_USAGE_BUCKETS.format(ts='t.ts')}
+        WHERE true
+        ON CONFLICT (user_id, period, bucket) DO UPDATE
+        SET bytes = GREATEST(upload_usage.bytes + %s, 0), files = GREATEST(upload_usage.files + %s, 0)
+        RETURNING period, bytes
+    """, (user_id, nbytes, files, at, nbytes, files))
+    return {r['period']: int(r['bytes']) for r in cur.fetchall()}
+
+def subtract_upload_usage(cur, rows):
+    # 批量删除作品时一次性扣回：rows 为 [(user_id, created_at, size_bytes)]，按用户与日/月桶汇总后一条 UPDATE
+    rows = list(rows)
+    if not rows:
+        return
+    cur.execute(f"""
+        UPDATE upload_usage u
+        SET bytes = GREATEST(u.bytes - d.bytes, 0), files = GREATEST(u.files - d.files, 0)
+        FROM (
+            SELECT x.user_id, b.period, b.bucket, SUM(x.bytes) AS bytes, COUNT(*) AS files
+            FROM unnest(%s::int[], %s::timestamp[], %s::bigint[]) AS x(user_id, ts, bytes)
+            CROSS JOIN {UPLOAD_USAGE_BUCKETS.format(ts='COALESCE(x.ts, LOCALTIMESTAMP)')}
+            GROUP BY x.user_id, b.period, b.bucket
+        ) d
+        WHERE u.user_id = d.user_id AND u.period = d.period AND u.bucket = d.bucket
+    """, ([r[0] for r in rows], [r[1] for r in rows], [int(r[2] or 0) for r in rows]))
+
+def get_upload_usage(cur, user_id):
+    cur.execute(f"""
+        SELECT b.period, COALESCE(u.bytes, 0) AS bytes, COALESCE(u.files, 0) AS files
+        FROM (SELECT LOCALTIMESTAMP AS ts) t
+        CROSS JOIN {UPLOAD_USAGE_BUCKETS.format(ts='t.ts')}
+        LEFT JOIN upload_usage u ON u.user_id = %s AND u.period = b.period AND u.bucket = b.bucket
+    """, (user_id,))
+    rows = cur.fetchall()
+    usage = {r['period']: int(r['bytes']) for r in rows}
+    usage.update({f"{r['period']}_files": int(r['files']) for r in rows})
+    return usage
+
+def rebuild_upload_usage(cur):
+    # 按 photos 重新生成台账，返回写入的行数
+    cur.execute('DELETE FROM upload_usage')
+    cur.execute(f"""
+        INSERT INTO upload_usage (user_id, period, bucket, bytes, files)
+        SELECT p.user_id, b.period, b.bucket, SUM(COALESCE(p.size_bytes, 0)), COUNT(*)
+        FROM photos p
+        CROSS JOIN {UPLOAD_USAGE_BUCKETS.format(ts='p.created_at')}
+        WHERE p.created_at IS NOT NULL
+        GROUP BY p.user_id, b.period, b.bucket
+        RETURNING user_id
+    """)
+    return cur.rowcount
 
 def init_schema():
-    conn = get_conn()
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         # Postgres Schema
         cur.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -158,4 +573,21 @@ def init_schema():
         """)
         cur.execute("CREATE INDEX IF NOT EXISTS idx_photo_edits_photo_id ON photo_edits (photo_id)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_photo_edits_user_id ON photo_edits (user_id)")
-    conn.close()
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id SERIAL PRIMARY KEY,
+            kind VARCHAR(32) NOT NULL,
+            photo_id INT,
+            payload TEXT,
+            status VARCHAR(16) NOT NULL DEFAULT 'queued' CHECK (status IN ('queued','running','done','failed')),
+            attempts INT NOT NULL DEFAULT 0,
+            error TEXT,
+            run_after TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            locked_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queued ON jobs (id) WHERE status = 'queued'")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_photo_id ON jobs (photo_id)")
@@ -0,0 +1,164 @@
+import os
+import json
+from urllib.parse import urlsplit
+
+# /uploads/ 防盗链：允许的来源在配置变化时预编译成
+#   - origins：精确匹配的 scheme://host[:port] 集合
+#   - prefixes：带路径的条目，以及主机名不完整的裸前缀（如 http://192.168.、http://10.，用于放行局域网），
+#     按 Referer 字符串前缀匹配
+#   - suffixes：*.example.com / https://*.example.com 形式，按主机名后缀匹配（example.com 本身也算），
+#     带协议时还要求协议一致
+# 请求路径上只做一次 urlsplit 加集合/元组查找，不再逐条遍历环境变量
+CACHE_CONTROL = b'public, max-age=31536000, immutable'
+
+def _origin(url: str):
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return None
+    if not parts.scheme or not parts.netloc:
+        return None
+    return f'{parts.scheme.lower()}://{parts.netloc.lower()}'
+
+def _complete_host(origin: str):
+    # http://192.168. 这类以 . 或 : 结尾的主机名只是前缀，不能当作完整来源精确匹配
+    return not origin.endswith(('.', ':'))
+
+class ReferrerMatcher:
+    def __init__(self, entries):
+        self.allow_all = False
+        origins = set()
+        hosts = set()
+        prefixes = []
+        suffixes = []
+        for a in entries:
+            a = (a or '').strip()
+            if not a:
+                continue
+            if a == '*':
+                self.allow_all = True
+            elif a.startswith('*.') or '://*.' in a:
+                # *.example.com 不限协议；https://*.example.com 只放行该协议
+                scheme, _, pattern = a.rpartition('://')
+                suf = pattern[2:].split('/', 1)[0].lower().rstrip('.')
+                suffixes.append((scheme.lower(), '.' + suf))
+                hosts.add((scheme.lower(), suf))
+            else:
+                origin = _origin(a)
+                if origin and origin == a.rstrip('/').lower() and _complete_host(origin):
+                    origins.add(origin)
+                else:
+                    prefixes.append(a)
+        self.origins = frozenset(origins)
+        self.prefixes = tuple(prefixes)
+        self.suffixes = tuple(suffixes)
+        self.hosts = frozenset(hosts)
+
+    def allows(self, ref: str):
+        if not ref or self.allow_all:
+            return True
+        if self.prefixes and ref.startswith(self.prefixes):
+            return True
+        try:
+            parts = urlsplit(ref)
+        except ValueError:
+            return False
+        if parts.scheme and parts.netloc and f'{parts.scheme.lower()}://{parts.netloc.lower()}' in self.origins:
+            return True
+        if self.suffixes:
+            host = (parts.hostname or '').rstrip('.')
+            scheme = parts.scheme.lower()
+            if host:
+                for s, suf in self.suffixes:
+                    if (not s or s == scheme) and host.endswith(suf):
+                        return True
+                if (scheme, host) in self.hosts or ('', host) in self.hosts:
+                    return True
+        return False
+
+def configured_entries():
+    allowed = [
+        'http://localhost:5173',
+        f"http://localhost:{os.getenv('PORT', '4002')}",
+    ]
+    extra = os.getenv('ALLOWED_REFERRERS')
+    if extra:
+        allowed.extend(s.strip() for s in extra.split(',') if s.strip())
+    return allowed
+
+_matcher = None
+
+def matcher():
+    global _matcher
+    if _matcher is None:
+        _matcher = ReferrerMatcher(configured_entries())
+    return _matcher
+
+def refresh():
+    # ALLOWED_REFERRERS / PORT 变化后调用（add_allowed_referrer、set_asset_base）
+    global _matcher
+    _matcher = ReferrerMatcher(configured_entries())
+    return _matcher
+
+_FORBIDDEN = json.dumps({'error': 'hotlink forbidden'}).encode('utf-8')
+
+class UploadsSecurityMiddleware:
+    # 纯 ASGI 中间件：不经过 BaseHTTPMiddleware，响应体直接流式透传
+    def __init__(self, app, prefix: str = '/uploads/'):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+        ref = ''
+        for k, v in scope['headers']:
+            if k == b'referer':
+                ref = v.decode('latin-1')
+                break
+        if not matcher().allows(ref):
+            await send({
+                'type': 'http.response.start',
+                'status': 403,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(_FORBIDDEN)).encode())],
+            })
+            await send({'type': 'http.response.body', 'body': _FORBIDDEN})
+            return
+
+        async def send_with_cache_control(message):
+            if message['type'] == 'http.response.start':
+                headers = [(k, v) for k, v in message.get('headers', []) if k.lower() != b'cache-control']
+                headers.append((b'cache-control', CACHE_CONTROL))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cache_control)
+
+# 随仓库提供的默认白名单（.env.local / app.py 的 default_env）应满足的行为：
+#     python -m python_server.hotlink
+DEFAULT_ALLOWED = 'http://localhost:5173, http://localhost:4002, http://192.168., http://10., http://172., https://*.ngrok-free.app, https://*.ngrok-free.dev, https://*.ngrok.io'
+DEFAULT_CASES = [
+    ('', True),
+    ('http://localhost:5173/photo/1', True),
+    ('http://localhost:4002/', True),
+    ('http://192.168.1.5:5173/x', True),
+    ('http://10.0.0.2/', True),
+    ('http://172.16.0.8:4002/gallery', True),
+    ('https://abc.ngrok-free.app/', True),
+    ('https://ngrok.io/', True),
+    ('http://localhost:40021/', False),
+    ('https://evil.example.com/', False),
+    ('https://badngrok.io/', False),
+    ('http://abc.ngrok-free.app/', False),
+]
+
+def check_defaults():
+    m = ReferrerMatcher(s.strip() for s in DEFAULT_ALLOWED.split(','))
+    return [(ref, expected) for ref, expected in DEFAULT_CASES if m.allows(ref) != expected]
+
+if __name__ == '__main__':
+    failed = check_defaults()
+    for ref, expected in failed:
+        print(f'{ref!r}: expected {"allowed" if expected else "forbidden"}')
+    raise SystemExit(1 if failed else 0)
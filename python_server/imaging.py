@@ -0,0 +1,164 @@
+import io
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+from . import metrics
+
+# 图片处理引擎：Pillow 的缩放与 WEBP 编码在进程池里执行，多文件上传可以用满多核。
+# spec 为 (最大宽, 最大高, 格式, 质量)，render 返回与 specs 一一对应的编码后字节。
+PHOTO_SPECS = [(2000, 2000, 'WEBP', 80), (480, 480, 'WEBP', 70)]
+CAROUSEL_SPECS = [(2560, 1600, 'WEBP', 85), (480, 480, 'WEBP', 75)]
+
+class ImageQueueFull(RuntimeError):
+    pass
+
+_lock = threading.Lock()
+_executor = None
+_slots = None
+
+def _to_output_mode(img, fmt=None):
+    if fmt == 'JPEG':
+        # JPEG 不支持透明通道：铺到白底上再存
+        if img.mode == 'RGB':
+            return img
+        if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+            rgba = img.convert('RGBA')
+            flat = Image.new('RGB', rgba.size, (255, 255, 255))
+            flat.paste(rgba, mask=rgba.getchannel('A'))
+            return flat
+        return img.convert('RGB')
+    if img.mode in ('RGB', 'RGBA'):
+        return img
+    return img.convert('RGBA' if img.mode in ('LA', 'PA') or 'transparency' in img.info else 'RGB')
+
+def _render(content: bytes, specs, timings=None):
+    # 按尺寸从大到小处理：最大的衍生图直接在未解码的图片上 thumbnail，
+    # JPEG 会走 draft 按 1/2、1/4、1/8 缩小解码，其他格式用 reduce() 先整数倍缩小，
+    # 不再解码出完整分辨率的位图；较小的衍生图从上一级结果继续缩放
+    # timings 不为 None 时累计 decode / resize / encode 三段耗时（秒）
+    clock = time.perf_counter
+    t0 = clock()
+    img = Image.open(io.BytesIO(content))
+    if img.mode in ('P', 'PA', '1', 'I', 'I;16', 'F'):
+        img = _to_output_mode(img)
+    order = sorted(range(len(specs)), key=lambda i: specs[i][0] * specs[i][1], reverse=True)
+    out = [None] * len(specs)
+    current = None
+    decode = resize = encode = 0.0
+    for i in order:
+        max_w, max_h, fmt, quality = specs[i]
+        if current is None:
+            # thumbnail 自带的 draft 会按 reducing_gap 预留 2 倍尺寸，这里直接按目标尺寸缩小解码
+            w, h = img.size
+            scale = min(max_w / w, max_h / h, 1.0)
+            img.draft(None, (max(1, int(w * scale)), max(1, int(h * scale))))
+            img.load()
+            current = img
+            t1 = clock()
+            decode = t1 - t0
+        else:
+            t1 = clock()
+            current = current.copy()
+        current.thumbnail((max_w, max_h), reducing_gap=2.0)
+        t2 = clock()
+        buf = io.BytesIO()
+        _to_output_mode(current, fmt).save(buf, format=fmt, quality=quality)
+        out[i] = buf.getvalue()
+        resize += t2 - t1
+        encode += clock() - t2
+    if timings is not None:
+        timings.update(decode=decode, resize=resize, encode=encode)
+    return out
+
+def _render_timed(content: bytes, specs):
+    # 进程池里执行：耗时随结果一起带回主进程记录
+    timings = {}
+    return _render(content, specs, timings), timings
+
+def _result(fut):
+    out, timings = fut.result()
+    metrics.record_image(timings)
+    return out
+
+def workers():
+    v = os.getenv('IMAGE_WORKERS')
+    if v is None or v.strip() == '':
+        return os.cpu_count() or 1
+    return max(0, int(v))
+
+def _get_executor():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            n = workers()
+            if n == 0:
+                return None, None
+            queue = int(os.getenv('IMAGE_QUEUE', '0') or '0') or n * 4
+            ctx = multiprocessing.get_context(os.getenv('IMAGE_MP_START', 'spawn'))
+            _executor = ProcessPoolExecutor(max_workers=n, mp_context=ctx)
+            _slots = threading.BoundedSemaphore(queue)
+        return _executor, _slots
+
+def _reset(broken):
+    global _executor, _slots
+    with _lock:
+        if _executor is broken:
+            _executor = None
+            _slots = None
+    try:
+        broken.shutdown(wait=False, cancel_futures=True)
+    except Exception:
+        pass
+
+def _done(slots):
+    slots.release()
+    metrics.IMAGE_IN_FLIGHT.dec()
+
+def submit(content: bytes, specs):
+    # 返回 Future，结果为 (编码后字节列表, 分段耗时)，用 _result() 取出；
+    # 队列满时最多等待 IMAGE_QUEUE_TIMEOUT 秒，超时抛 ImageQueueFull
+    executor, slots = _get_executor()
+    if executor is None:
+        fut = Future()
+        try:
+            fut.set_result(_render_timed(content, specs))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+    if not slots.acquire(timeout=float(os.getenv('IMAGE_QUEUE_TIMEOUT', '60'))):
+        raise ImageQueueFull('图片处理队列已满')
+    metrics.IMAGE_IN_FLIGHT.inc()
+    try:
+        fut = executor.submit(_render_timed, content, list(specs))
+    except BrokenProcessPool:
+        _done(slots)
+        _reset(executor)
+        raise
+    fut.add_done_callback(lambda _: _done(slots))
+    return fut
+
+def render(content: bytes, specs):
+    fut = submit(content, specs)
+    try:
+        return _result(fut)
+    except BrokenProcessPool:
+        # 子进程异常退出（例如内存不足被杀），下次调用时重建进程池
+        executor, _ = _get_executor()
+        if executor is not None:
+            _reset(executor)
+        raise
+
+def render_many(contents, specs):
+    futures = [submit(c, specs) for c in contents]
+    return [_result(f) for f in futures]
+
+def shutdown():
+    global _executor, _slots
+    with _lock:
+        executor, _executor, _slots = _executor, None, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import logging
+import threading
+from .db import get_conn
+from . import imaging
+
+# 基于 PostgreSQL 的后台任务队列：任务行持久化在 jobs 表，进程重启后继续处理。
+# 多个进程/线程通过 FOR UPDATE SKIP LOCKED 认领任务，互不重复。
+log = logging.getLogger('python_server.jobs')
+
+_handlers = {}
+_on_failed = {}
+_threads = []
+_stop = threading.Event()
+_wake = threading.Event()
+
+def register(kind: str, fn, on_failed=None):
+    # on_failed(payload, error) 在任务用完 JOB_MAX_ATTEMPTS 次重试、最终标记为 failed 时调用
+    _handlers[kind] = fn
+    if on_failed is not None:
+        _on_failed[kind] = on_failed
+
+def enqueue(cur, kind: str, payload: dict, photo_id: int = None):
+    cur.execute('INSERT INTO jobs (kind, photo_id, payload) VALUES (%s,%s,%s)', (kind, photo_id, json.dumps(payload)))
+    jid = cur.lastrowid
+    _wake.set()
+    return jid
+
+def _claim(cur):
+    cur.execute("""
+        UPDATE jobs SET status='running', attempts=attempts+1, locked_at=CURRENT_TIMESTAMP, updated_at=CURRENT_TIMESTAMP
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE status='queued' AND run_after <= CURRENT_TIMESTAMP
+            ORDER BY id
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING id, kind, photo_id, payload, attempts
+    """)
+    return cur.fetchone()
+
+def requeue_stale(cur, stale_seconds: int):
+    # 进程崩溃时留下的 running 任务，超时后重新排队
+    cur.execute("""
+        UPDATE jobs SET status='queued', locked_at=NULL, updated_at=CURRENT_TIMESTAMP
+        WHERE status='running' AND locked_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+    """, (stale_seconds,))
+    return cur.rowcount
+
+def _finish(jid: int, error: str = None, attempts: int = 0):
+    # 返回任务是否最终失败（不再重试）
+    max_attempts = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+    with get_conn() as conn, conn.cursor() as cur:
+        if error is None:
+            cur.execute("UPDATE jobs SET status='done', error=NULL, updated_at=CURRENT_TIMESTAMP WHERE id=%s", (jid,))
+        elif attempts < max_attempts:
+            cur.execute("""
+                UPDATE jobs SET status='queued', error=%s, locked_at=NULL, updated_at=CURRENT_TIMESTAMP,
+                                run_after=CURRENT_TIMESTAMP + make_interval(secs => %s)
+                WHERE id=%s
+            """, (error, 5 * attempts, jid))
+        else:
+            cur.execute("UPDATE jobs SET status='failed', error=%s, updated_at=CURRENT_TIMESTAMP WHERE id=%s", (error, jid))
+            return True
+    return False
+
+def run_once():
+    with get_conn() as conn, conn.cursor() as cur:
+        job = _claim(cur)
+    if not job:
+        return False
+    fn = _handlers.get(job['kind'])
+    payload = json.loads(job['payload'] or '{}')
+    try:
+        if fn is None:
+            raise RuntimeError(f"no handler for job kind {job['kind']}")
+        fn(payload)
+    except Exception as e:
+        log.exception('job %s (%s) failed', job['id'], job['kind'])
+        error = str(e) or e.__class__.__name__
+        if _finish(job['id'], error=error, attempts=job['attempts']):
+            hook = _on_failed.get(job['kind'])
+            if hook is not None:
+                try:
+                    hook(payload, error)
+                except Exception:
+                    log.exception('on_failed hook for job %s (%s) failed', job['id'], job['kind'])
+    else:
+        _finish(job['id'])
+    return True
+
+def _worker_loop():
+    poll = float(os.getenv('JOB_POLL_INTERVAL', '2'))
+    while not _stop.is_set():
+        try:
+            busy = run_once()
+        except Exception:
+            log.exception('job worker error')
+            busy = False
+        if not busy:
+            _wake.wait(poll)
+            _wake.clear()
+
+def default_workers():
+    # 每个 worker 同一时间只把一张图送进进程池，默认与图片进程数一致才能用满多核
+    v = os.getenv('JOB_WORKERS')
+    if v is None or v.strip() == '':
+        return max(1, imaging.workers())
+    return int(v)
+
+def start(workers: int = None):
+    if workers is None:
+        workers = default_workers()
+    if workers <= 0 or _threads:
+        return
+    try:
+        with get_conn() as conn, conn.cursor() as cur:
+            requeue_stale(cur, int(os.getenv('JOB_STALE_SECONDS', '600')))
+    except Exception:
+        log.exception('requeue stale jobs failed')
+    _stop.clear()
+    for i in range(workers):
+        t = threading.Thread(target=_worker_loop, name=f'job-worker-{i}', daemon=True)
+        t.start()
+        _threads.append(t)
+
+def stop(timeout: float = 10.0):
+    _stop.set()
+    _wake.set()
+    deadline = time.monotonic() + timeout
+    for t in _threads:
+        t.join(max(0.0, deadline - time.monotonic()))
+    _threads.clear()
+
+def wait_forever():
+    try:
+        while not _stop.is_set():
+            _stop.wait(1)
+    except KeyboardInterrupt:
+        stop()
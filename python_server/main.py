@@ -1,23 +1,33 @@
 import os
 from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import Response
 import hashlib
+import threading
+import anyio.to_thread
+import shutil
+import base64
+import json
+import re
 import jwt
 import bcrypt
-from .db import init_pool, init_schema, get_conn
+from .db import init_pool, init_schema, get_conn, close_pool, pool_stats, search_doc, atomic, add_upload_usage, subtract_upload_usage, get_upload_usage, query_budget, query_stats
+from . import adb, jobs, imaging, variants, hotlink, metrics, migrations, tags as tagging
+from .uploads import UploadsApp
+from .cache import responses as response_cache
+from starlette.concurrency import run_in_threadpool
 from .seed import ensure_admin
 from typing import List, Dict
-from PIL import Image
 import io
 from minio import Minio
 from minio.error import S3Error
+from minio.deleteobjects import DeleteObject
 import urllib3
 from urllib3.util import Timeout, Retry
 from datetime import datetime, timedelta
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 def asset_url(path: str):
     base = os.getenv('ASSET_BASE_URL')
@@ -27,6 +37,23 @@ def asset_url(path: str):
     proto = 'http'
     return f"{proto}://{host}/{path.lstrip('/')}"
 
+def api_origin(request: Request):
+    # /api/img 由本服务提供，衍生图地址要用 API 自身的来源：ASSET_BASE_URL 可能指向不提供 /api 的静态/CDN 域名。
+    # 优先 API_PUBLIC_URL，否则取请求的 Host（反向代理后看 X-Forwarded-*）；都拿不到时返回 None，不输出 srcset
+    base = os.getenv('API_PUBLIC_URL')
+    if base:
+        return base.rstrip('/')
+    host = request.headers.get('x-forwarded-host') or request.headers.get('host')
+    if not host:
+        return None
+    proto = (request.headers.get('x-forwarded-proto') or request.url.scheme).split(',')[0].strip()
+    return f"{proto}://{host.split(',')[0].strip()}{request.scope.get('root_path', '')}".rstrip('/')
+
+def _srcset(photo_id: int, source_url: str, origin: str):
+    if not origin:
+        return None
+    return variants.srcset(photo_id, source_url, lambda path: f"{origin}/{path.lstrip('/')}")
+
 def normalize_asset(url: str):
     try:
         if not url or '/uploads/' not in url:
@@ -48,14 +75,57 @@ def normalize_row_urls(row: Dict):
         row['video_url'] = normalize_asset(row['video_url'])
     return row
 
+# 进程级共享的对象存储客户端：只在首次使用或 set_r2_config 修改配置后重建，
+# 复用同一个 urllib3 连接池（TLS 连接保持），maxsize 由 R2_POOL_MAXSIZE 控制
+_r2_lock = threading.Lock()
+_r2_cached = None
+_r2_counters = {'client_hits': 0, 'client_misses': 0}
+
 def _r2_client():
+    cached = _r2_cached
+    if cached is not None:
+        _r2_counters['client_hits'] += 1
+        return cached[0], cached[1]
+    return _r2_rebuild()
+
+def _r2_rebuild():
+    global _r2_cached
+    with _r2_lock:
+        if _r2_cached is None:
+            _r2_counters['client_misses'] += 1
+            _r2_cached = _r2_build()
+        return _r2_cached[0], _r2_cached[1]
+
+def _r2_reset():
+    global _r2_cached
+    with _r2_lock:
+        old, _r2_cached = _r2_cached, None
+    if old and old[2] is not None:
+        old[2].clear()
+
+def r2_pool_stats():
+    cached = _r2_cached
+    stats = dict(_r2_counters, configured=bool(cached and cached[0]), maxsize=None, connections=0, requests=0, reused=0)
+    http = cached[2] if cached else None
+    if http is not None:
+        stats['maxsize'] = http.connection_pool_kw.get('maxsize')
+        for key in list(http.pools.keys()):
+            p = http.pools.get(key)
+            if p is None:
+                continue
+            stats['connections'] += p.num_connections
+            stats['requests'] += p.num_requests
+        stats['reused'] = max(0, stats['requests'] - stats['connections'])
+    return stats
+
+def _r2_build():
     endpoint = os.getenv('R2_ENDPOINT')
     access_key = os.getenv('R2_ACCESS_KEY')
     secret_key = os.getenv('R2_SECRET_KEY')
     secure = os.getenv('R2_SECURE', 'true').lower() in ('1','true','yes')
     bucket = os.getenv('R2_BUCKET') or 'photos'
     if not (endpoint and access_key and secret_key):
-        return None, None
+        return None, None, None
     try:
         connect_timeout = float(os.getenv('R2_CONNECT_TIMEOUT', '2'))
         read_timeout = float(os.getenv('R2_READ_TIMEOUT', '10'))
@@ -79,7 +149,8 @@ def _r2_client():
         http_client = urllib3.PoolManager(
             timeout=Timeout(connect=connect_timeout, read=read_timeout),
             retries=Retry(total=total_retries, backoff_factor=0.2, status_forcelist=[500,502,503,504]),
-            ssl_context=ssl_ctx
+            ssl_context=ssl_ctx,
+            maxsize=int(os.getenv('R2_POOL_MAXSIZE', '16')),
         )
         client = Minio(
             host,
@@ -89,9 +160,9 @@ def _r2_client():
             region=region,
             http_client=http_client,
         )
-        return client, bucket
+        return client, bucket, http_client
     except Exception:
-        return None, None
+        return None, None, None
 
 def _r2_public_base():
     base = os.getenv('R2_PUBLIC_BASE')
@@ -130,7 +201,21 @@ def _r2_put_bytes(object_name: str, data: bytes, content_type: str = 'applicatio
         return False
     try:
         bio = io.BytesIO(data)
-        client.put_object(bucket, object_name, bio, length=len(data), content_type=content_type)
+        with metrics.storage('put'):
+            client.put_object(bucket, object_name, bio, length=len(data), content_type=content_type)
+        return True
+    except Exception:
+        return False
+
+def _r2_put_stream(object_name: str, stream, length: int, content_type: str = 'application/octet-stream'):
+    # 分片上传：minio 每次只从 stream 读取一个 part，内存占用与文件大小无关
+    client, bucket = _r2_client()
+    if not client:
+        return False
+    try:
+        part_size = int(os.getenv('R2_PART_SIZE', str(16 * 1024 * 1024)))
+        with metrics.storage('put_stream'):
+            client.put_object(bucket, object_name, stream, length=length, content_type=content_type, part_size=part_size)
         return True
     except Exception:
         return False
@@ -140,11 +225,27 @@ def _r2_remove(object_name: str):
     if not client:
         return False
     try:
-        client.remove_object(bucket, object_name)
+        with metrics.storage('remove'):
+            client.remove_object(bucket, object_name)
         return True
     except Exception:
         return False
 
+def _r2_remove_many(object_names):
+    # 多对象删除（S3 DeleteObjects，每次请求最多 1000 个）；返回删除失败的对象名
+    client, bucket = _r2_client()
+    names = list(object_names)
+    if not names:
+        return []
+    if not client:
+        return names
+    try:
+        # remove_objects 是惰性的，必须遍历返回的错误迭代器才会真正发出请求
+        with metrics.storage('remove_many'):
+            return [err.name for err in client.remove_objects(bucket, (DeleteObject(n) for n in names))]
+    except Exception:
+        return names
+
 def _r2_key_from_url(url: str):
     try:
         base = _r2_public_base()
@@ -166,23 +267,293 @@ def _r2_get_bytes(object_name: str):
     if not client:
         return None
     try:
-        resp = client.get_object(bucket, object_name)
-        try:
-            data = resp.read()
-            return data
-        finally:
-            resp.close()
-            resp.release_conn()
+        with metrics.storage('get'):
+            resp = client.get_object(bucket, object_name)
+            try:
+                data = resp.read()
+                return data
+            finally:
+                resp.close()
+                resp.release_conn()
+    except Exception:
+        return None
+
+def _r2_stat_size(object_name: str):
+    client, bucket = _r2_client()
+    if not client:
+        return None
+    try:
+        with metrics.storage('stat'):
+            return client.stat_object(bucket, object_name).size
     except Exception:
         return None
 
+UPLOADS_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
+
+def _local_path(key: str):
+    return os.path.join(UPLOADS_ROOT, *key.split('/'))
+
+def _store_object(key: str, data: bytes, content_type: str = 'application/octet-stream'):
+    # 优先写对象存储，失败时落到本地 uploads/ 下的同名路径；返回 (url, 是否在对象存储)
+    if _r2_put_bytes(key, data, content_type=content_type):
+        url = _r2_url(key)
+        if url:
+            return url, True
+    with open(_local_path(key), 'wb') as out:
+        out.write(data)
+    return asset_url(f'uploads/{key}'), False
+
+# 对象存储写入的 I/O 线程池：同一作品的多个对象、同一批上传的多个文件并发写入，
+# 线程数 R2_IO_WORKERS（默认 8，不宜超过 R2_POOL_MAXSIZE）；每个对象各自失败时各自回退到本地
+_io_lock = threading.Lock()
+_io_executor = None
+
+def _io_pool():
+    global _io_executor
+    with _io_lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(max_workers=max(1, int(os.getenv('R2_IO_WORKERS', '8'))), thread_name_prefix='r2-io')
+        return _io_executor
+
+def _io_shutdown():
+    global _io_executor
+    with _io_lock:
+        executor, _io_executor = _io_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+def _io_map(fn, arg_list):
+    # 并发执行 fn(*args)，按输入顺序返回 [(结果, 异常)]；只有一个任务时直接在当前线程执行
+    arg_list = list(arg_list)
+    if len(arg_list) <= 1:
+        futures = None
+    else:
+        pool = _io_pool()
+        metrics.STORAGE_IO_IN_FLIGHT.inc(amount=len(arg_list))
+        futures = []
+        for args in arg_list:
+            fut = pool.submit(fn, *args)
+            fut.add_done_callback(lambda _: metrics.STORAGE_IO_IN_FLIGHT.dec())
+            futures.append(fut)
+    out = []
+    for i, args in enumerate(arg_list):
+        try:
+            out.append((futures[i].result() if futures else fn(*args), None))
+        except Exception as e:
+            out.append((None, e))
+    return out
+
+def _store_objects(items):
+    # items: [(key, data, content_type)]，返回与之对应的 [(url, 是否在对象存储)]
+    results = _io_map(_store_object, items)
+    for _, err in results:
+        if err is not None:
+            raise err
+    return [r for r, _ in results]
+
+class _HashingReader:
+    # 包装上传文件：读取的同时累计字节数与 SHA-256，不额外缓存内容
+    def __init__(self, fileobj):
+        self._f = fileobj
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def read(self, n=-1):
+        chunk = self._f.read(n)
+        if chunk:
+            self.size += len(chunk)
+            self.sha256.update(chunk)
+        return chunk
+
+def _upload_size(uf: UploadFile):
+    if uf.size is not None:
+        return uf.size
+    f = uf.file
+    pos = f.tell()
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(pos)
+    return size
+
+def _store_upload(key: str, uf: UploadFile):
+    # 把 UploadFile（SpooledTemporaryFile）流式写入对象存储，失败时流式复制到本地；
+    # 返回 (url, 是否在对象存储, 字节数, sha256)
+    content_type = uf.content_type or 'application/octet-stream'
+    uf.file.seek(0)
+    reader = _HashingReader(uf.file)
+    if _r2_put_stream(key, reader, _upload_size(uf), content_type=content_type):
+        url = _r2_url(key)
+        if url:
+            return url, True, reader.size, reader.sha256.hexdigest()
+    uf.file.seek(0)
+    reader = _HashingReader(uf.file)
+    with open(_local_path(key), 'wb') as out:
+        shutil.copyfileobj(reader, out, 1024 * 1024)
+    return asset_url(f'uploads/{key}'), False, reader.size, reader.sha256.hexdigest()
+
+def _render_derivatives(content: bytes):
+    proc, thumb = imaging.render(content, imaging.PHOTO_SPECS)
+    return proc, thumb
+
+def _derive_target(job: dict):
+    # 内容相同的作品共用同一份原图，衍生图生成后一并回写
+    if job.get('content_hash'):
+        return 'content_hash=%s AND original_url=%s', (job['content_hash'], job['original_url'])
+    return 'id=%s', (job['photo_id'],)
+
+def _derive_photo(job: dict):
+    # 后台任务：由原图生成 processed / thumb 两个衍生图并回写作品
+    key = job['key']
+    target, target_params = _derive_target(job)
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(f'SELECT id FROM photos WHERE {target} LIMIT 1', target_params)
+        if not cur.fetchone():
+            return
+    if job.get('source') == 'local':
+        with open(_local_path(key), 'rb') as f:
+            content = f.read()
+    else:
+        content = _r2_get_bytes(key)
+        if content is None:
+            raise RuntimeError(f'原图读取失败: {key}')
+    try:
+        proc, thumb = _render_derivatives(content)
+    except Exception:
+        # 无法解码的图片重试也没有意义，作品保持使用原图
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(f"UPDATE photos SET status='failed', version = version + 1 WHERE {target}", target_params)
+        return
+    base = job['base']
+    (image_url, _), (thumb_url, _) = _store_objects([
+        (f"processed/{base}.webp", proc, 'image/webp'),
+        (f"thumbs/{base}_thumb.webp", thumb, 'image/webp'),
+    ])
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(f"UPDATE photos SET image_url=%s, thumb_url=%s, status='ready', version = version + 1 WHERE {target}", (image_url, thumb_url) + target_params)
+    response_cache.invalidate('photos')
+
+def _derive_photo_failed(job: dict, error: str):
+    # 重试次数用完（原图读取失败、写对象存储失败等）：作品标记为 failed，上传进度查询不再停在 processing
+    target, target_params = _derive_target(job)
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(f"UPDATE photos SET status='failed', version = version + 1 WHERE {target} AND status='processing'", target_params)
+    response_cache.invalidate('photos')
+
+jobs.register('derive_photo', _derive_photo, on_failed=_derive_photo_failed)
+
+def _enqueue_derivatives(cur, photo_id: int, base: str, key: str, in_r2: bool, content_hash: str = None, original_url: str = None):
+    job = {'photo_id': photo_id, 'base': base, 'key': key, 'source': 'r2' if in_r2 else 'local'}
+    if content_hash:
+        job.update(content_hash=content_hash, original_url=original_url)
+    jobs.enqueue(cur, 'derive_photo', job, photo_id=photo_id)
+
+def _find_duplicate(cur, content_hash: str):
+    # FOR SHARE 锁住被复用的作品行直到上传事务提交：并发删除它的事务会等待，
+    # 之后做引用检查时能看到新作品，不会把仍被引用的原图/衍生图删掉
+    cur.execute('SELECT original_url, image_url, thumb_url, status FROM photos WHERE content_hash=%s ORDER BY id LIMIT 1 FOR SHARE', (content_hash,))
+    return cur.fetchone()
+
+def _discard_object(key: str, in_r2: bool):
+    # 重复上传时丢弃刚写入的原图
+    if in_r2:
+        _r2_remove(key)
+        return
+    try:
+        os.remove(_local_path(key))
+    except OSError:
+        pass
+
+def _insert_uploaded_photo(cur, user_id: int, meta: dict, base: str, key: str, in_r2: bool, original_url: str, size_bytes: int, content_hash: str):
+    # 按内容哈希去重：已有相同内容的作品时复用它的原图与衍生图，不再排队处理
+    dup = _find_duplicate(cur, content_hash)
+    if dup:
+        _discard_object(key, in_r2)
+        original_url = dup['original_url']
+        image_url, thumb_url, status = dup['image_url'], dup['thumb_url'], dup['status']
+    else:
+        image_url = thumb_url = original_url
+        status = 'processing'
+    cur.execute(
+        "INSERT INTO photos (user_id, title, description, camera, settings, category, original_url, image_url, thumb_url, size_bytes, status, content_hash) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)",
+        (user_id, meta['title'], meta['description'], meta['camera'], meta['settings'], meta['category'], original_url, image_url, thumb_url, size_bytes, status, content_hash),
+    )
+    photo_id = cur.lastrowid
+    if not dup:
+        _enqueue_derivatives(cur, photo_id, base, key, in_r2, content_hash, original_url)
+    return {'id': photo_id, 'image_url': image_url, 'thumb_url': thumb_url, 'status': status, 'duplicate': bool(dup)}
+
+def _cascade_delete_photos(cur, photo_ids, owner_id: int = None, carousel: str = 'delete'):
+    # 在调用方的事务里批量删除作品及其关联行，返回 (被删除的作品行, 可以从存储里删除的 URL)。
+    # carousel='delete' 时连同引用这些作品的轮播图一起删除，'detach' 时只解除关联
+    owner_sql = ' AND user_id = %s' if owner_id is not None else ''
+    cur.execute(f"""
+        DELETE FROM photos WHERE id = ANY(%s){owner_sql}
+        RETURNING id, user_id, original_url, image_url, thumb_url, content_hash, size_bytes, created_at
+    """, (list(photo_ids),) + ((owner_id,) if owner_id is not None else ()))
+    deleted = cur.fetchall()
+    if not deleted:
+        return [], set()
+    ids = [r['id'] for r in deleted]
+    urls = {u for r in deleted for u in (r['original_url'], r['image_url'], r['thumb_url']) if u}
+    if carousel == 'delete':
+        cur.execute('DELETE FROM home_carousel WHERE photo_id = ANY(%s) RETURNING image_url, thumb_url', (ids,))
+        urls.update(u for r in cur.fetchall() for u in (r['image_url'], r['thumb_url']) if u)
+    else:
+        cur.execute('UPDATE home_carousel SET photo_id = NULL WHERE photo_id = ANY(%s)', (ids,))
+    for table in ('photo_tags', 'likes', 'favorites', 'comments'):
+        cur.execute(f'DELETE FROM {table} WHERE photo_id = ANY(%s)', (ids,))
+    # 从各作品上传当天/当月的台账里扣回
+    subtract_upload_usage(cur, [(r['user_id'], r['created_at'], r['size_bytes']) for r in deleted])
+    # 引用计数：同一 content_hash 的其余作品、仍保留的轮播图还在用的对象不删除
+    hashes = list({r['content_hash'] for r in deleted if r['content_hash']})
+    if hashes and urls:
+        cur.execute('SELECT original_url, image_url, thumb_url FROM photos WHERE content_hash = ANY(%s)', (hashes,))
+        for r in cur.fetchall():
+            urls.difference_update(r.values())
+    if urls:
+        url_list = list(urls)
+        cur.execute('SELECT image_url, thumb_url FROM home_carousel WHERE image_url = ANY(%s) OR thumb_url = ANY(%s)', (url_list, url_list))
+        for r in cur.fetchall():
+            urls.difference_update(r.values())
+    return deleted, urls
+
+def _remove_stored_objects(urls, deleted=()):
+    # 事务提交后调用：对象存储上的一次批量删除，本地文件按 URL 中 /uploads/ 之后的路径删除；
+    # 传入被删除的作品行时，连同写入对象存储的响应式尺寸（variants/）一起删除
+    keys = []
+    if variants.r2_write_through():
+        for r in deleted:
+            keys.extend(variants.storage_keys(r['id'], (r['original_url'], r['image_url'])))
+    for u in urls:
+        k = _r2_key_from_url(u)
+        if k:
+            keys.append(k)
+        elif '/uploads/' in u:
+            path = os.path.abspath(_local_path(u.split('/uploads/', 1)[1].split('?', 1)[0]))
+            if os.path.commonpath([UPLOADS_ROOT, path]) != UPLOADS_ROOT:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return _r2_remove_many(keys)
+
+def _delete_photos(photo_ids, owner_id: int = None, carousel: str = 'delete'):
+    with get_conn() as conn, atomic(conn), conn.cursor() as cur:
+        deleted, urls = _cascade_delete_photos(cur, photo_ids, owner_id, carousel)
+    if deleted:
+        _remove_stored_objects(urls, deleted)
+        response_cache.invalidate('photos', 'carousel')
+    return [r['id'] for r in deleted]
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_pool()
     init_schema()
+    if migrations.migrate_on_startup():
+        migrations.migrate()
     ensure_admin()
-    conn = get_conn()
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute("SELECT id FROM users WHERE role='admin' ORDER BY id ASC LIMIT 1")
         r = cur.fetchone()
         admin_id = r['id'] if r else None
@@ -194,61 +565,24 @@ async def lifespan(app: FastAPI):
                 cur.execute("INSERT INTO photos (user_id, title, description, camera, settings, category, original_url, image_url, thumb_url, size_bytes) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", (admin_id, title, None, None, None, 'carousel', None, row['image_url'], row['thumb_url'], 0))
                 pid = cur.lastrowid
                 cur.execute("UPDATE home_carousel SET photo_id=%s WHERE id=%s", (pid, row['id']))
-    conn.close()
     uploads_dir = os.path.join(os.path.dirname(__file__), '..', 'uploads')
     for d in ['originals', 'processed', 'thumbs', 'carousel', 'carousel_thumbs', 'videos']:
         p = os.path.join(uploads_dir, d)
         os.makedirs(p, exist_ok=True)
-        app.mount('/uploads', StaticFiles(directory=os.path.abspath(uploads_dir)), name='uploads')
+    app.mount('/uploads', UploadsApp(os.path.abspath(uploads_dir)), name='uploads')
+    jobs.start()
     yield
+    jobs.stop()
+    _io_shutdown()
+    imaging.shutdown()
+    adb.shutdown()
+    close_pool()
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
 
-class UploadsSecurityMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        path = request.url.path
-        if path.startswith('/uploads/'):
-            ref = request.headers.get('referer', '')
-            allowed = [
-                'http://localhost:5173',
-                f"http://localhost:{os.getenv('PORT','4002')}",
-            ]
-            extra = os.getenv('ALLOWED_REFERRERS')
-            if extra:
-                allowed.extend([s.strip() for s in extra.split(',') if s.strip()])
-            ok = (ref == '')
-            if not ok and ref:
-                try:
-                    from urllib.parse import urlparse
-                    host = urlparse(ref).hostname or ''
-                except Exception:
-                    host = ''
-                for a in allowed:
-                    if ok:
-                        break
-                    a = a.strip()
-                    if not a:
-                        continue
-                    if a == '*':
-                        ok = True
-                        break
-                    if a.startswith('*.'):
-                        suf = a[2:]
-                        if host and host.endswith(suf):
-                            ok = True
-                            break
-                    if ref.startswith(a):
-                        ok = True
-                        break
-            if not ok:
-                return JSONResponse({'error':'hotlink forbidden'}, status_code=403)
-            resp = await call_next(request)
-            resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
-            return resp
-        return await call_next(request)
-
-app.add_middleware(UploadsSecurityMiddleware)
+app.add_middleware(hotlink.UploadsSecurityMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 
 JWT_SECRET = os.getenv('JWT_SECRET', 'dev_secret')
 
@@ -276,21 +610,64 @@ def role_required(payload, *roles):
     if role not in roles:
         raise HTTPException(status_code=403, detail='无权限')
 
+def _ops_authorized(authorization: str):
+    # 运维数据（指标、池状态）只给抓取令牌或管理员看
+    if metrics.authorized(authorization):
+        return True
+    if not authorization or not authorization.startswith('Bearer '):
+        return False
+    try:
+        payload = jwt.decode(authorization[7:], JWT_SECRET, algorithms=['HS256'])
+    except Exception:
+        return False
+    return payload.get('role') in ('admin', 'super_admin')
+
 @app.get('/api/health')
-def health():
-    return {'ok': True}
+def health(authorization: str = Header(None)):
+    # 匿名请求只返回存活状态，池与缓存的内部数据需要认证
+    if not _ops_authorized(authorization):
+        return {'ok': True}
+    return {'ok': True, 'db_pool': pool_stats(), 'r2_pool': r2_pool_stats(), 'variant_cache': variants.cache().stats(), 'response_cache': response_cache.stats()}
+
+@metrics.register_collector
+def _pool_saturation():
+    # 抓取时读取各个池的占用：数据库连接池、同步端点线程池、async 端点的数据库线程池、对象存储 I/O 线程池、图片进程池
+    rows = []
+    db = pool_stats()
+    if db:
+        for k in ('in_use', 'idle', 'max', 'waits', 'wait_time_total', 'wait_time_max', 'timeouts'):
+            rows.append((f'db_pool_{k}', f'Database connection pool {k}', None, db.get(k)))
+    try:
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        rows.append(('threadpool_borrowed', 'Sync endpoint threadpool threads in use', None, limiter.borrowed_tokens))
+        rows.append(('threadpool_size', 'Sync endpoint threadpool size', None, limiter.total_tokens))
+    except RuntimeError:
+        pass
+    a = adb.stats()
+    rows.append(('db_async_in_flight', 'Async DB calls queued or running', None, a['in_flight']))
+    rows.append(('db_async_workers', 'Async DB executor threads', None, a['workers']))
+    executor = _io_executor
+    rows.append(('storage_io_workers', 'Object storage I/O pool threads', None, executor._max_workers if executor else 0))
+    rows.append(('image_workers', 'Image processing worker processes', None, imaging.workers()))
+    r2 = r2_pool_stats()
+    rows.append(('storage_http_connections', 'Object storage HTTP connections opened', None, r2.get('connections', 0)))
+    return rows
+
+@app.get('/api/metrics')
+async def metrics_endpoint(request: Request):
+    if not _ops_authorized(request.headers.get('authorization')):
+        raise HTTPException(status_code=401, detail='未认证')
+    return Response(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.post('/api/auth/register')
 def register(username: str = Form(...), email: str = Form(None), password: str = Form(...), role: str = Form('user')):
-    conn = get_conn()
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute('SELECT id FROM users WHERE username=%s OR email=%s', (username, email))
         rows = cur.fetchall()
         if rows:
             raise HTTPException(status_code=409, detail='用户名或邮箱已存在')
         hashpw = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
         cur.execute('INSERT INTO users (username, email, password_hash, role) VALUES (%s,%s,%s,%s)', (username, email, hashpw, role))
-    conn.close()
     return {'ok': True}
 
 @app.post('/api/auth/login')
@@ -317,17 +694,11 @@ async def login(request: Request):
             pass
     if not isinstance(username, str) or not isinstance(password, str):
         raise HTTPException(status_code=400, detail='用户名和密码必填')
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute('SELECT id, username, role, password_hash FROM users WHERE username=%s', (username,))
-        row = cur.fetchone()
-        if not row:
-            conn.close()
-            raise HTTPException(status_code=404, detail='用户不存在')
-        if not bcrypt.checkpw(password.encode(), row['password_hash'].encode()):
-            conn.close()
-            raise HTTPException(status_code=401, detail='密码不正确')
-    conn.close()
+    row = await adb.fetchone('SELECT id, username, role, password_hash FROM users WHERE username=%s', (username,))
+    if not row:
+        raise HTTPException(status_code=404, detail='用户不存在')
+    if not await run_in_threadpool(bcrypt.checkpw, password.encode(), row['password_hash'].encode()):
+        raise HTTPException(status_code=401, detail='密码不正确')
     payload = {'id': row['id'], 'username': row['username'], 'role': row['role'], 'exp': int((datetime.utcnow() + timedelta(hours=12)).timestamp())}
     token = jwt.encode(payload, JWT_SECRET, algorithm='HS256')
     return {'token': token}
@@ -350,6 +721,8 @@ async def set_asset_base(request: Request, base: str = Form(...), allow_ref: str
         if base not in parts:
             parts.append(base)
         os.environ['ALLOWED_REFERRERS'] = ','.join(parts)
+        hotlink.refresh()
+    response_cache.invalidate()
     return {'ok': True, 'ASSET_BASE_URL': base, 'ALLOWED_REFERRERS': os.environ.get('ALLOWED_REFERRERS')}
 
 @app.post('/api/admin/add-allowed-referrer')
@@ -364,6 +737,7 @@ async def add_allowed_referrer(request: Request, ref: str = Form(...), payload:
     if ref not in parts:
         parts.append(ref)
     os.environ['ALLOWED_REFERRERS'] = ','.join(parts)
+    hotlink.refresh()
     return {'ok': True, 'ALLOWED_REFERRERS': os.environ.get('ALLOWED_REFERRERS')}
 
 @app.get('/api/admin/r2-config')
@@ -422,6 +796,7 @@ async def set_r2_config(
     if isinstance(region, str) and region.strip():
         os.environ['R2_REGION'] = region.strip()
     os.environ['R2_SKIP_VERIFY'] = 'true' if str(skip_verify).lower() in ('1','true','yes') else 'false'
+    _r2_reset()
     client, b2 = _r2_client()
     if not client:
         raise HTTPException(status_code=400, detail='R2配置无效')
@@ -463,56 +838,53 @@ async def change_password(request: Request, payload: dict = Depends(auth_require
             pass
     if not isinstance(new_password, str) or len(new_password) < 6:
         raise HTTPException(status_code=400, detail='新密码长度至少为6位')
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute('SELECT id, password_hash FROM users WHERE id=%s', (payload['id'],))
-        user = cur.fetchone()
-        if not user:
-            conn.close()
-            raise HTTPException(status_code=404, detail='用户不存在')
-        if old_password:
-            ok = bcrypt.checkpw(old_password.encode(), user['password_hash'].encode())
-            if not ok:
-                conn.close()
-                raise HTTPException(status_code=401, detail='原密码不正确')
-        hashpw = bcrypt.hashpw(new_password.encode(), bcrypt.gensalt()).decode()
-        cur.execute('UPDATE users SET password_hash=%s WHERE id=%s', (hashpw, payload['id']))
-    conn.close()
+    user = await adb.fetchone('SELECT id, password_hash FROM users WHERE id=%s', (payload['id'],))
+    if not user:
+        raise HTTPException(status_code=404, detail='用户不存在')
+    if old_password:
+        ok = await run_in_threadpool(bcrypt.checkpw, old_password.encode(), user['password_hash'].encode())
+        if not ok:
+            raise HTTPException(status_code=401, detail='原密码不正确')
+    hashpw = (await run_in_threadpool(bcrypt.hashpw, new_password.encode(), bcrypt.gensalt())).decode()
+    await adb.execute('UPDATE users SET password_hash=%s WHERE id=%s', (hashpw, payload['id']))
     return {'ok': True}
 
 @app.get('/api/users/me')
 def me(payload: dict = Depends(auth_required)):
-    conn = get_conn()
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute('SELECT id, username, role, created_at FROM users WHERE id=%s', (payload['id'],))
         user = cur.fetchone()
-    conn.close()
     return user
 
 @app.get('/api/users/me/photos')
 def my_photos(payload: dict = Depends(auth_required)):
-    conn = get_conn()
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         if payload.get('role') in ('admin','super_admin'):
             cur.execute('SELECT id, title, COALESCE(thumb_url, image_url, original_url) AS thumb_url, COALESCE(image_url, original_url) AS image_url, created_at FROM photos ORDER BY id DESC')
         else:
             cur.execute('SELECT id, title, COALESCE(thumb_url, image_url, original_url) AS thumb_url, COALESCE(image_url, original_url) AS image_url, created_at FROM photos WHERE user_id=%s ORDER BY id DESC', (payload['id'],))
         rows = cur.fetchall()
-    conn.close()
     return [normalize_row_urls(r) for r in rows]
 
 @app.get('/api/users/me/stats')
 def my_stats(payload: dict = Depends(auth_required)):
-    conn = get_conn()
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute('SELECT COUNT(*) as count FROM photos WHERE user_id=%s', (payload['id'],))
         photos = cur.fetchone()['count']
         cur.execute('SELECT COUNT(*) as count FROM likes WHERE user_id=%s', (payload['id'],))
         likes = cur.fetchone()['count']
         cur.execute('SELECT COUNT(*) as count FROM favorites WHERE user_id=%s', (payload['id'],))
         favorites = cur.fetchone()['count']
-    conn.close()
-    return {'photos': photos, 'likes': likes, 'favorites': favorites}
+        usage = get_upload_usage(cur, payload['id'])
+    upload_usage = {
+        'day_bytes': usage['day'],
+        'day_files': usage['day_files'],
+        'month_bytes': usage['month'],
+        'month_files': usage['month_files'],
+        'day_limit': int(os.getenv('UPLOAD_MAX_PER_DAY_BYTES', '0') or '0'),
+        'month_limit': int(os.getenv('UPLOAD_MAX_PER_MONTH_BYTES', '0') or '0'),
+    }
+    return {'photos': photos, 'likes': likes, 'favorites': favorites, 'upload_usage': upload_usage}
 
 @app.post('/api/users/change-username')
 async def change_username(request: Request, payload: dict = Depends(auth_required)):
@@ -539,136 +911,271 @@ async def change_username(request: Request, payload: dict = Depends(auth_require
     name = name.strip()
     if len(name) < 3 or len(name) > 64:
         raise HTTPException(status_code=400, detail='用户名长度需在3-64之间')
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute('SELECT id FROM users WHERE username=%s', (name,))
-        exists = cur.fetchall()
-        if exists:
-            conn.close()
-            raise HTTPException(status_code=409, detail='用户名已存在')
-        cur.execute('UPDATE users SET username=%s WHERE id=%s', (name, payload['id']))
-    conn.close()
+    exists = await adb.fetchall('SELECT id FROM users WHERE username=%s', (name,))
+    if exists:
+        raise HTTPException(status_code=409, detail='用户名已存在')
+    await adb.execute('UPDATE users SET username=%s WHERE id=%s', (name, payload['id']))
     return {'ok': True, 'username': name}
 
+def _encode_cursor(kind: str, value: int):
+    return base64.urlsafe_b64encode(f'{kind}:{value}'.encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor: str, kind: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        k, value = raw.split(':', 1)
+        if k != kind:
+            raise ValueError(k)
+        return int(value)
+    except Exception:
+        raise HTTPException(status_code=400, detail='无效的分页游标')
+
+def _like_escape(s: str):
+    return s.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _cached_json(request: Request, namespace: str, key, build):
+    # 公开只读接口：响应体进程内缓存，带 ETag，浏览器/CDN 用 If-None-Match 重新验证
+    body, etag = response_cache.get_or_build(namespace, key, lambda: json.dumps(jsonable_encoder(build()), ensure_ascii=False).encode('utf-8'))
+    headers = {'ETag': etag, 'Cache-Control': os.getenv('RESPONSE_CACHE_CONTROL', 'public, no-cache')}
+    inm = request.headers.get('if-none-match')
+    if inm and etag in [t.strip() for t in inm.split(',')]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
+
 @app.get('/api/photos')
-def list_photos(q: str = None, tag: str = None, category: str = None, photographer: str = None, page: int = 1, pageSize: int = 20):
-    offset = (page - 1) * pageSize
+def list_photos(request: Request, q: str = None, tag: str = None, category: str = None, photographer: str = None, page: int = 1, pageSize: int = 20, cursor: str = None, sort: str = None):
+    origin = api_origin(request)
+    # 无筛选条件的第一页是首页每次都会请求的，走响应缓存；srcset 里带着 API 来源，按来源分开缓存
+    if not (q or tag or category or photographer or cursor) and page == 1:
+        return _cached_json(request, 'photos', (cursor is None, pageSize, origin), lambda: _list_photos(None, None, None, None, 1, pageSize, cursor, sort, origin))
+    return _list_photos(q, tag, category, photographer, page, pageSize, cursor, sort, origin)
+
+def _list_photos(q: str, tag: str, category: str, photographer: str, page: int, pageSize: int, cursor: str, sort: str, origin: str = None):
+    # 传入 cursor（首页传空串）时走 keyset 分页并返回 {items, next_cursor}；
+    # 否则保持旧的 page/pageSize 行为，直接返回列表
+    by_relevance = bool(q) and sort == 'relevance'
+    select_extra = ''
+    select_params = []
     where = 'WHERE 1=1'
     params = []
     if q:
-        where += ' AND (photos.title LIKE %s OR photos.description LIKE %s)'
-        params.extend([f"%{q}%", f"%{q}%"])
+        like = f"%{_like_escape(q)}%"
+        if re.search(r'\S\S', q):
+            # 先用 bigram GIN 索引缩小候选集，再用 ILIKE 复核
+            where += f" AND photo_search_grams({search_doc('photos.')}) @> photo_search_grams(%s)"
+            params.append(q)
+        where += ' AND (photos.title ILIKE %s OR photos.description ILIKE %s)'
+        params.extend([like, like])
+        if by_relevance:
+            select_extra = """,
+             (CASE WHEN lower(photos.title) = lower(%s) THEN 8 ELSE 0 END
+              + CASE WHEN photos.title ILIKE %s THEN 4 ELSE 0 END
+              + CASE WHEN photos.title ILIKE %s THEN 2 ELSE 0 END
+              + CASE WHEN photos.description ILIKE %s THEN 1 ELSE 0 END) AS relevance"""
+            select_params = [q, f"{_like_escape(q)}%", like, like]
     if category:
         where += ' AND photos.category = %s'
         params.append(category)
     if photographer:
         where += ' AND users.username = %s'
         params.append(photographer)
+    if cursor is not None:
+        pageSize = max(1, min(pageSize, 100))
+    offset = (page - 1) * pageSize
+    if cursor and not by_relevance:
+        where += ' AND photos.id < %s'
+        params.append(_decode_cursor(cursor, 'id'))
+    elif cursor:
+        # 相关度排序没有单调的键，游标里记录偏移量
+        offset = _decode_cursor(cursor, 'off')
     tagJoin = ''
     if tag:
         tagJoin = ' JOIN photo_tags pt ON pt.photo_id = photos.id JOIN tags t ON t.id = pt.tag_id AND t.name = %s'
-        params.append(tag)
+        params.insert(0, tag)
+    order = 'relevance DESC, photos.id DESC' if by_relevance else 'photos.id DESC'
+    limit = ' LIMIT %s'
+    if cursor is None:
+        limit += ' OFFSET %s'
+        params.extend([pageSize, offset])
+    elif by_relevance:
+        limit += ' OFFSET %s'
+        params.extend([pageSize + 1, offset])
+    else:
+        params.append(pageSize + 1)
     sql = f"""
       SELECT photos.id,
              photos.title,
              COALESCE(photos.thumb_url, photos.image_url, photos.original_url) AS thumb_url,
              COALESCE(photos.image_url, photos.original_url) AS image_url,
              photos.category,
-             users.username AS author
+             photos.like_count AS likes,
+             photos.favorite_count AS favorites,
+             users.username AS author{select_extra}
       FROM photos JOIN users ON users.id = photos.user_id {tagJoin} {where}
-      ORDER BY photos.id DESC LIMIT %s OFFSET %s
+      ORDER BY {order}{limit}
     """
-    params.extend([pageSize, offset])
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute(sql, params)
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(sql, select_params + params)
         rows = cur.fetchall()
-    conn.close()
-    return [normalize_row_urls(r) for r in rows]
+    for r in rows:
+        r['srcset'] = _srcset(r['id'], r['image_url'], origin)
+    if cursor is None:
+        return [normalize_row_urls(r) for r in rows]
+    next_cursor = None
+    if len(rows) > pageSize:
+        rows = rows[:pageSize]
+        if by_relevance:
+            next_cursor = _encode_cursor('off', offset + pageSize)
+        else:
+            next_cursor = _encode_cursor('id', rows[-1]['id'])
+    return {'items': [normalize_row_urls(r) for r in rows], 'next_cursor': next_cursor}
+
+# 只选对外公开的列：content_hash / status / version 等内部列不进响应（version 只用于 ETag，返回前去掉）
+PHOTO_DETAIL_SQL = """
+    SELECT p.id, p.user_id, p.title, p.description, p.camera, p.settings, p.category,
+           p.original_url, p.image_url, p.thumb_url, p.size_bytes, p.created_at, p.version,
+           u.username AS author,
+           COALESCE(tg.tags, '{}') AS tags,
+           p.like_count AS likes,
+           p.favorite_count AS favorites,
+           COALESCE(cm.comments, '[]'::json) AS comments,
+           EXISTS (SELECT 1 FROM likes l WHERE l.photo_id = p.id AND l.user_id = %s) AS liked_by_me,
+           EXISTS (SELECT 1 FROM favorites f WHERE f.photo_id = p.id AND f.user_id = %s) AS favorited_by_me
+    FROM photos p
+    LEFT JOIN users u ON u.id = p.user_id
+    LEFT JOIN LATERAL (
+        SELECT array_agg(t.name) AS tags
+        FROM photo_tags pt JOIN tags t ON t.id = pt.tag_id
+        WHERE pt.photo_id = p.id
+    ) tg ON true
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object('id', c.id, 'content', c.content, 'created_at', c.created_at, 'username', cu.username) ORDER BY c.id DESC) AS comments
+        FROM comments c JOIN users cu ON cu.id = c.user_id
+        WHERE c.photo_id = p.id
+    ) cm ON true
+    WHERE p.id = %s
+"""
+
+def _optional_uid(authorization: str):
+    if authorization and authorization.startswith('Bearer '):
+        try:
+            payload = jwt.decode(authorization[7:], JWT_SECRET, algorithms=['HS256'])
+            return payload.get('id')
+        except Exception:
+            return None
+    return None
+
+def _detail_etag(photo_id: int, version: int, uid):
+    # liked_by_me / favorited_by_me 因人而异，ETag 里带上用户 id
+    return f'W/"p{photo_id}-v{version}-u{uid or 0}"'
 
 @app.get('/api/photos/{photo_id}')
-def photo_detail(photo_id: int, authorization: str = Header(None)):
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute('SELECT p.*, u.username as author FROM photos p LEFT JOIN users u ON u.id=p.user_id WHERE p.id=%s', (photo_id,))
+def photo_detail(photo_id: int, request: Request, response: Response, authorization: str = Header(None)):
+    uid = _optional_uid(authorization)
+    headers = {'Cache-Control': 'private, no-cache', 'Vary': 'Authorization'}
+    inm = request.headers.get('if-none-match')
+    with get_conn() as conn, conn.cursor() as cur:
+        if inm:
+            cur.execute('SELECT version FROM photos WHERE id=%s', (photo_id,))
+            r = cur.fetchone()
+            if r:
+                etag = _detail_etag(photo_id, r['version'], uid)
+                if etag in [t.strip() for t in inm.split(',')]:
+                    return Response(status_code=304, headers=dict(headers, ETag=etag))
+        cur.execute(PHOTO_DETAIL_SQL, (uid, uid, photo_id))
         photo = cur.fetchone()
-        if not photo:
-            conn.close()
-            raise HTTPException(status_code=404, detail='作品不存在')
-        cur.execute('SELECT t.name FROM photo_tags pt JOIN tags t ON t.id = pt.tag_id WHERE pt.photo_id = %s', (photo_id,))
-        tags = [r['name'] for r in cur.fetchall()]
-        cur.execute('SELECT COUNT(*) as c FROM likes WHERE photo_id=%s', (photo_id,))
-        likes = cur.fetchone()['c']
-        cur.execute('SELECT COUNT(*) as c FROM favorites WHERE photo_id=%s', (photo_id,))
-        favorites = cur.fetchone()['c']
-        cur.execute('SELECT c.id, c.content, c.created_at, u.username FROM comments c JOIN users u ON u.id=c.user_id WHERE c.photo_id=%s ORDER BY c.id DESC', (photo_id,))
-        comments = cur.fetchall()
-        liked_by_me = False
-        favorited_by_me = False
-        if authorization and authorization.startswith('Bearer '):
+    if not photo:
+        raise HTTPException(status_code=404, detail='作品不存在')
+    response.headers.update(headers)
+    response.headers['ETag'] = _detail_etag(photo_id, photo.pop('version'), uid)
+    photo['srcset'] = _srcset(photo_id, photo['image_url'] or photo['original_url'], api_origin(request))
+    return normalize_row_urls(photo)
+
+def _load_source(url: str):
+    # 按 URL 取回源图字节：对象存储上的走 get_object，/uploads/ 下的读本地文件
+    key = _r2_key_from_url(url)
+    if key:
+        return _r2_get_bytes(key)
+    if url and '/uploads/' in url:
+        path = _local_path(url.split('/uploads/', 1)[1].split('?', 1)[0])
+        if os.path.commonpath([UPLOADS_ROOT, os.path.abspath(path)]) == UPLOADS_ROOT and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                return f.read()
+    return None
+
+@app.get('/api/img/{photo_id}')
+def photo_variant(photo_id: int, w: int, fmt: str = 'webp', v: str = None):
+    # 响应式尺寸：白名单宽度首次请求时渲染，之后直接从磁盘 LRU 缓存返回
+    if w not in variants.WIDTHS:
+        raise HTTPException(status_code=400, detail='不支持的宽度')
+    if fmt not in variants.FORMATS:
+        raise HTTPException(status_code=400, detail='不支持的格式')
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute('SELECT COALESCE(image_url, original_url) AS src FROM photos WHERE id=%s', (photo_id,))
+        r = cur.fetchone()
+    if not r or not r['src']:
+        raise HTTPException(status_code=404, detail='作品不存在')
+    tag = variants.source_tag(r['src'])
+    # v 与当前源图一致时 URL 内容不会再变，可以长期缓存；否则只做短期缓存
+    if v == tag:
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'public, max-age=300'
+    headers = {'Cache-Control': cache_control}
+    name = variants.cache_name(photo_id, tag, w, fmt)
+    cache = variants.cache()
+    data = cache.get(name)
+    if data is None:
+        data = _r2_get_bytes(f'variants/{name}') if variants.r2_write_through() else None
+        if data is None:
+            content = _load_source(r['src'])
+            if content is None:
+                raise HTTPException(status_code=404, detail='源图不可用')
             try:
-                payload = jwt.decode(authorization[7:], JWT_SECRET, algorithms=['HS256'])
-                uid = payload.get('id')
-                if uid:
-                    cur.execute('SELECT id FROM likes WHERE user_id=%s AND photo_id=%s', (uid, photo_id))
-                    liked_by_me = bool(cur.fetchone())
-                    cur.execute('SELECT id FROM favorites WHERE user_id=%s AND photo_id=%s', (uid, photo_id))
-                    favorited_by_me = bool(cur.fetchone())
+                data = imaging.render(content, [variants.spec(w, fmt)])[0]
+            except imaging.ImageQueueFull:
+                raise HTTPException(status_code=503, detail='图片处理繁忙，请稍后重试')
             except Exception:
-                pass
-    conn.close()
-    photo['tags'] = tags
-    photo['likes'] = likes
-    photo['favorites'] = favorites
-    photo['comments'] = comments
-    photo['liked_by_me'] = liked_by_me
-    photo['favorited_by_me'] = favorited_by_me
-    return normalize_row_urls(photo)
+                raise HTTPException(status_code=422, detail='源图无法解码')
+            if variants.r2_write_through():
+                _r2_put_bytes(f'variants/{name}', data, content_type=variants.media_type(fmt))
+        cache.put(name, data)
+    return Response(content=data, media_type=variants.media_type(fmt), headers=headers)
+
+def _toggle_reaction(table: str, counter: str, photo_id: int, user_id: int):
+    # 单条语句完成：删除已有记录，否则插入；同时按增量维护 photos 上的计数并递增 version
+    sql = f"""
+        WITH del AS (
+            DELETE FROM {table} WHERE user_id = %(uid)s AND photo_id = %(pid)s RETURNING 1
+        ), ins AS (
+            INSERT INTO {table} (user_id, photo_id)
+            SELECT %(uid)s, id FROM photos WHERE id = %(pid)s AND NOT EXISTS (SELECT 1 FROM del)
+            ON CONFLICT (user_id, photo_id) DO NOTHING
+            RETURNING 1
+        )
+        UPDATE photos
+        SET {counter} = GREATEST({counter} + (SELECT COUNT(*) FROM ins) - (SELECT COUNT(*) FROM del), 0),
+            version = version + 1
+        WHERE id = %(pid)s
+        RETURNING {counter} AS cnt, EXISTS (SELECT 1 FROM ins) AS active
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(sql, {'uid': user_id, 'pid': photo_id})
+        row = cur.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail='作品不存在')
+    return row['active'], row['cnt']
 
 @app.post('/api/photos/{photo_id}/like')
 def toggle_like(photo_id: int, request: Request, payload: dict = Depends(auth_required)):
     require_csrf(request, payload)
-    conn = get_conn()
-    liked = False
-    with conn.cursor() as cur:
-        cur.execute('SELECT id FROM photos WHERE id=%s', (photo_id,))
-        if not cur.fetchone():
-            conn.close()
-            raise HTTPException(status_code=404, detail='作品不存在')
-        cur.execute('SELECT id FROM likes WHERE user_id=%s AND photo_id=%s', (payload['id'], photo_id))
-        row = cur.fetchone()
-        if row:
-            cur.execute('DELETE FROM likes WHERE id=%s', (row['id'],))
-            liked = False
-        else:
-            cur.execute('INSERT INTO likes (user_id, photo_id) VALUES (%s,%s)', (payload['id'], photo_id))
-            liked = True
-        cur.execute('SELECT COUNT(*) as c FROM likes WHERE photo_id=%s', (photo_id,))
-        cnt = cur.fetchone()['c']
-    conn.close()
+    liked, cnt = _toggle_reaction('likes', 'like_count', photo_id, payload['id'])
     return {'ok': True, 'liked': liked, 'likes': cnt}
 
 @app.post('/api/photos/{photo_id}/favorite')
 def toggle_favorite(photo_id: int, request: Request, payload: dict = Depends(auth_required)):
     require_csrf(request, payload)
-    conn = get_conn()
-    favorited = False
-    with conn.cursor() as cur:
-        cur.execute('SELECT id FROM photos WHERE id=%s', (photo_id,))
-        if not cur.fetchone():
-            conn.close()
-            raise HTTPException(status_code=404, detail='作品不存在')
-        cur.execute('SELECT id FROM favorites WHERE user_id=%s AND photo_id=%s', (payload['id'], photo_id))
-        row = cur.fetchone()
-        if row:
-            cur.execute('DELETE FROM favorites WHERE id=%s', (row['id'],))
-            favorited = False
-        else:
-            cur.execute('INSERT INTO favorites (user_id, photo_id) VALUES (%s,%s)', (payload['id'], photo_id))
-            favorited = True
-        cur.execute('SELECT COUNT(*) as c FROM favorites WHERE photo_id=%s', (photo_id,))
-        cnt = cur.fetchone()['c']
-    conn.close()
+    favorited, cnt = _toggle_reaction('favorites', 'favorite_count', photo_id, payload['id'])
     return {'ok': True, 'favorited': favorited, 'favorites': cnt}
 
 @app.post('/api/photos/{photo_id}/comment')
@@ -694,120 +1201,65 @@ async def add_comment(photo_id: int, request: Request, payload: dict = Depends(a
     if not isinstance(content, str) or not content.strip():
         raise HTTPException(status_code=400, detail='评论内容不能为空')
     content = content.strip()
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute('SELECT id FROM photos WHERE id=%s', (photo_id,))
-        if not cur.fetchone():
-            conn.close()
-            raise HTTPException(status_code=404, detail='作品不存在')
-        cur.execute('INSERT INTO comments (user_id, photo_id, content) VALUES (%s,%s,%s)', (payload['id'], photo_id, content))
-        cid = cur.lastrowid
-        cur.execute('SELECT c.id, c.content, c.created_at, u.username FROM comments c JOIN users u ON u.id=c.user_id WHERE c.id=%s', (cid,))
-        cmt = cur.fetchone()
-    conn.close()
+    cmt = await adb.run_with_cursor(_insert_comment, photo_id, payload['id'], content)
     return {'ok': True, 'comment': cmt}
 
+def _insert_comment(cur, photo_id: int, user_id: int, content: str):
+    cur.execute('UPDATE photos SET version = version + 1 WHERE id=%s RETURNING id', (photo_id,))
+    if not cur.fetchone():
+        raise HTTPException(status_code=404, detail='作品不存在')
+    cur.execute('INSERT INTO comments (user_id, photo_id, content) VALUES (%s,%s,%s)', (user_id, photo_id, content))
+    cid = cur.lastrowid
+    cur.execute('SELECT c.id, c.content, c.created_at, u.username FROM comments c JOIN users u ON u.id=c.user_id WHERE c.id=%s', (cid,))
+    return cur.fetchone()
+
+def _check_upload_quota(usage: dict, extra: int):
+    day_limit = int(os.getenv('UPLOAD_MAX_PER_DAY_BYTES', '0') or '0')
+    month_limit = int(os.getenv('UPLOAD_MAX_PER_MONTH_BYTES', '0') or '0')
+    if day_limit and usage.get('day', 0) + extra > day_limit:
+        raise HTTPException(status_code=429, detail='超出每日上传总量限制')
+    if month_limit and usage.get('month', 0) + extra > month_limit:
+        raise HTTPException(status_code=429, detail='超出每月上传总量限制')
+
 @app.post('/api/photos')
 def upload_photos(request: Request, payload: dict = Depends(auth_required), files: List[UploadFile] = File(...), title: str = Form(None), description: str = Form(None), camera: str = Form(None), settings: str = Form(None), category: str = Form(None), tags: str = Form(None)):
     role_required(payload, 'admin')
     require_csrf(request, payload)
     user_id = payload['id']
-    uploads_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
-    originals = os.path.join(uploads_root, 'originals')
-    processed = os.path.join(uploads_root, 'processed')
-    thumbs = os.path.join(uploads_root, 'thumbs')
-    items = []
-    conn = get_conn()
-    with conn.cursor() as cur:
-        day_limit = int(os.getenv('UPLOAD_MAX_PER_DAY_BYTES', '0') or '0')
-        month_limit = int(os.getenv('UPLOAD_MAX_PER_MONTH_BYTES', '0') or '0')
-        cur.execute('SELECT COALESCE(SUM(size_bytes),0) as sum FROM photos WHERE user_id=%s AND DATE(created_at)=CURDATE()', (user_id,))
-        day_used = int(cur.fetchone()['sum'] or 0)
-        cur.execute("SELECT COALESCE(SUM(size_bytes),0) as sum FROM photos WHERE user_id=%s AND DATE_FORMAT(created_at,'%%Y-%%m')=DATE_FORMAT(CURDATE(),'%%Y-%%m')", (user_id,))
-        month_used = int(cur.fetchone()['sum'] or 0)
+    sizes = [_upload_size(uf) for uf in files]
+    with get_conn() as conn, conn.cursor() as cur:
+        _check_upload_quota(get_upload_usage(cur, user_id), sum(sizes))
+    stored = []
+    try:
+        planned = []
         for uf in files:
             base = f"{int(datetime.utcnow().timestamp()*1000)}-{os.urandom(4).hex()}"
             ext = os.path.splitext(uf.filename)[1].lower() or '.jpg'
-            size_bytes = 0
-            uf.file.seek(0)
-            content = b''
-            while True:
-                chunk = uf.file.read(1024*1024)
-                if not chunk:
-                    break
-                content += chunk
-                size_bytes += len(chunk)
-            if day_limit and (day_used + size_bytes) > day_limit:
-                raise HTTPException(status_code=429, detail='超出每日上传总量限制')
-            if month_limit and (month_used + size_bytes) > month_limit:
-                raise HTTPException(status_code=429, detail='超出每月上传总量限制')
-            day_used += size_bytes
-            month_used += size_bytes
-            
-            image_url = None
-            thumb_url = None
-            original_url = None
-            orig_key = f"originals/{base}{ext}"
-            ok_orig = _r2_put_bytes(orig_key, content, content_type=uf.content_type or 'application/octet-stream')
-            if ok_orig:
-                original_url = _r2_url(orig_key)
-            try:
-                img = Image.open(io.BytesIO(content))
-                img_copy = img.copy(); img_copy.thumbnail((2000, 2000))
-                buf_proc = io.BytesIO(); img_copy.save(buf_proc, format='WEBP', quality=80)
-                proc_key = f"processed/{base}.webp"
-                ok_proc = _r2_put_bytes(proc_key, buf_proc.getvalue(), content_type='image/webp')
-                if ok_proc:
-                    image_url = _r2_url(proc_key)
-                th = img.copy(); th.thumbnail((480, 480))
-                buf_th = io.BytesIO(); th.save(buf_th, format='WEBP', quality=70)
-                th_key = f"thumbs/{base}_thumb.webp"
-                ok_th = _r2_put_bytes(th_key, buf_th.getvalue(), content_type='image/webp')
-                if ok_th:
-                    thumb_url = _r2_url(th_key)
-            except Exception:
-                pass
-            if not image_url:
-                image_url = original_url
-            if not thumb_url:
-                thumb_url = image_url or original_url
-            
-            if not original_url:
-                orig_path = os.path.join(originals, base + ext)
-                proc_path = os.path.join(processed, base + '.webp')
-                thumb_path = os.path.join(thumbs, base + '_thumb.webp')
-                with open(orig_path, 'wb') as out:
-                    out.write(content)
-                try:
-                    img = Image.open(orig_path)
-                    img_copy = img.copy()
-                    img_copy.thumbnail((2000, 2000))
-                    img_copy.save(proc_path, format='WEBP', quality=80)
-                    th = img.copy()
-                    th.thumbnail((480, 480))
-                    th.save(thumb_path, format='WEBP', quality=70)
-                    image_url = asset_url(f'uploads/processed/{os.path.basename(proc_path)}')
-                    thumb_url = asset_url(f'uploads/thumbs/{os.path.basename(thumb_path)}')
-                except Exception:
-                    image_url = asset_url(f'uploads/originals/{os.path.basename(orig_path)}')
-                    thumb_url = image_url
-                original_url = asset_url(f'uploads/originals/{os.path.basename(orig_path)}')
-            t = title or uf.filename
-            cur.execute('INSERT INTO photos (user_id, title, description, camera, settings, category, original_url, image_url, thumb_url, size_bytes) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)', (user_id, t, description, camera, settings, category, original_url, image_url, thumb_url, size_bytes))
-            photo_id = cur.lastrowid
-            tags_arr = [s.strip() for s in (tags or '').split(',') if s.strip()]
-            for tg in tags_arr:
-                cur.execute('SELECT id FROM tags WHERE name=%s', (tg,))
-                r = cur.fetchone()
-                tag_id = None
-                if r:
-                    tag_id = r['id']
-                else:
-                    cur.execute('INSERT INTO tags (name) VALUES (%s)', (tg,))
-                    tag_id = cur.lastrowid
-                cur.execute('INSERT IGNORE INTO photo_tags (photo_id, tag_id) VALUES (%s,%s)', (photo_id, tag_id))
-            items.append({'id': photo_id, 'image_url': image_url, 'thumb_url': thumb_url})
-    conn.close()
+            planned.append((uf, base, f"originals/{base}{ext}"))
+        # 一批文件的原图并发写入；任一失败时整批放弃，已写入的在下面统一清理
+        error = None
+        for (uf, base, orig_key), (res, err) in zip(planned, _io_map(_store_upload, [(key, uf) for uf, _, key in planned])):
+            if err is not None:
+                error = error or err
+                continue
+            original_url, in_r2, size_bytes, sha = res
+            stored.append((uf, base, orig_key, in_r2, original_url, size_bytes, sha))
+        if error is not None:
+            raise error
+        items = []
+        with get_conn() as conn, atomic(conn), conn.cursor() as cur:
+            # 台账与作品在同一事务里写入；台账行锁让同一用户的并发上传按顺序通过配额检查
+            usage = add_upload_usage(cur, user_id, sum(st[5] for st in stored), len(stored))
+            _check_upload_quota(usage, 0)
+            for uf, base, orig_key, in_r2, original_url, size_bytes, sha in stored:
+                meta = {'title': title or uf.filename, 'description': description, 'camera': camera, 'settings': settings, 'category': category}
+                items.append(_insert_uploaded_photo(cur, user_id, meta, base, orig_key, in_r2, original_url, size_bytes, sha))
+            tagging.link(cur, [it['id'] for it in items], tagging.parse(tags))
+    except BaseException:
+        for _, _, orig_key, in_r2, _, _, _ in stored:
+            _discard_object(orig_key, in_r2)
+        raise
+    response_cache.invalidate('photos')
     return {'ok': True, 'items': items}
 
 @app.post('/api/admin/r2-import')
@@ -817,48 +1269,20 @@ def admin_r2_import(request: Request, payload: dict = Depends(auth_required), ur
     key = _r2_key_from_url(url) or (url or '').strip()
     if not key:
         raise HTTPException(status_code=400, detail='无效URL')
-    data = _r2_get_bytes(key)
-    if not data:
+    size = _r2_stat_size(key)
+    if size is None:
         raise HTTPException(status_code=404, detail='对象不存在或不可读取')
     base = os.path.splitext(os.path.basename(key))[0]
-    ext = os.path.splitext(key)[1].lower() or '.jpg'
-    image_url = None
-    thumb_url = None
-    try:
-        img = Image.open(io.BytesIO(data))
-        img_copy = img.copy()
-        img_copy.thumbnail((2000, 2000))
-        buf_proc = io.BytesIO()
-        img_copy.save(buf_proc, format='WEBP', quality=80)
-        proc_key = f"processed/{base}.webp"
-        ok_proc = _r2_put_bytes(proc_key, buf_proc.getvalue(), content_type='image/webp')
-        th = img.copy()
-        th.thumbnail((480, 480))
-        buf_th = io.BytesIO()
-        th.save(buf_th, format='WEBP', quality=70)
-        th_key = f"thumbs/{base}_thumb.webp"
-        ok_th = _r2_put_bytes(th_key, buf_th.getvalue(), content_type='image/webp')
-        image_url = _r2_url(proc_key) if ok_proc else None
-        thumb_url = _r2_url(th_key) if ok_th else None
-    except Exception:
-        pass
     original_url = _r2_url(key)
-    conn = get_conn()
-    with conn.cursor() as cur:
+    with get_conn() as conn, atomic(conn), conn.cursor() as cur:
         t = title or os.path.basename(key)
-        cur.execute('INSERT INTO photos (user_id, title, description, camera, settings, category, original_url, image_url, thumb_url, size_bytes) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)', (payload['id'], t, description, camera, settings, category, original_url, image_url or original_url, thumb_url or image_url or original_url, len(data)))
+        cur.execute("INSERT INTO photos (user_id, title, description, camera, settings, category, original_url, image_url, thumb_url, size_bytes, status) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,'processing')", (payload['id'], t, description, camera, settings, category, original_url, original_url, original_url, size))
         photo_id = cur.lastrowid
-        tags_arr = [s.strip() for s in (tags or '').split(',') if s.strip()]
-        for tg in tags_arr:
-            cur.execute('SELECT id FROM tags WHERE name=%s', (tg,))
-            r = cur.fetchone()
-            tag_id = r['id'] if r else None
-            if tag_id is None:
-                cur.execute('INSERT INTO tags (name) VALUES (%s)', (tg,))
-                tag_id = cur.lastrowid
-            cur.execute('INSERT IGNORE INTO photo_tags (photo_id, tag_id) VALUES (%s,%s)', (photo_id, tag_id))
-    conn.close()
-    return {'ok': True, 'id': photo_id, 'image_url': image_url or original_url, 'thumb_url': thumb_url or image_url or original_url}
+        add_upload_usage(cur, payload['id'], size)
+        _enqueue_derivatives(cur, photo_id, base, key, True)
+        tagging.link(cur, [photo_id], tagging.parse(tags))
+    response_cache.invalidate('photos')
+    return {'ok': True, 'id': photo_id, 'image_url': original_url, 'thumb_url': original_url, 'status': 'processing'}
 
 @app.post('/api/admin/r2-upload')
 def admin_r2_upload(request: Request, payload: dict = Depends(auth_required), file: UploadFile = File(...), title: str = Form(None), description: str = Form(None), camera: str = Form(None), settings: str = Form(None), category: str = Form(None), tags: str = Form(None)):
@@ -866,66 +1290,39 @@ def admin_r2_upload(request: Request, payload: dict = Depends(auth_required), fi
     require_csrf(request, payload)
     base = f"{int(datetime.utcnow().timestamp()*1000)}-{os.urandom(4).hex()}"
     ext = os.path.splitext(file.filename or '')[1].lower() or '.jpg'
-    content = file.file.read()
-    image_url = None
-    thumb_url = None
-    original_url = None
-    ok_orig = _r2_put_bytes(f"originals/{base}{ext}", content, content_type=file.content_type or 'application/octet-stream')
-    if ok_orig:
-        original_url = _r2_url(f"originals/{base}{ext}")
-    try:
-        img = Image.open(io.BytesIO(content))
-        img_copy = img.copy(); img_copy.thumbnail((2000, 2000))
-        buf_proc = io.BytesIO(); img_copy.save(buf_proc, format='WEBP', quality=80)
-        th = img.copy(); th.thumbnail((480, 480))
-        buf_th = io.BytesIO(); th.save(buf_th, format='WEBP', quality=70)
-        ok_proc = _r2_put_bytes(f"processed/{base}.webp", buf_proc.getvalue(), content_type='image/webp')
-        ok_th = _r2_put_bytes(f"thumbs/{base}_thumb.webp", buf_th.getvalue(), content_type='image/webp')
-        image_url = _r2_url(f"processed/{base}.webp") if ok_proc else None
-        thumb_url = _r2_url(f"thumbs/{base}_thumb.webp") if ok_th else None
-    except Exception:
-        pass
-    if not image_url:
-        image_url = original_url
-    if not thumb_url:
-        thumb_url = image_url or original_url
-    if not original_url:
-        uploads_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
-        originals = os.path.join(uploads_root, 'originals')
-        processed = os.path.join(uploads_root, 'processed')
-        thumbs = os.path.join(uploads_root, 'thumbs')
-        orig_path = os.path.join(originals, base + ext)
-        proc_path = os.path.join(processed, base + '.webp')
-        th_path = os.path.join(thumbs, base + '_thumb.webp')
-        with open(orig_path, 'wb') as out:
-            out.write(content)
-        try:
-            img = Image.open(orig_path)
-            img_copy = img.copy(); img_copy.thumbnail((2000, 2000))
-            img_copy.save(proc_path, format='WEBP', quality=80)
-            th = img.copy(); th.thumbnail((480, 480))
-            th.save(th_path, format='WEBP', quality=70)
-            image_url = asset_url(f'uploads/processed/{os.path.basename(proc_path)}')
-            thumb_url = asset_url(f'uploads/thumbs/{os.path.basename(th_path)}')
-        except Exception:
-            image_url = asset_url(f'uploads/originals/{os.path.basename(orig_path)}')
-            thumb_url = image_url
-        original_url = asset_url(f'uploads/originals/{os.path.basename(orig_path)}')
-    conn = get_conn()
-    with conn.cursor() as cur:
-        t = title or file.filename
-        cur.execute('INSERT INTO photos (user_id, title, description, camera, settings, category, original_url, image_url, thumb_url, size_bytes) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)', (payload['id'], t, description, camera, settings, category, original_url, image_url, thumb_url, len(content)))
-        photo_id = cur.lastrowid
-        tags_arr = [s.strip() for s in (tags or '').split(',') if s.strip()]
-        for tg in tags_arr:
-            cur.execute('SELECT id FROM tags WHERE name=%s', (tg,))
-            r = cur.fetchone(); tag_id = r['id'] if r else None
-            if tag_id is None:
-                cur.execute('INSERT INTO tags (name) VALUES (%s)', (tg,))
-                tag_id = cur.lastrowid
-            cur.execute('INSERT IGNORE INTO photo_tags (photo_id, tag_id) VALUES (%s,%s)', (photo_id, tag_id))
-    conn.close()
-    return {'ok': True, 'id': photo_id, 'image_url': image_url, 'thumb_url': thumb_url}
+    orig_key = f"originals/{base}{ext}"
+    original_url, in_r2, size_bytes, sha = _store_upload(orig_key, file)
+    with get_conn() as conn, atomic(conn), conn.cursor() as cur:
+        meta = {'title': title or file.filename, 'description': description, 'camera': camera, 'settings': settings, 'category': category}
+        item = _insert_uploaded_photo(cur, payload['id'], meta, base, orig_key, in_r2, original_url, size_bytes, sha)
+        add_upload_usage(cur, payload['id'], size_bytes)
+        tagging.link(cur, [item['id']], tagging.parse(tags))
+    response_cache.invalidate('photos')
+    return {'ok': True, **item}
+
+@app.get('/api/upload-status')
+def upload_status(ids: str, payload: dict = Depends(auth_required)):
+    id_list = [int(x) for x in ids.split(',') if x.strip().isdigit()][:200]
+    rows = []
+    if id_list:
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT p.id, p.status,
+                       COALESCE(p.image_url, p.original_url) AS image_url,
+                       COALESCE(p.thumb_url, p.image_url, p.original_url) AS thumb_url,
+                       j.status AS job_status, j.attempts, j.error
+                FROM photos p
+                LEFT JOIN LATERAL (
+                    SELECT status, attempts, error FROM jobs WHERE jobs.photo_id = p.id ORDER BY id DESC LIMIT 1
+                ) j ON true
+                WHERE p.id = ANY(%s)
+                ORDER BY p.id
+            """, (id_list,))
+            rows = cur.fetchall()
+    counts = {'ready': 0, 'processing': 0, 'failed': 0}
+    for r in rows:
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+    return {'total': len(rows), **counts, 'items': [normalize_row_urls(r) for r in rows]}
 
 @app.post('/api/admin/r2-delete')
 def admin_r2_delete(request: Request, payload: dict = Depends(auth_required), url: str = Form(...), remove_related: bool = Form(True)):
@@ -937,61 +1334,33 @@ def admin_r2_delete(request: Request, payload: dict = Depends(auth_required), ur
     _r2_remove(key)
     if not remove_related:
         return {'ok': True}
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute('SELECT * FROM photos WHERE original_url=%s OR image_url=%s OR thumb_url=%s', (url, url, url))
-        rows = cur.fetchall()
-        for photo in rows:
-            pid = photo['id']
-            cur.execute('SELECT id, image_url, thumb_url FROM home_carousel WHERE photo_id=%s', (pid,))
-            related = cur.fetchall()
-            for hc in related:
-                ik = _r2_key_from_url(hc.get('image_url') or '')
-                tk = _r2_key_from_url(hc.get('thumb_url') or '')
-                if ik:
-                    _r2_remove(ik)
-                if tk:
-                    _r2_remove(tk)
-                cur.execute('DELETE FROM home_carousel WHERE id=%s', (hc['id'],))
-            for u in [photo.get('image_url'), photo.get('thumb_url'), photo.get('original_url')]:
-                if u:
-                    k = _r2_key_from_url(u)
-                    if k:
-                        _r2_remove(k)
-            cur.execute('DELETE FROM photo_tags WHERE photo_id=%s', (pid,))
-            cur.execute('DELETE FROM likes WHERE photo_id=%s', (pid,))
-            cur.execute('DELETE FROM favorites WHERE photo_id=%s', (pid,))
-            cur.execute('DELETE FROM comments WHERE photo_id=%s', (pid,))
-            cur.execute('DELETE FROM photos WHERE id=%s', (pid,))
-    conn.close()
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute('SELECT id FROM photos WHERE original_url=%s OR image_url=%s OR thumb_url=%s', (url, url, url))
+        ids = [r['id'] for r in cur.fetchall()]
+    if ids:
+        _delete_photos(ids)
     return {'ok': True}
 
 def _process_carousel_image(content: bytes):
-    img = Image.open(io.BytesIO(content))
-    img = img.convert('RGB') if img.mode not in ('RGB', 'RGBA') else img
-    base = img.copy()
-    base.thumbnail((2560, 1600))
-    th = img.copy()
-    th.thumbnail((480, 480))
-    return base, th
+    img_data, thumb_data = imaging.render(content, imaging.CAROUSEL_SPECS)
+    return img_data, thumb_data
 
 @app.get('/api/carousel')
-def list_carousel():
-    conn = get_conn()
-    with conn.cursor() as cur:
+def list_carousel(request: Request):
+    return _cached_json(request, 'carousel', None, _query_carousel)
+
+def _query_carousel():
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute('SELECT hc.id, hc.image_url, hc.thumb_url, hc.sort_order, p.title FROM home_carousel hc LEFT JOIN photos p ON p.id = hc.photo_id ORDER BY hc.sort_order ASC, hc.id ASC')
         rows = cur.fetchall()
-    conn.close()
     return [normalize_row_urls(r) for r in rows]
 
 @app.get('/api/admin/carousel')
 def admin_list_carousel(payload: dict = Depends(auth_required)):
     role_required(payload, 'admin')
-    conn = get_conn()
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute('SELECT hc.id, hc.image_url, hc.thumb_url, hc.sort_order, p.title FROM home_carousel hc LEFT JOIN photos p ON p.id = hc.photo_id ORDER BY hc.sort_order ASC, hc.id ASC')
         rows = cur.fetchall()
-    conn.close()
     return [normalize_row_urls(r) for r in rows]
 
 @app.post('/api/admin/carousel')
@@ -1002,48 +1371,31 @@ def admin_add_carousel(request: Request, payload: dict = Depends(auth_required),
         raise HTTPException(status_code=400, detail='仅支持JPG/PNG图片')
     content = file.file.read()
     try:
-        img, thumb = _process_carousel_image(content)
+        img_data, thumb_data = _process_carousel_image(content)
     except Exception:
         raise HTTPException(status_code=400, detail='图片处理失败或格式不支持')
     base = f"{int(datetime.utcnow().timestamp()*1000)}-{os.urandom(4).hex()}"
-    buf_img = io.BytesIO(); img.save(buf_img, format='WEBP', quality=85)
-    buf_th = io.BytesIO(); thumb.save(buf_th, format='WEBP', quality=75)
-    car_key = f"carousel/{base}.webp"
-    th_key = f"carousel_thumbs/{base}_thumb.webp"
-    ok_img = _r2_put_bytes(car_key, buf_img.getvalue(), content_type='image/webp')
-    ok_th = _r2_put_bytes(th_key, buf_th.getvalue(), content_type='image/webp')
-    image_url = _r2_url(car_key) if ok_img else None
-    thumb_url = _r2_url(th_key) if ok_th else None
-    if not (image_url and thumb_url):
-        uploads_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
-        car_dir = os.path.join(uploads_root, 'carousel')
-        car_thumbs = os.path.join(uploads_root, 'carousel_thumbs')
-        proc_path = os.path.join(car_dir, base + '.webp')
-        thumb_path = os.path.join(car_thumbs, base + '_thumb.webp')
-        img.save(proc_path, format='WEBP', quality=85)
-        thumb.save(thumb_path, format='WEBP', quality=75)
-        image_url = asset_url(f'uploads/carousel/{os.path.basename(proc_path)}')
-        thumb_url = asset_url(f'uploads/carousel_thumbs/{os.path.basename(thumb_path)}')
-    conn = get_conn()
-    with conn.cursor() as cur:
+    (image_url, img_in_r2), (thumb_url, th_in_r2) = _store_objects([
+        (f"carousel/{base}.webp", img_data, 'image/webp'),
+        (f"carousel_thumbs/{base}_thumb.webp", thumb_data, 'image/webp'),
+    ])
+    with get_conn() as conn, atomic(conn), conn.cursor() as cur:
         # 同步到作品库
         title = os.path.splitext(file.filename or '')[0] or '首页轮播图'
         cur.execute('INSERT INTO photos (user_id, title, description, camera, settings, category, original_url, image_url, thumb_url, size_bytes) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)', (payload['id'], title, None, None, None, 'carousel', None, image_url, thumb_url, len(content)))
         photo_id = cur.lastrowid
+        add_upload_usage(cur, payload['id'], len(content))
         cur.execute('SELECT COUNT(*) as c FROM home_carousel')
         c = cur.fetchone()['c']
         if c >= 9:
-            try:
-                os.remove(proc_path)
-                os.remove(thumb_path)
-            except Exception:
-                pass
+            _discard_object(f"carousel/{base}.webp", img_in_r2)
+            _discard_object(f"carousel_thumbs/{base}_thumb.webp", th_in_r2)
             raise HTTPException(status_code=400, detail='最多只能上传9张轮播图')
         cur.execute('SELECT COALESCE(MAX(sort_order), 0) as m FROM home_carousel')
         m = cur.fetchone()['m']
         cur.execute('INSERT INTO home_carousel (image_url, thumb_url, photo_id, sort_order) VALUES (%s,%s,%s,%s)', (image_url, thumb_url, photo_id, m + 1))
         new_id = cur.lastrowid
-    conn.close()
+    response_cache.invalidate('photos', 'carousel')
     return {'ok': True, 'id': new_id, 'image_url': image_url, 'thumb_url': thumb_url}
 
 @app.put('/api/admin/carousel/sort')
@@ -1054,13 +1406,9 @@ async def admin_sort_carousel(request: Request, payload: dict = Depends(auth_req
     ids = data.get('ids') or []
     if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
         raise HTTPException(status_code=400, detail='请求格式错误')
-    conn = get_conn()
-    with conn.cursor() as cur:
-        order = 1
-        for cid in ids:
-            cur.execute('UPDATE home_carousel SET sort_order=%s WHERE id=%s', (order, cid))
-            order += 1
-    conn.close()
+    if ids:
+        await adb.execute('UPDATE home_carousel hc SET sort_order=v.ord FROM unnest(%s::int[]) WITH ORDINALITY AS v(id, ord) WHERE hc.id=v.id', (ids,))
+    response_cache.invalidate('carousel')
     return {'ok': True}
 
 @app.delete('/api/admin/carousel/{cid}')
@@ -1070,14 +1418,12 @@ def admin_delete_carousel(cid: int, request: Request, payload: dict = Depends(au
     uploads_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
     car_dir = os.path.join(uploads_root, 'carousel')
     car_thumbs = os.path.join(uploads_root, 'carousel_thumbs')
-    conn = get_conn()
     image = None
     thumb = None
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute('SELECT image_url, thumb_url FROM home_carousel WHERE id=%s', (cid,))
         row = cur.fetchone()
         if not row:
-            conn.close()
             raise HTTPException(status_code=404, detail='轮播图不存在')
         image = os.path.join(car_dir, os.path.basename(row['image_url'] or ''))
         thumb = os.path.join(car_thumbs, os.path.basename(row['thumb_url'] or ''))
@@ -1088,7 +1434,6 @@ def admin_delete_carousel(cid: int, request: Request, payload: dict = Depends(au
         if tk:
             _r2_remove(tk)
         cur.execute('DELETE FROM home_carousel WHERE id=%s', (cid,))
-    conn.close()
     try:
         if image and os.path.exists(image):
             os.remove(image)
@@ -1096,6 +1441,7 @@ def admin_delete_carousel(cid: int, request: Request, payload: dict = Depends(au
             os.remove(thumb)
     except Exception:
         pass
+    response_cache.invalidate('carousel')
     return {'ok': True}
 
 @app.put('/api/admin/carousel/{cid}')
@@ -1109,44 +1455,34 @@ def admin_replace_carousel(cid: int, request: Request, payload: dict = Depends(a
     car_dir = os.path.join(uploads_root, 'carousel')
     car_thumbs = os.path.join(uploads_root, 'carousel_thumbs')
     try:
-        img, thumb = _process_carousel_image(content)
+        img_data, thumb_data = _process_carousel_image(content)
     except Exception:
         raise HTTPException(status_code=400, detail='图片处理失败或格式不支持')
-    conn = get_conn()
     old_proc = None
     old_thumb = None
-    with conn.cursor() as cur:
+    # 对象存储写入放在事务之外，不在持有行锁的事务里等待网络往返
+    base = f"{int(datetime.utcnow().timestamp()*1000)}-{os.urandom(4).hex()}"
+    (image_url, img_in_r2), (thumb_url, th_in_r2) = _store_objects([
+        (f"carousel/{base}.webp", img_data, 'image/webp'),
+        (f"carousel_thumbs/{base}_thumb.webp", thumb_data, 'image/webp'),
+    ])
+    with get_conn() as conn, atomic(conn), conn.cursor() as cur:
         cur.execute('SELECT image_url, thumb_url FROM home_carousel WHERE id=%s', (cid,))
         row = cur.fetchone()
         if not row:
-            conn.close()
+            _discard_object(f"carousel/{base}.webp", img_in_r2)
+            _discard_object(f"carousel_thumbs/{base}_thumb.webp", th_in_r2)
             raise HTTPException(status_code=404, detail='轮播图不存在')
         if row['image_url']:
             old_proc = os.path.join(car_dir, os.path.basename(row['image_url']))
         if row['thumb_url']:
             old_thumb = os.path.join(car_thumbs, os.path.basename(row['thumb_url']))
-        base = f"{int(datetime.utcnow().timestamp()*1000)}-{os.urandom(4).hex()}"
-        buf_img = io.BytesIO(); img.save(buf_img, format='WEBP', quality=85)
-        buf_th = io.BytesIO(); thumb.save(buf_th, format='WEBP', quality=75)
-        car_key = f"carousel/{base}.webp"
-        th_key = f"carousel_thumbs/{base}_thumb.webp"
-        ok_img = _r2_put_bytes(car_key, buf_img.getvalue(), content_type='image/webp')
-        ok_th = _r2_put_bytes(th_key, buf_th.getvalue(), content_type='image/webp')
-        image_url = _r2_url(car_key) if ok_img else None
-        thumb_url = _r2_url(th_key) if ok_th else None
-        if not (image_url and thumb_url):
-            proc_path = os.path.join(car_dir, base + '.webp')
-            thumb_path = os.path.join(car_thumbs, base + '_thumb.webp')
-            img.save(proc_path, format='WEBP', quality=85)
-            thumb.save(thumb_path, format='WEBP', quality=75)
-            image_url = asset_url(f'uploads/carousel/{os.path.basename(proc_path)}')
-            thumb_url = asset_url(f'uploads/carousel_thumbs/{os.path.basename(thumb_path)}')
         # 同步到作品库
         title = os.path.splitext(file.filename or '')[0] or '首页轮播图'
         cur.execute('INSERT INTO photos (user_id, title, description, camera, settings, category, original_url, image_url, thumb_url, size_bytes) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)', (payload['id'], title, None, None, None, 'carousel', None, image_url, thumb_url, len(content)))
         new_pid = cur.lastrowid
+        add_upload_usage(cur, payload['id'], len(content))
         cur.execute('UPDATE home_carousel SET image_url=%s, thumb_url=%s, photo_id=%s WHERE id=%s', (image_url, thumb_url, new_pid, cid))
-    conn.close()
     try:
         if old_proc and os.path.exists(old_proc):
             os.remove(old_proc)
@@ -1154,25 +1490,25 @@ def admin_replace_carousel(cid: int, request: Request, payload: dict = Depends(a
             os.remove(old_thumb)
     except Exception:
         pass
+    response_cache.invalidate('photos', 'carousel')
     return {'ok': True, 'id': cid, 'image_url': image_url, 'thumb_url': thumb_url}
 
 @app.get('/api/home-videos')
-def list_home_videos():
-    conn = get_conn()
-    with conn.cursor() as cur:
+def list_home_videos(request: Request):
+    return _cached_json(request, 'home_videos', None, _query_home_videos)
+
+def _query_home_videos():
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute('SELECT id, video_url, title, sort_order FROM home_videos ORDER BY sort_order ASC, id ASC')
         rows = cur.fetchall()
-    conn.close()
     return [normalize_row_urls(r) for r in rows]
 
 @app.get('/api/admin/home-videos')
 def admin_list_home_videos(payload: dict = Depends(auth_required)):
     role_required(payload, 'super_admin')
-    conn = get_conn()
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute('SELECT id, video_url, title, sort_order FROM home_videos ORDER BY sort_order ASC, id ASC')
         rows = cur.fetchall()
-    conn.close()
     return [normalize_row_urls(r) for r in rows]
 
 @app.post('/api/admin/home-videos')
@@ -1183,23 +1519,13 @@ def admin_add_home_video(request: Request, payload: dict = Depends(auth_required
         raise HTTPException(status_code=400, detail='仅支持视频文件')
     base = f"{int(datetime.utcnow().timestamp()*1000)}-{os.urandom(4).hex()}"
     ext = os.path.splitext(file.filename or '')[1].lower() or '.mp4'
-    content = file.file.read()
-    uploads_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
-    videos_dir = os.path.join(uploads_root, 'videos')
-    ok = _r2_put_bytes(f"videos/{base}{ext}", content, content_type=file.content_type or 'application/octet-stream')
-    video_url = _r2_url(f"videos/{base}{ext}") if ok else None
-    if not video_url:
-        path = os.path.join(videos_dir, base + ext)
-        with open(path, 'wb') as out:
-            out.write(content)
-        video_url = asset_url(f"uploads/videos/{os.path.basename(path)}")
-    conn = get_conn()
-    with conn.cursor() as cur:
+    video_url, _, _, _ = _store_upload(f"videos/{base}{ext}", file)
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute('SELECT COALESCE(MAX(sort_order),0) as m FROM home_videos')
         m = cur.fetchone()['m']
         cur.execute('INSERT INTO home_videos (video_url, title, user_id, sort_order) VALUES (%s,%s,%s,%s)', (video_url, title, payload['id'], m + 1))
         vid = cur.lastrowid
-    conn.close()
+    response_cache.invalidate('home_videos')
     return {'ok': True, 'id': vid, 'video_url': video_url}
 
 @app.delete('/api/admin/home-videos/{vid}')
@@ -1208,12 +1534,10 @@ def admin_delete_home_video(vid: int, request: Request, payload: dict = Depends(
     require_csrf(request, payload)
     uploads_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
     videos_dir = os.path.join(uploads_root, 'videos')
-    conn = get_conn()
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute('SELECT video_url FROM home_videos WHERE id=%s', (vid,))
         row = cur.fetchone()
         if not row:
-            conn.close()
             raise HTTPException(status_code=404, detail='视频不存在')
         u = row['video_url']
         k = _r2_key_from_url(u)
@@ -1221,12 +1545,12 @@ def admin_delete_home_video(vid: int, request: Request, payload: dict = Depends(
             _r2_remove(k)
         p = os.path.join(videos_dir, os.path.basename(u or ''))
         cur.execute('DELETE FROM home_videos WHERE id=%s', (vid,))
-    conn.close()
     try:
         if p and os.path.exists(p):
             os.remove(p)
     except Exception:
         pass
+    response_cache.invalidate('home_videos')
     return {'ok': True}
 
 @app.put('/api/photos/{photo_id}')
@@ -1250,164 +1574,98 @@ async def update_photo(photo_id: int, request: Request, payload: dict = Depends(
                     fields[k] = v
     except Exception:
         pass
-    conn = get_conn()
-    before = None
-    with conn.cursor() as cur:
-        cur.execute('SELECT * FROM photos WHERE id=%s', (photo_id,))
-        photo = cur.fetchone()
-        if not photo:
-            conn.close()
-            raise HTTPException(status_code=404, detail='作品不存在')
-        if payload.get('role') not in ('admin','super_admin') and photo['user_id'] != payload['id']:
-            conn.close()
-            raise HTTPException(status_code=403, detail='无权限')
-        sets = []
-        params = []
-        for k in ['title','description','camera','settings','category']:
-            v = fields.get(k)
-            if isinstance(v, str):
-                sets.append(f"{k}=%s")
-                params.append(v)
-        if sets:
-            sql = f"UPDATE photos SET {', '.join(sets)} WHERE id=%s"
-            params.append(photo_id)
-            cur.execute(sql, params)
-        tg = fields.get('tags')
-        if isinstance(tg, str):
-            cur.execute('DELETE FROM photo_tags WHERE photo_id=%s', (photo_id,))
-            tags_arr = [s.strip() for s in tg.split(',') if s.strip()]
-            for name in tags_arr:
-                cur.execute('SELECT id FROM tags WHERE name=%s', (name,))
-                r = cur.fetchone()
-                tag_id = r['id'] if r else None
-                if tag_id is None:
-                    cur.execute('INSERT INTO tags (name) VALUES (%s)', (name,))
-                    tag_id = cur.lastrowid
-                cur.execute('INSERT IGNORE INTO photo_tags (photo_id, tag_id) VALUES (%s,%s)', (photo_id, tag_id))
-    conn.close()
+    # UPDATE 与标签的删除/重建放在同一事务里，避免中途失败留下标签被清空的作品
+    await adb.run_in_transaction(_apply_photo_update, photo_id, payload, fields)
+    response_cache.invalidate('photos', 'carousel')
     return {'ok': True}
 
+def _apply_photo_update(cur, photo_id: int, payload: dict, fields: dict):
+    cur.execute('SELECT * FROM photos WHERE id=%s FOR UPDATE', (photo_id,))
+    photo = cur.fetchone()
+    if not photo:
+        raise HTTPException(status_code=404, detail='作品不存在')
+    if payload.get('role') not in ('admin','super_admin') and photo['user_id'] != payload['id']:
+        raise HTTPException(status_code=403, detail='无权限')
+    sets = ['version = version + 1']
+    params = []
+    for k in ['title','description','camera','settings','category']:
+        v = fields.get(k)
+        if isinstance(v, str):
+            sets.append(f"{k}=%s")
+            params.append(v)
+    if len(sets) > 1 or isinstance(fields.get('tags'), str):
+        sql = f"UPDATE photos SET {', '.join(sets)} WHERE id=%s"
+        params.append(photo_id)
+        cur.execute(sql, params)
+    tg = fields.get('tags')
+    if isinstance(tg, str):
+        tagging.link(cur, [photo_id], tagging.parse(tg), replace=True)
+
+@app.delete('/api/photos')
+@query_budget(10)
+async def delete_photos(request: Request, payload: dict = Depends(auth_required)):
+    require_csrf(request, payload)
+    data = await request.json()
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        raise HTTPException(status_code=400, detail='请求格式错误')
+    if len(ids) > 10000:
+        raise HTTPException(status_code=400, detail='单次最多删除 10000 个作品')
+    # 普通用户只能删除自己的作品，不属于自己的 id 会被忽略
+    owner_id = None if payload.get('role') in ('admin', 'super_admin') else payload['id']
+    deleted = await run_in_threadpool(_delete_photos, ids, owner_id) if ids else []
+    return {'ok': True, 'deleted': len(deleted), 'ids': deleted}
+
 @app.delete('/api/photos/{photo_id}')
+@query_budget(11)
 def delete_photo(photo_id: int, request: Request, payload: dict = Depends(auth_required)):
     require_csrf(request, payload)
-    conn = get_conn()
-    uploads_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
-    processed = os.path.join(uploads_root, 'processed')
-    thumbs = os.path.join(uploads_root, 'thumbs')
-    car_dir = os.path.join(uploads_root, 'carousel')
-    car_thumbs = os.path.join(uploads_root, 'carousel_thumbs')
-    with conn.cursor() as cur:
-        cur.execute('SELECT * FROM photos WHERE id=%s', (photo_id,))
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute('SELECT user_id FROM photos WHERE id=%s', (photo_id,))
         photo = cur.fetchone()
-        if not photo:
-            conn.close()
-            raise HTTPException(status_code=404, detail='作品不存在')
-        if payload.get('role') not in ('admin','super_admin') and photo['user_id'] != payload['id']:
-            conn.close()
-            raise HTTPException(status_code=403, detail='无权限')
-        cur.execute('SELECT id, image_url, thumb_url FROM home_carousel WHERE photo_id=%s', (photo_id,))
-        related = cur.fetchall()
-        for hc in related:
-            cur.execute('DELETE FROM home_carousel WHERE id=%s', (hc['id'],))
-            try:
-                if hc.get('image_url'):
-                    key = _r2_key_from_url(hc['image_url'])
-                    if key:
-                        _r2_remove(key)
-                    p = os.path.join(car_dir, os.path.basename(hc['image_url']))
-                    if os.path.exists(p):
-                        os.remove(p)
-                if hc.get('thumb_url'):
-                    key = _r2_key_from_url(hc['thumb_url'])
-                    if key:
-                        _r2_remove(key)
-                    t = os.path.join(car_thumbs, os.path.basename(hc['thumb_url']))
-                    if os.path.exists(t):
-                        os.remove(t)
-            except Exception:
-                pass
-        cur.execute('DELETE FROM photo_tags WHERE photo_id=%s', (photo_id,))
-        cur.execute('DELETE FROM likes WHERE photo_id=%s', (photo_id,))
-        cur.execute('DELETE FROM favorites WHERE photo_id=%s', (photo_id,))
-        cur.execute('DELETE FROM comments WHERE photo_id=%s', (photo_id,))
-        cur.execute('DELETE FROM photos WHERE id=%s', (photo_id,))
-    conn.close()
-    try:
-        for u in [photo.get('image_url'), photo.get('thumb_url'), photo.get('original_url')]:
-            if u:
-                key = _r2_key_from_url(u)
-                if key:
-                    _r2_remove(key)
-            if u:
-                
-                dirs = [processed, thumbs, car_dir, car_thumbs]
-                for d in dirs:
-                    p = os.path.join(d, os.path.basename(u))
-                    if os.path.exists(p):
-                        os.remove(p)
-    except Exception:
-        pass
+    if not photo:
+        raise HTTPException(status_code=404, detail='作品不存在')
+    if payload.get('role') not in ('admin','super_admin') and photo['user_id'] != payload['id']:
+        raise HTTPException(status_code=403, detail='无权限')
+    _delete_photos([photo_id])
     return {'ok': True}
 
 @app.post('/api/admin/superadmin')
+@query_budget(15)
 def set_super_admin(request: Request, payload: dict = Depends(auth_required), username: str = Form(...)):
     role_required(payload, 'admin')
     require_csrf(request, payload)
-    conn = get_conn()
-    uploads_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
-    processed = os.path.join(uploads_root, 'processed')
-    thumbs = os.path.join(uploads_root, 'thumbs')
-    total_deleted = 0
-    with conn.cursor() as cur:
+    with get_conn() as conn, atomic(conn), conn.cursor() as cur:
         cur.execute('SELECT id FROM users WHERE username=%s', (username,))
         row = cur.fetchone()
         if not row:
-            conn.close()
             raise HTTPException(status_code=404, detail='用户不存在')
         target_id = row['id']
         cur.execute('UPDATE users SET role=%s WHERE id=%s', ('super_admin', target_id))
-        cur.execute('SELECT id FROM users WHERE role=%s AND id<>%s', ('admin', target_id))
-        admins = [r['id'] for r in cur.fetchall()]
-        for aid in admins:
-            cur.execute('SELECT id, image_url, thumb_url FROM photos WHERE user_id=%s', (aid,))
-            photos = cur.fetchall()
-            for p in photos:
-                pid = p['id']
-                cur.execute('UPDATE home_carousel SET photo_id=NULL WHERE photo_id=%s', (pid,))
-                cur.execute('DELETE FROM photo_tags WHERE photo_id=%s', (pid,))
-                cur.execute('DELETE FROM likes WHERE photo_id=%s', (pid,))
-                cur.execute('DELETE FROM favorites WHERE photo_id=%s', (pid,))
-                cur.execute('DELETE FROM comments WHERE photo_id=%s', (pid,))
-                cur.execute('DELETE FROM photos WHERE id=%s', (pid,))
-                total_deleted += 1
-                if p.get('image_url'):
-                    try:
-                        ip = os.path.join(processed, os.path.basename(p['image_url']))
-                        if os.path.exists(ip):
-                            os.remove(ip)
-                    except Exception:
-                        pass
-                if p.get('thumb_url'):
-                    try:
-                        tp = os.path.join(thumbs, os.path.basename(p['thumb_url']))
-                        if os.path.exists(tp):
-                            os.remove(tp)
-                    except Exception:
-                        pass
-    conn.close()
-    return {'ok': True, 'super_admin_username': username, 'deleted_photos': total_deleted}
+        cur.execute("SELECT p.id FROM photos p JOIN users u ON u.id = p.user_id WHERE u.role='admin' AND u.id<>%s", (target_id,))
+        ids = [r['id'] for r in cur.fetchall()]
+        # 轮播图保留，只解除与被删作品的关联
+        deleted, urls = _cascade_delete_photos(cur, ids, carousel='detach')
+    _remove_stored_objects(urls, deleted)
+    response_cache.invalidate('photos', 'carousel')
+    return {'ok': True, 'super_admin_username': username, 'deleted_photos': len(deleted)}
 
 @app.get('/api/admin/admin-stats')
+@query_budget(1)
 def admin_stats(payload: dict = Depends(auth_required)):
     role_required(payload, 'admin')
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute("SELECT id, username, role FROM users WHERE role IN ('admin','super_admin')")
-        users = cur.fetchall()
-        result = []
-        for u in users:
-            cur.execute('SELECT COUNT(*) as c FROM photos WHERE user_id=%s', (u['id'],))
-            c = cur.fetchone()['c']
-            result.append({'id': u['id'], 'username': u['username'], 'role': u['role'], 'photos_count': c})
-    conn.close()
-    return result
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT u.id, u.username, u.role, COUNT(p.id) AS photos_count
+            FROM users u LEFT JOIN photos p ON p.user_id = u.id
+            WHERE u.role IN ('admin','super_admin')
+            GROUP BY u.id
+            ORDER BY u.id
+        """)
+        return [{'id': u['id'], 'username': u['username'], 'role': u['role'], 'photos_count': u['photos_count']} for u in cur.fetchall()]
+
+@app.get('/api/admin/query-stats')
+def admin_query_stats(payload: dict = Depends(auth_required), limit: int = 50):
+    # 按总耗时排序的归一化 SQL（含调用路由），用于排查慢接口与 N+1
+    role_required(payload, 'admin')
+    return query_stats(max(1, min(limit, 500)))
@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+import argparse
+from .db import init_pool, init_schema, get_conn, close_pool, atomic, reconcile_counters, rebuild_upload_usage
+from . import jobs, migrations
+
+# 运维命令入口：python -m python_server.manage <command>
+
+def _load_env():
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    for name in ('.env.local', '.env'):
+        path = os.path.join(root, name)
+        if os.path.exists(path):
+            load_dotenv(path, override=False)
+            break
+
+def cmd_reconcile_counters(args):
+    with get_conn() as conn, conn.cursor() as cur:
+        fixed = reconcile_counters(cur)
+    print(f'已校正 {fixed} 个作品的点赞/收藏计数')
+
+def cmd_rebuild_upload_usage(args):
+    with get_conn() as conn, atomic(conn), conn.cursor() as cur:
+        rows = rebuild_upload_usage(cur)
+    print(f'已按作品重建上传量台账（{rows} 行）')
+
+def cmd_migrate(args):
+    if args.list:
+        with get_conn() as conn, conn.cursor() as cur:
+            done = set(migrations.applied_versions(cur))
+        for m in migrations.MIGRATIONS:
+            print(f"{m.version:>4}  {'已执行' if m.version in done else '待执行'}  {m.name}")
+        return
+    # 迁移依赖的表由 init_schema 创建，新库上单独执行本命令也能完成
+    init_schema()
+    ran = migrations.migrate(log_fn=print)
+    print(f'已执行 {len(ran)} 个迁移' if ran else '没有待执行的迁移')
+
+def _migrate_args(p):
+    p.add_argument('--list', action='store_true', help='只列出各迁移的执行状态')
+
+def cmd_check_indexes(args):
+    with get_conn() as conn, conn.cursor() as cur:
+        missing = migrations.missing_indexes(cur)
+    for m in missing:
+        print(f"缺少索引：{m['table']} ({', '.join(m['columns'])})  用于 {m['used_by']}")
+    if missing:
+        sys.exit(1)
+    print(f'热路径索引齐全（共检查 {len(migrations.REQUIRED_INDEXES)} 项）')
+
+def cmd_seed(args):
+    from .seed import seed_synthetic
+    started = time.monotonic()
+    seed_synthetic(
+        users=args.users, photos=args.photos, tags=args.tags, likes=args.likes, favorites=args.favorites,
+        comments=args.comments, photographers=args.photographers, tags_per_photo=(args.min_tags, args.max_tags),
+        alpha=args.alpha, days=args.days, password=args.password, seed=args.seed,
+    )
+    print(f'合成数据写入完成，共 {time.monotonic() - started:.1f} 秒')
+
+def _seed_args(p):
+    p.add_argument('--users', type=int, default=10000)
+    p.add_argument('--photos', type=int, default=100000)
+    p.add_argument('--tags', type=int, default=2000)
+    p.add_argument('--likes', type=int, default=2000000, help='点赞总数（按长尾分布分给作品）')
+    p.add_argument('--favorites', type=int, default=500000)
+    p.add_argument('--comments', type=int, default=500000)
+    p.add_argument('--photographers', type=float, default=0.1, help='有作品的用户比例')
+    p.add_argument('--min-tags', type=int, default=1)
+    p.add_argument('--max-tags', type=int, default=5)
+    p.add_argument('--alpha', type=float, default=1.2, help='帕累托分布参数，越小越集中在头部')
+    p.add_argument('--days', type=int, default=365, help='作品时间分布在最近多少天内')
+    p.add_argument('--password', default='seed123', help='合成用户的统一密码')
+    p.add_argument('--seed', type=int, default=None, help='随机种子，相同参数可复现')
+
+def cmd_worker(args):
+    from . import main  # noqa: F401  导入以注册任务处理函数
+    workers = args.workers if args.workers is not None else jobs.default_workers()
+    jobs.start(workers)
+    print(f'后台任务 worker 已启动（{workers} 个线程），Ctrl+C 退出')
+    jobs.wait_forever()
+
+def _worker_args(p):
+    p.add_argument('--workers', type=int, default=None, help='线程数，默认同 JOB_WORKERS')
+
+COMMANDS = {
+    'reconcile-counters': (cmd_reconcile_counters, '按 likes/favorites 表重新计算 photos 上的计数', None),
+    'rebuild-upload-usage': (cmd_rebuild_upload_usage, '按 photos 重建每日/每月上传量台账 upload_usage', None),
+    'migrate': (cmd_migrate, '按版本号执行未执行的数据库迁移（索引用 CREATE INDEX CONCURRENTLY）', _migrate_args),
+    'check-indexes': (cmd_check_indexes, '对照 main.py 热路径查询检查缺少的索引，缺少时以非零状态退出', None),
+    'seed': (cmd_seed, '用 COPY 批量写入合成的用户/作品/标签/点赞/收藏/评论（仅用于测试库）', _seed_args),
+    'worker': (cmd_worker, '独立运行衍生图等后台任务（配合 JOB_WORKERS=0 的 Web 进程）', _worker_args),
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m python_server.manage')
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name, (fn, help_text, configure) in COMMANDS.items():
+        p = sub.add_parser(name, help=help_text)
+        if configure:
+            configure(p)
+        p.set_defaults(func=fn)
+    args = parser.parse_args(argv)
+    _load_env()
+    init_pool()
+    try:
+        args.func(args)
+    finally:
+        close_pool()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
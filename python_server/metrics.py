@@ -0,0 +1,263 @@
+import os
+import hmac
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 进程内指标，GET /api/metrics 以 Prometheus 文本格式输出：
+#   - 每个路由的请求耗时直方图与状态码计数（路由取路径模板，基数有界）
+#   - 每条 SQL 的耗时（按语句类型），以及每个请求内的语句数与 SQL 总耗时
+#   - 对象存储调用耗时与错误数、图片解码/缩放/编码耗时
+#   - 抓取时读取的线程池、数据库连接池、图片进程池的占用情况
+# 记录路径上只有一次 bisect 和一把短锁，可以常开
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _num(v):
+    if v == float('inf'):
+        return '+Inf'
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _labels(self.labelnames, k), v) for k, v in sorted(items)]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(v[0]), v[1]) for k, v in self._values.items()]
+        out = []
+        for labels, counts, total in sorted(items):
+            acc = 0
+            for bound, c in zip(self.buckets + (float('inf'),), counts):
+                acc += c
+                out.append((self.name + '_bucket', _labels(self.labelnames, labels, f'le="{_num(float(bound))}"'), acc))
+            out.append((self.name + '_sum', _labels(self.labelnames, labels), total))
+            out.append((self.name + '_count', _labels(self.labelnames, labels), acc))
+        return out
+
+_metrics = []
+_collectors = []
+
+def _register(metric):
+    _metrics.append(metric)
+    return metric
+
+def counter(name, help, labelnames=()):
+    return _register(Counter(name, help, labelnames))
+
+def gauge(name, help, labelnames=()):
+    return _register(Gauge(name, help, labelnames))
+
+def histogram(name, help, labelnames=(), buckets=DURATION_BUCKETS):
+    return _register(Histogram(name, help, labelnames, buckets))
+
+def register_collector(fn):
+    # fn() 在抓取时调用，返回 [(指标名, 说明, {标签: 值} 或 None, 数值)]，按 gauge 输出
+    _collectors.append(fn)
+    return fn
+
+HTTP_DURATION = histogram('http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route'))
+HTTP_REQUESTS = counter('http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status'))
+HTTP_IN_FLIGHT = gauge('http_requests_in_flight', 'HTTP requests currently being served')
+REQUEST_QUERIES = histogram('http_request_db_queries', 'SQL statements executed per request', ('route',), COUNT_BUCKETS)
+REQUEST_DB_SECONDS = histogram('http_request_db_seconds', 'Total SQL time per request', ('route',), SQL_BUCKETS)
+DB_QUERY_DURATION = histogram('db_query_duration_seconds', 'SQL statement latency by statement type', ('statement',), SQL_BUCKETS)
+DB_QUERY_ERRORS = counter('db_query_errors_total', 'SQL statements that raised', ('statement',))
+STORAGE_DURATION = histogram('storage_call_duration_seconds', 'Object storage call latency', ('op',))
+STORAGE_ERRORS = counter('storage_call_errors_total', 'Object storage calls that raised', ('op',))
+IMAGE_DURATION = histogram('image_stage_duration_seconds', 'Image decode/resize/encode time per job', ('stage',))
+IMAGE_IN_FLIGHT = gauge('image_jobs_in_flight', 'Image jobs submitted and not yet finished')
+STORAGE_IO_IN_FLIGHT = gauge('storage_io_in_flight', 'Object storage writes queued or running in the I/O pool')
+
+class RequestStats:
+    # 当前请求的 SQL 统计；scope 用来在请求过程中取路由与端点
+    __slots__ = ('queries', 'seconds', 'scope', 'over_budget')
+
+    def __init__(self, scope=None):
+        self.queries = 0
+        self.seconds = 0.0
+        self.scope = scope
+        self.over_budget = False
+
+    @property
+    def route(self):
+        return _route(self.scope) if self.scope is not None else 'background'
+
+    @property
+    def endpoint(self):
+        return self.scope.get('endpoint') if self.scope is not None else None
+
+# 后台线程（任务 worker、运维命令）里没有请求上下文
+_request = contextvars.ContextVar('metrics_request', default=None)
+
+def current_request():
+    return _request.get()
+
+_STATEMENTS = ('select', 'insert', 'update', 'delete', 'with', 'copy', 'explain')
+
+def statement_type(query):
+    head = query.lstrip()[:8].lower()
+    for s in _STATEMENTS:
+        if head.startswith(s):
+            return s
+    return 'other'
+
+def record_query(query, elapsed, failed=False):
+    kind = statement_type(query)
+    DB_QUERY_DURATION.observe(elapsed, kind)
+    if failed:
+        DB_QUERY_ERRORS.inc(kind)
+    req = _request.get()
+    if req is not None:
+        req.queries += 1
+        req.seconds += elapsed
+
+@contextmanager
+def storage(op):
+    # 包住一次对象存储调用：记录耗时，异常计入错误数后继续抛出
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STORAGE_ERRORS.inc(op)
+        raise
+    finally:
+        STORAGE_DURATION.observe(time.perf_counter() - t0, op)
+
+def record_image(timings):
+    for stage, seconds in timings.items():
+        IMAGE_DURATION.observe(seconds, stage)
+
+def _route(scope):
+    route = scope.get('route')
+    path = getattr(route, 'path', None)
+    if path:
+        return path
+    if 'endpoint' in scope:
+        # Mount（/uploads 等）没有路由对象，用挂载点
+        return scope.get('root_path') or 'mount'
+    return 'unmatched'
+
+class MetricsMiddleware:
+    # 纯 ASGI 中间件；路由在请求处理完后从 scope 里读（路由匹配时写入）
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        req = RequestStats(scope)
+        token = _request.set(req)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - t0
+            HTTP_IN_FLIGHT.dec()
+            _request.reset(token)
+            route = _route(scope)
+            method = scope.get('method', 'GET')
+            HTTP_DURATION.observe(elapsed, method, route)
+            HTTP_REQUESTS.inc(method, route, str(status))
+            REQUEST_QUERIES.observe(req.queries, route)
+            REQUEST_DB_SECONDS.observe(req.seconds, route)
+
+def render():
+    lines = []
+    for m in _metrics:
+        lines.append(f'# HELP {m.name} {m.help}')
+        lines.append(f'# TYPE {m.name} {m.kind}')
+        for name, labels, value in m.samples():
+            lines.append(f'{name}{labels} {_num(value)}')
+    seen = set()
+    for fn in _collectors:
+        try:
+            rows = fn()
+        except Exception:
+            continue
+        for name, help, labels, value in rows:
+            if value is None:
+                continue
+            if name not in seen:
+                seen.add(name)
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} gauge')
+            label_str = _labels(labels.keys(), labels.values()) if labels else ''
+            lines.append(f'{name}{label_str} {_num(value)}')
+    return '\n'.join(lines) + '\n'
+
+def authorized(header):
+    # 默认关闭：只有设置了 METRICS_TOKEN 且请求带 Authorization: Bearer <token> 时放行
+    token = os.getenv('METRICS_TOKEN')
+    if not token or not header:
+        return False
+    return hmac.compare_digest(header.encode('utf-8'), f'Bearer {token}'.encode('utf-8'))
@@ -0,0 +1,196 @@
+import os
+import time
+import logging
+from .db import get_conn, atomic, search_doc, reconcile_counters, rebuild_upload_usage, SEARCH_GRAMS_FN
+
+# 版本化的数据库迁移：init_schema 只负责 CREATE TABLE IF NOT EXISTS，之后对已有部署的改动都写成迁移，
+# 按版本号顺序执行一次，执行记录在 schema_migrations 表里。只追加新版本，不修改已发布的迁移。
+#   - 每个迁移是一组语句；语句也可以是 fn(cur)，用于回填数据
+#   - concurrent=True 的迁移在自动提交模式下逐条执行（CREATE INDEX CONCURRENTLY
+#     不能放在事务里），否则整组放在一个事务里
+#   - 上一次 CONCURRENTLY 建索引中途失败会留下 INVALID 索引，重跑时先删掉再建
+#   - 多个进程同时启动时用 advisory lock 串行，只有一个进程实际执行；等锁用 try + sleep 轮询，
+#     不在数据库里阻塞等待（阻塞中的语句持有快照，会让另一个进程的 CONCURRENTLY 建索引互相等待）
+log = logging.getLogger('python_server.migrations')
+
+LOCK_ID = 7243501
+
+class Migration:
+    def __init__(self, version: int, name: str, statements, concurrent: bool = False):
+        self.version = version
+        self.name = name
+        self.statements = list(statements)
+        self.concurrent = concurrent
+
+def _index(name: str, table: str, columns: str):
+    return f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})'
+
+MIGRATIONS = [
+    Migration(1, 'hot path indexes', [
+        # tag 筛选：JOIN photo_tags ON tag_id
+        _index('idx_photo_tags_tag_id', 'photo_tags', 'tag_id, photo_id'),
+        # 点赞/收藏切换、删除作品时的级联删除、reconcile_counters
+        _index('idx_likes_photo_id', 'likes', 'photo_id'),
+        _index('idx_favorites_photo_id', 'favorites', 'photo_id'),
+        # 作品详情的评论列表（按 id 排序）与级联删除
+        _index('idx_comments_photo_id_id', 'comments', 'photo_id, id'),
+        # 删除作品时删除/解除关联的轮播图
+        _index('idx_home_carousel_photo_id', 'home_carousel', 'photo_id'),
+        # category 筛选 + keyset 翻页
+        _index('idx_photos_category_id', 'photos', 'category, id'),
+        # admin_r2_delete 按 URL 反查作品，以及删除时的引用计数
+        _index('idx_photos_original_url', 'photos', 'original_url'),
+        _index('idx_photos_image_url', 'photos', 'image_url'),
+        _index('idx_photos_thumb_url', 'photos', 'thumb_url'),
+    ], concurrent=True),
+    # 搜索用的 bigram GIN 表达式索引：整表逐行计算切分，大表上建索引耗时长，必须 CONCURRENTLY
+    Migration(2, 'photo search grams', [
+        SEARCH_GRAMS_FN,
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_photos_search_grams ON photos USING GIN (photo_search_grams({search_doc()}))',
+    ], concurrent=True),
+    # 作品上的乐观锁版本号、处理状态、点赞/收藏冗余计数与内容哈希；加列后按实际行数回填计数
+    Migration(3, 'photo columns', [
+        'ALTER TABLE photos ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1',
+        "ALTER TABLE photos ADD COLUMN IF NOT EXISTS status VARCHAR(16) NOT NULL DEFAULT 'ready'",
+        'ALTER TABLE photos ADD COLUMN IF NOT EXISTS like_count INT NOT NULL DEFAULT 0',
+        'ALTER TABLE photos ADD COLUMN IF NOT EXISTS favorite_count INT NOT NULL DEFAULT 0',
+        'ALTER TABLE photos ADD COLUMN IF NOT EXISTS content_hash CHAR(64)',
+        reconcile_counters,
+    ]),
+    # 上传去重按内容哈希查重
+    Migration(4, 'photo content hash index', [
+        _index('idx_photos_content_hash', 'photos', 'content_hash'),
+    ], concurrent=True),
+    # 上传量台账：每个用户按自然日、自然月各一行；建表后按已有作品生成一次
+    Migration(5, 'upload usage ledger', [
+        """
+        CREATE TABLE IF NOT EXISTS upload_usage (
+            user_id INT NOT NULL,
+            period VARCHAR(8) NOT NULL CHECK (period IN ('day','month')),
+            bucket DATE NOT NULL,
+            bytes BIGINT NOT NULL DEFAULT 0,
+            files INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, period, bucket)
+        )
+        """,
+        rebuild_upload_usage,
+    ]),
+]
+
+# 热路径查询需要的索引：(表, 前导列, 使用位置)。missing_indexes 检查每一项是否有有效索引以这些列开头
+REQUIRED_INDEXES = [
+    ('photos', ('user_id',), 'list_photos photographer / users/me/photos'),
+    ('photos', ('category', 'id'), 'list_photos category'),
+    ('photos', ('content_hash',), '_find_duplicate'),
+    ('photos', ('original_url',), 'admin_r2_delete'),
+    ('photos', ('image_url',), 'admin_r2_delete'),
+    ('photos', ('thumb_url',), 'admin_r2_delete'),
+    ('photo_tags', ('photo_id',), 'photo_detail tags / _cascade_delete_photos'),
+    ('photo_tags', ('tag_id',), 'list_photos tag'),
+    ('likes', ('user_id', 'photo_id'), '_toggle_reaction'),
+    ('likes', ('photo_id',), '_cascade_delete_photos / reconcile_counters'),
+    ('favorites', ('user_id', 'photo_id'), '_toggle_reaction'),
+    ('favorites', ('photo_id',), '_cascade_delete_photos / reconcile_counters'),
+    ('comments', ('photo_id', 'id'), 'photo_detail comments'),
+    ('home_carousel', ('photo_id',), '_cascade_delete_photos'),
+    ('jobs', ('photo_id',), 'upload-status'),
+    ('upload_usage', ('user_id', 'period', 'bucket'), 'add_upload_usage / get_upload_usage'),
+]
+
+def _ensure_table(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def applied_versions(cur):
+    _ensure_table(cur)
+    cur.execute('SELECT version FROM schema_migrations ORDER BY version')
+    return [r['version'] for r in cur.fetchall()]
+
+def _drop_invalid_index(cur, statement: str):
+    # CREATE INDEX CONCURRENTLY IF NOT EXISTS 会跳过上次失败留下的 INVALID 索引，这里先删掉
+    words = statement.split()
+    if 'EXISTS' not in words:
+        return
+    name = words[words.index('EXISTS') + 1]
+    cur.execute("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    """, (name,))
+    if cur.fetchone():
+        log.warning('dropping invalid index %s left by an interrupted migration', name)
+        cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+def _execute(cur, statement):
+    if callable(statement):
+        statement(cur)
+    else:
+        cur.execute(statement)
+
+def _apply(conn, cur, m: Migration):
+    if m.concurrent:
+        for statement in m.statements:
+            if not callable(statement):
+                _drop_invalid_index(cur, statement)
+            _execute(cur, statement)
+        cur.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s) RETURNING version', (m.version, m.name))
+        return
+    with atomic(conn):
+        for statement in m.statements:
+            _execute(cur, statement)
+        cur.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s) RETURNING version', (m.version, m.name))
+
+def pending(cur):
+    done = set(applied_versions(cur))
+    return [m for m in MIGRATIONS if m.version not in done]
+
+def migrate(log_fn=None):
+    # 返回本次执行的迁移版本号列表
+    say = log_fn or log.info
+    ran = []
+    with get_conn() as conn, conn.cursor() as cur:
+        deadline = time.monotonic() + float(os.getenv('MIGRATE_LOCK_TIMEOUT', '600'))
+        while True:
+            cur.execute('SELECT pg_try_advisory_lock(%s) AS locked', (LOCK_ID,))
+            if cur.fetchone()['locked']:
+                break
+            if time.monotonic() > deadline:
+                raise RuntimeError('timed out waiting for another process to finish migrations')
+            time.sleep(1)
+        try:
+            for m in pending(cur):
+                say(f'applying migration {m.version}: {m.name}')
+                _apply(conn, cur, m)
+                ran.append(m.version)
+        finally:
+            cur.execute('SELECT pg_advisory_unlock(%s)', (LOCK_ID,))
+    return ran
+
+def migrate_on_startup():
+    return os.getenv('MIGRATE_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+
+def missing_indexes(cur):
+    # 对照 REQUIRED_INDEXES 检查：有效索引（含主键/唯一约束）的前导列覆盖所需列即视为满足
+    cur.execute("""
+        SELECT t.relname AS table_name,
+               array_agg(COALESCE(a.attname::text, '') ORDER BY k.ord) AS columns
+        FROM pg_index i
+        JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace AND n.nspname = current_schema()
+        CROSS JOIN LATERAL unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+        LEFT JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+        WHERE i.indisvalid
+        GROUP BY i.indexrelid, t.relname
+    """)
+    existing = {}
+    for r in cur.fetchall():
+        existing.setdefault(r['table_name'], []).append(tuple(r['columns']))
+    missing = []
+    for table, columns, used_by in REQUIRED_INDEXES:
+        if not any(cols[:len(columns)] == columns for cols in existing.get(table, [])):
+            missing.append({'table': table, 'columns': list(columns), 'used_by': used_by})
+    return missing
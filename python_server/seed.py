@@ -1,18 +1,176 @@
+import io
 import os
+import csv
+import time
+import random
+import itertools
+from datetime import datetime
 import bcrypt
-from .db import get_conn
+from .db import get_conn, atomic, rebuild_upload_usage
 
 def ensure_admin():
     username = os.getenv('ADMIN_USERNAME', 'admin')
     email = os.getenv('ADMIN_EMAIL')
     raw = os.getenv('ADMIN_PASSWORD', 'admin123')
     hashpw = bcrypt.hashpw(raw.encode(), bcrypt.gensalt()).decode()
-    conn = get_conn()
-    with conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute('SELECT id, role FROM users WHERE username=%s', (username,))
         row = cur.fetchone()
         if row:
             cur.execute('UPDATE users SET password_hash=%s, role=%s WHERE id=%s', (hashpw, 'admin', row['id']))
         else:
             cur.execute('INSERT INTO users (username, email, password_hash, role) VALUES (%s,%s,%s,%s)', (username, email, hashpw, 'admin'))
-    conn.close()
\ No newline at end of file
+
+# 合成数据集：用 COPY FROM STDIN 批量写入 users / tags / photos / photo_tags / likes / favorites / comments，
+# 用于在接近生产的规模下测试索引与分页。各表 id 在持锁后从当前最大值往后显式分配，
+# 点赞/收藏/评论数按帕累托分布（长尾）分给作品，作品数按帕累托分布分给摄影师，
+# photos 上的 like_count / favorite_count 直接按生成的行数写入，不需要再校正。
+SEED_WORDS = ['日落', '海边', '城市', '夜景', '人像', '山川', '街头', '黑白', '花卉', '雪景',
+              '森林', '星空', '建筑', '旅行', '婚礼', '秋天', '春天', '湖泊', '草原', '古镇',
+              'sunset', 'portrait', 'street', 'film', 'travel', 'mono', 'night', 'city']
+SEED_CATEGORIES = ['风光', '人像', '街拍', '建筑', '夜景', '旅行', '纪实', '静物']
+SEED_CAMERAS = ['Sony A7M4', 'Canon R5', 'Nikon Z6II', 'Fujifilm X-T5', 'Leica Q2', 'iPhone 15 Pro', None]
+SEED_COMMENTS = ['好看', '构图很棒', '光线绝了', '请问用的什么镜头', '色调很舒服', 'nice shot', '收藏了', '求原图']
+
+class _CopyStream:
+    # 把行生成器包装成 copy_expert 需要的 read(size) 文件对象，按块生成 CSV，内存占用与行数无关
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf, lineterminator='\n')
+        self._pending = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        size = size if size and size > 0 else 65536
+        while len(self._pending) < size:
+            self._buf.seek(0)
+            self._buf.truncate()
+            for row in itertools.islice(self._rows, 1000):
+                self._writer.writerow(row)
+                self.count += 1
+            chunk = self._buf.getvalue()
+            if not chunk:
+                break
+            self._pending += chunk
+        out, self._pending = self._pending[:size], self._pending[size:]
+        return out
+
+def _copy(cur, table, columns, rows):
+    stream = _CopyStream(rows)
+    started = time.monotonic()
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", stream, size=1 << 20)
+    return stream.count, time.monotonic() - started
+
+def _long_tail(rnd, n, total, alpha, cap=None):
+    # 把 total 按帕累托权重分给 n 个对象，随机舍入；cap 为单个对象的上限
+    if n <= 0 or total <= 0:
+        return [0] * max(n, 0)
+    weights = [rnd.paretovariate(alpha) for _ in range(n)]
+    scale = total / sum(weights)
+    counts = [int(w * scale + rnd.random()) for w in weights]
+    if cap is not None:
+        counts = [min(c, cap) for c in counts]
+    return counts
+
+def _ts(epoch):
+    return datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S')
+
+def seed_synthetic(users=1000, photos=100000, tags=500, likes=1000000, favorites=300000, comments=200000,
+                   photographers=0.1, tags_per_photo=(1, 5), alpha=1.2, days=365, password='seed123',
+                   seed=None, log=print):
+    rnd = random.Random(seed)
+    now = time.time()
+    start_epoch = now - days * 86400
+    hashpw = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    summary = {}
+
+    def report(table, result):
+        summary[table] = {'rows': result[0], 'seconds': round(result[1], 1)}
+        log(f'{table}: {result[0]} 行，{result[1]:.1f} 秒')
+
+    with get_conn() as conn, atomic(conn), conn.cursor() as cur:
+        tables = ('users', 'tags', 'photos', 'photo_tags', 'likes', 'favorites', 'comments')
+        cur.execute(f"LOCK TABLE {', '.join(tables)} IN SHARE ROW EXCLUSIVE MODE")
+        base = {}
+        for t in ('users', 'tags', 'photos', 'likes', 'favorites', 'comments'):
+            cur.execute(f'SELECT COALESCE(MAX(id), 0) AS m FROM {t}')
+            base[t] = cur.fetchone()['m']
+
+        user_ids = range(base['users'] + 1, base['users'] + users + 1)
+        n_photographers = max(1, int(users * photographers)) if users else 0
+        report('users', _copy(cur, 'users', ('id', 'username', 'email', 'password_hash', 'role', 'created_at'), (
+            (uid, f'seed{uid}', f'seed{uid}@example.com', hashpw, 'photographer' if i < n_photographers else 'user', _ts(start_epoch))
+            for i, uid in enumerate(user_ids)
+        )))
+
+        tag_ids = range(base['tags'] + 1, base['tags'] + tags + 1)
+        report('tags', _copy(cur, 'tags', ('id', 'name'), (
+            (tid, f'{SEED_WORDS[i % len(SEED_WORDS)]}-{tid}') for i, tid in enumerate(tag_ids)
+        )))
+
+        if not users:
+            return summary
+        # 作品按帕累托权重分给摄影师；点赞/收藏/评论数同样长尾，单个作品不超过用户数
+        uploaders = user_ids[:n_photographers]
+        uploader_weights = list(itertools.accumulate(rnd.paretovariate(alpha) for _ in uploaders))
+        owners = rnd.choices(uploaders, cum_weights=uploader_weights, k=photos)
+        like_counts = _long_tail(rnd, photos, likes, alpha, cap=users)
+        fav_counts = _long_tail(rnd, photos, favorites, alpha, cap=users)
+        comment_counts = _long_tail(rnd, photos, comments, alpha)
+        photo_ids = range(base['photos'] + 1, base['photos'] + photos + 1)
+        photo_times = sorted(rnd.uniform(start_epoch, now) for _ in range(photos))
+
+        def photo_rows():
+            for i, pid in enumerate(photo_ids):
+                w1, w2 = rnd.choice(SEED_WORDS), rnd.choice(SEED_WORDS)
+                yield (pid, owners[i], f'{w1}{w2} {pid}', f'{w1}，{w2}' if rnd.random() < 0.6 else None,
+                       rnd.choice(SEED_CAMERAS), None, rnd.choice(SEED_CATEGORIES),
+                       f'http://localhost/uploads/originals/seed-{pid}.jpg',
+                       f'http://localhost/uploads/processed/seed-{pid}.webp',
+                       f'http://localhost/uploads/thumbs/seed-{pid}_thumb.webp',
+                       rnd.randint(500_000, 8_000_000), _ts(photo_times[i]), 'ready', like_counts[i], fav_counts[i])
+        report('photos', _copy(cur, 'photos', ('id', 'user_id', 'title', 'description', 'camera', 'settings', 'category',
+                                               'original_url', 'image_url', 'thumb_url', 'size_bytes', 'created_at',
+                                               'status', 'like_count', 'favorite_count'), photo_rows()))
+
+        tag_weights = list(itertools.accumulate(rnd.paretovariate(alpha) for _ in tag_ids))
+
+        def photo_tag_rows():
+            lo, hi = tags_per_photo
+            for pid in photo_ids:
+                k = rnd.randint(lo, hi) if tags else 0
+                for tid in set(rnd.choices(tag_ids, cum_weights=tag_weights, k=k)) if k else ():
+                    yield (pid, tid)
+        report('photo_tags', _copy(cur, 'photo_tags', ('photo_id', 'tag_id'), photo_tag_rows()))
+
+        def reaction_rows(table, counts):
+            rid = base[table]
+            for i, pid in enumerate(photo_ids):
+                if not counts[i]:
+                    continue
+                t0 = photo_times[i]
+                for uid in rnd.sample(user_ids, counts[i]):
+                    rid += 1
+                    yield (rid, uid, pid, _ts(rnd.uniform(t0, now)))
+        for table, counts in (('likes', like_counts), ('favorites', fav_counts)):
+            report(table, _copy(cur, table, ('id', 'user_id', 'photo_id', 'created_at'), reaction_rows(table, counts)))
+
+        def comment_rows():
+            cid = base['comments']
+            for i, pid in enumerate(photo_ids):
+                t0 = photo_times[i]
+                for _ in range(comment_counts[i]):
+                    cid += 1
+                    yield (cid, rnd.choice(user_ids), pid, rnd.choice(SEED_COMMENTS), _ts(rnd.uniform(t0, now)))
+        report('comments', _copy(cur, 'comments', ('id', 'user_id', 'photo_id', 'content', 'created_at'), comment_rows()))
+
+        # 显式写入了 id，把各表序列推到当前最大值之后
+        for t in ('users', 'tags', 'photos', 'likes', 'favorites', 'comments'):
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{t}', 'id'), GREATEST((SELECT MAX(id) FROM {t}), 1))")
+        started = time.monotonic()
+        rebuild_upload_usage(cur)
+        log(f'upload_usage: 重建完成，{time.monotonic() - started:.1f} 秒')
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(f"ANALYZE {', '.join(tables)}")
+    return summary
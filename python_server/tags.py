@@ -0,0 +1,71 @@
+import os
+import threading
+from collections import OrderedDict
+
+# 标签解析：一批作品共用的标签名一次性 upsert 并关联，名称 -> id 放在进程内的有界缓存里。
+# 只缓存已提交过的标签（本事务新建的在下次查询时再进缓存），事务回滚不会留下无效 id。
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+def _cache_size():
+    return int(os.getenv('TAG_CACHE_SIZE', '1024'))
+
+def parse(raw: str):
+    seen = []
+    for s in (raw or '').split(','):
+        s = s.strip()
+        if s and s not in seen:
+            seen.append(s)
+    return seen
+
+def _remember(rows):
+    limit = _cache_size()
+    with _lock:
+        for name, tid in rows:
+            _cache[name] = tid
+            _cache.move_to_end(name)
+        while len(_cache) > limit:
+            _cache.popitem(last=False)
+
+def resolve(cur, names):
+    # 返回 名称 -> id；缓存未命中的名称最多两条语句：批量插入缺失的，再批量查回
+    ids = {}
+    missing = []
+    with _lock:
+        for name in names:
+            tid = _cache.get(name)
+            if tid is None:
+                missing.append(name)
+            else:
+                _cache.move_to_end(name)
+                ids[name] = tid
+    if not missing:
+        return ids
+    cur.execute('INSERT INTO tags (name) SELECT unnest(%s::text[]) ON CONFLICT (name) DO NOTHING RETURNING id, name', (missing,))
+    created = {r['name'] for r in cur.fetchall()}
+    cur.execute('SELECT id, name FROM tags WHERE name = ANY(%s)', (missing,))
+    found = [(r['name'], r['id']) for r in cur.fetchall()]
+    ids.update(found)
+    _remember([(n, tid) for n, tid in found if n not in created])
+    return ids
+
+def link(cur, photo_ids, names, replace: bool = False):
+    # 把同一组标签关联到一批作品；replace 时先清掉这些作品原有的标签
+    photo_ids = list(photo_ids)
+    if not photo_ids:
+        return
+    if replace:
+        cur.execute('DELETE FROM photo_tags WHERE photo_id = ANY(%s)', (photo_ids,))
+    if not names:
+        return
+    tag_ids = list(resolve(cur, names).values())
+    cur.execute("""
+        INSERT INTO photo_tags (photo_id, tag_id)
+        SELECT p, t FROM unnest(%s::int[]) AS p CROSS JOIN unnest(%s::int[]) AS t
+        ON CONFLICT DO NOTHING
+        RETURNING photo_id
+    """, (photo_ids, tag_ids))
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
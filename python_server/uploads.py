@@ -0,0 +1,184 @@
+import os
+import stat
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+import anyio
+
+# /uploads 文件服务（未配置对象存储时原图、衍生图、首页视频都从这里读）：
+#   - 强 ETag（大小 + 纳秒级 mtime）、Last-Modified，If-None-Match / If-Modified-Since 返回 304
+#   - 单段 Range 与 If-Range，视频拖动只读所需字节；多段 Range 按完整内容返回
+#   - ASGI 服务器支持 http.response.zerocopysend 扩展时直接交给 sendfile，否则按块流式读取
+#   - 同目录存在 .br / .gz 预压缩文件且客户端接受时直接返回（UPLOADS_PRECOMPRESSED=false 关闭）
+CHUNK_SIZE = 256 * 1024
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+def _route_path(scope):
+    path = scope['path']
+    root = scope.get('root_path', '')
+    if root and path.startswith(root) and (len(path) == len(root) or path[len(root)] == '/'):
+        return path[len(root):]
+    return path
+
+def _header(scope, name: bytes):
+    for k, v in scope['headers']:
+        if k == name:
+            return v.decode('latin-1')
+    return None
+
+def parse_range(value: str, size: int):
+    # 返回 (start, end) 闭区间；None 表示忽略 Range 返回完整内容；不可满足时抛 ValueError
+    if not value or not value.startswith('bytes='):
+        return None
+    specs = value[6:].split(',')
+    if len(specs) != 1:
+        return None
+    first, sep, last = specs[0].strip().partition('-')
+    if not sep or (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+        return None
+    if not first:
+        n = int(last)
+        if n == 0 or size == 0:
+            raise ValueError('unsatisfiable')
+        return max(0, size - n), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        return None
+    if start >= size:
+        raise ValueError('unsatisfiable')
+    return start, min(end, size - 1)
+
+def _not_modified(scope, etag: str, mtime: float):
+    inm = _header(scope, b'if-none-match')
+    if inm is not None:
+        tags = [t.strip() for t in inm.split(',')]
+        return '*' in tags or etag in tags or f'W/{etag}' in tags
+    ims = _header(scope, b'if-modified-since')
+    if ims:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _if_range_ok(value: str, etag: str, last_modified: str):
+    if value is None:
+        return True
+    value = value.strip()
+    if value.startswith('"') or value.startswith('W/'):
+        return value == etag
+    return value == last_modified
+
+class UploadsApp:
+    def __init__(self, directory: str):
+        self.directory = os.path.realpath(directory)
+        self.precompressed = os.getenv('UPLOADS_PRECOMPRESSED', 'true').lower() in ('1', 'true', 'yes')
+
+    def _resolve(self, route_path: str):
+        rel = route_path.lstrip('/')
+        if not rel or '\x00' in rel:
+            return None
+        full = os.path.realpath(os.path.join(self.directory, *rel.split('/')))
+        if os.path.commonpath([self.directory, full]) != self.directory:
+            return None
+        return full
+
+    def _lookup(self, path: str, accept_encoding: str):
+        # 在线程里执行：stat 原文件，并挑选可用的预压缩版本
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None, None, None
+        if not stat.S_ISREG(st.st_mode):
+            return None, None, None
+        if self.precompressed and accept_encoding:
+            accepted = {e.split(';')[0].strip() for e in accept_encoding.split(',')}
+            for name, suffix in ENCODINGS:
+                if name in accepted:
+                    try:
+                        cst = os.stat(path + suffix)
+                    except OSError:
+                        continue
+                    if stat.S_ISREG(cst.st_mode) and cst.st_mtime >= st.st_mtime:
+                        return st, path + suffix, (name, cst)
+        return st, path, None
+
+    async def __call__(self, scope, receive, send):
+        method = scope.get('method', 'GET')
+        if scope['type'] != 'http' or method not in ('GET', 'HEAD'):
+            await self._plain(send, 405, b'Method Not Allowed', [(b'allow', b'GET, HEAD')])
+            return
+        path = self._resolve(_route_path(scope))
+        if path is None:
+            await self._plain(send, 404, b'Not Found')
+            return
+        has_range = _header(scope, b'range') is not None
+        accept_encoding = None if has_range else _header(scope, b'accept-encoding')
+        st, serve_path, encoded = await anyio.to_thread.run_sync(self._lookup, path, accept_encoding)
+        if st is None:
+            await self._plain(send, 404, b'Not Found')
+            return
+
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+        if encoded:
+            etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}-{encoded[0]}"'
+        last_modified = formatdate(st.st_mtime, usegmt=True)
+        headers = [
+            (b'content-type', content_type.encode('latin-1')),
+            (b'etag', etag.encode('latin-1')),
+            (b'last-modified', last_modified.encode('latin-1')),
+            (b'accept-ranges', b'bytes'),
+        ]
+        if self.precompressed:
+            headers.append((b'vary', b'Accept-Encoding'))
+
+        if _not_modified(scope, etag, st.st_mtime):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        size = st.st_size
+        status = 200
+        start, end = 0, size - 1
+        if encoded:
+            size = encoded[1].st_size
+            start, end = 0, size - 1
+            headers.append((b'content-encoding', encoded[0].encode('latin-1')))
+        elif has_range and _if_range_ok(_header(scope, b'if-range'), etag, last_modified):
+            try:
+                rng = parse_range(_header(scope, b'range'), size)
+            except ValueError:
+                await self._plain(send, 416, b'', [(b'content-range', f'bytes */{size}'.encode('latin-1'))] + headers[1:])
+                return
+            if rng is not None:
+                start, end = rng
+                status = 206
+                headers.append((b'content-range', f'bytes {start}-{end}/{size}'.encode('latin-1')))
+        length = max(0, end - start + 1)
+        headers.append((b'content-length', str(length).encode('latin-1')))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        if method == 'HEAD' or length == 0:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        if 'http.response.zerocopysend' in scope.get('extensions', {}):
+            with open(serve_path, 'rb') as f:
+                await send({'type': 'http.response.zerocopysend', 'file': f.fileno(), 'offset': start, 'count': length})
+            return
+        async with await anyio.open_file(serve_path, 'rb') as f:
+            await f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+            if remaining > 0:
+                await send({'type': 'http.response.body', 'body': b''})
+
+    async def _plain(self, send, status: int, body: bytes, headers=None):
+        hs = [(b'content-type', b'text/plain; charset=utf-8'), (b'content-length', str(len(body)).encode())]
+        hs.extend(h for h in (headers or []) if h[0] not in (b'content-type', b'content-length'))
+        await send({'type': 'http.response.start', 'status': status, 'headers': hs})
+        await send({'type': 'http.response.body', 'body': body})
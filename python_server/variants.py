@@ -0,0 +1,152 @@
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# 按需生成的响应式图片尺寸：/api/img/{photo_id}?w=&fmt= 首次请求时由 imaging 渲染，
+# 结果写入容量受限的磁盘 LRU 缓存（VARIANT_CACHE_DIR / VARIANT_CACHE_MAX_BYTES）。
+# 宽度与格式只允许白名单内的取值，避免任意尺寸把缓存撑爆。
+WIDTHS = (240, 320, 480, 640, 960, 1280, 1600, 2000)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', 78),
+    'jpeg': ('JPEG', 'image/jpeg', 82),
+}
+
+def srcset_widths():
+    raw = os.getenv('VARIANT_SRCSET_WIDTHS', '320,480,640,960,1280')
+    out = []
+    for part in raw.split(','):
+        part = part.strip()
+        if part.isdigit() and int(part) in WIDTHS:
+            out.append(int(part))
+    return out
+
+def source_tag(source_url: str):
+    # 源图地址变化（例如衍生图生成完成）时换一个 v，对应的 URL 可以长期缓存
+    return hashlib.sha1((source_url or '').encode('utf-8')).hexdigest()[:10]
+
+def spec(width: int, fmt: str):
+    pil_fmt, _, quality = FORMATS[fmt]
+    # 只限制宽度；高度给足余量，超长图仍按宽度缩放
+    return (width, width * 4, pil_fmt, quality)
+
+def media_type(fmt: str):
+    return FORMATS[fmt][1]
+
+def cache_name(photo_id: int, tag: str, width: int, fmt: str):
+    return f'{photo_id}-{tag}-{width}.{fmt}'
+
+def storage_keys(photo_id: int, source_urls):
+    # 写入对象存储的 variants/ 对象名：源图先后是原图与 processed 衍生图，两者对应的所有宽度与格式
+    tags = {source_tag(u) for u in source_urls if u}
+    return [f'variants/{cache_name(photo_id, tag, w, fmt)}' for tag in tags for w in WIDTHS for fmt in FORMATS]
+
+def variant_path(photo_id: int, tag: str, fmt: str = 'webp'):
+    return f'api/img/{photo_id}?fmt={fmt}&v={tag}'
+
+def srcset(photo_id: int, source_url: str, url_fn, fmt: str = 'webp'):
+    tag = source_tag(source_url)
+    base = url_fn(variant_path(photo_id, tag, fmt))
+    return ', '.join(f'{base}&w={w} {w}w' for w in srcset_widths())
+
+class DiskLRU:
+    # 文件即缓存项，内存里只维护 名称 -> 字节数 的访问顺序；启动时按 mtime 恢复顺序
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+        found = []
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name.startswith('.') or not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            found.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total += size
+        with self._lock:
+            self._evict()
+
+    def path(self, name: str):
+        return os.path.join(self.root, name)
+
+    def get(self, name: str):
+        # 直接返回内容而不是路径：返回后文件可能被并发的淘汰删掉，响应阶段再打开会失败
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+        try:
+            with open(self.path(name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            with self._lock:
+                size = self._entries.pop(name, None)
+                if size is not None:
+                    self._total -= size
+            return None
+
+    def put(self, name: str, data: bytes):
+        path = self.path(name)
+        tmp = os.path.join(self.root, f'.{name}.{threading.get_ident()}.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self._total -= old
+            self._entries[name] = len(data)
+            self._total += len(data)
+            self._evict(keep=name)
+
+    def _evict(self, keep: str = None):
+        while self._total > self.max_bytes and self._entries:
+            name, size = next(iter(self._entries.items()))
+            if name == keep:
+                break
+            self._entries.popitem(last=False)
+            self._total -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            # 默认放在系统临时目录，不写进仓库工作区
+            default_dir = os.path.join(tempfile.gettempdir(), 'personphoto-variants')
+            root = os.getenv('VARIANT_CACHE_DIR') or default_dir
+            max_bytes = int(os.getenv('VARIANT_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+            _cache = DiskLRU(root, max_bytes)
+        return _cache
+
+def r2_write_through():
+    return os.getenv('VARIANT_R2_WRITE', 'false').lower() in ('1', 'true', 'yes')